@@ -0,0 +1,56 @@
+# Compare per-key lookups (`db[key]`) to batched lookups (`db.get_many`)
+# of `odin.fuel.databases.MmapDict` and `SQLiteDict`
+#  python nosql_get_many.py 100000 1000000 10000000
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+from tempfile import mkstemp
+
+import numpy as np
+
+from odin.fuel.databases import MmapDict, SQLiteDict
+
+NB_KEYS = [int(i) for i in sys.argv[1:]] if len(sys.argv) > 1 else \
+    [10**5, 10**6, 10**7]
+# number of randomly queried keys
+NB_QUERY = 10**5
+BATCH_SIZE = 1024
+
+
+def create(cls, n):
+  fd, path = mkstemp(suffix='.db')
+  os.close(fd)
+  os.remove(path)
+  db = cls(path, cache_size=100000)
+  for i in range(n):
+    db['key%d' % i] = i
+  db.close()
+  return path
+
+
+def run(cls, n):
+  path = create(cls, n)
+  db = cls(path, read_only=True)
+  keys = ['key%d' % i for i in np.random.randint(0, n, size=NB_QUERY)]
+  # ====== per-key ====== #
+  start = time.time()
+  s1 = sum(db[k] for k in keys)
+  t1 = time.time() - start
+  # ====== batched ====== #
+  start = time.time()
+  s2 = sum(sum(db.get_many(keys[i:i + BATCH_SIZE]))
+           for i in range(0, len(keys), BATCH_SIZE))
+  t2 = time.time() - start
+  assert s1 == s2
+  db.close()
+  os.remove(path)
+  return t1, t2
+
+
+for n in NB_KEYS:
+  for cls in (MmapDict, SQLiteDict):
+    t1, t2 = run(cls, n)
+    print("%-10s #keys:%-9d per-key:%.2f(s) get_many:%.2f(s) speedup:%.2fx" %
+          (cls.__name__, n, t1, t2, t1 / t2))
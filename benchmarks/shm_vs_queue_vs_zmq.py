@@ -0,0 +1,56 @@
+# Compare the throughput of `odin.utils.mpi.MPI` backends for returning
+# large numpy.ndarray results (e.g. features matrices of long utterances)
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import numpy as np
+
+from odin.utils.mpi import MPI
+
+NB_JOBS = 240
+NCPU = 3
+# number of float32 elements in each returned array
+PAYLOAD_SIZES = [10**3, 10**4, 10**5, 10**6, 4 * 10**6]
+BACKENDS = ['python', 'pyzmq', 'shm']
+
+
+def make_func(size):
+
+  def map_func(idx):
+    return {'name': str(idx), 'X': np.full((size // 40, 40), idx, 'float32')}
+
+  return map_func
+
+
+def run(backend, size):
+  mpi = MPI(jobs=list(range(NB_JOBS)),
+            func=make_func(size),
+            ncpu=NCPU,
+            batch=1,
+            hwm=NCPU * 3,
+            backend=backend,
+            shm_size=max(16 * 1024 * 1024, size * 4 + 1024))
+  start = time.time()
+  checksum = 0
+  for r in mpi:
+    checksum += r['X'][0, 0]
+  duration = time.time() - start
+  assert checksum == sum(range(NB_JOBS))
+  return duration
+
+
+# ===========================================================================
+# Run the test
+# ===========================================================================
+if __name__ == "__main__":
+  print("%-10s" % "MB/result" + ''.join("%12s" % b for b in BACKENDS))
+  for size in PAYLOAD_SIZES:
+    text = "%-10.3f" % (size * 4 / 1024. / 1024.)
+    for backend in BACKENDS:
+      try:
+        duration = run(backend, size)
+        text += "%12s" % ("%.1f/s" % (NB_JOBS / duration))
+      except ImportError:  # pyzmq is not installed
+        text += "%12s" % "N/A"
+    print(text)
@@ -0,0 +1,108 @@
+# Compare the reference per-utterance inversion of the i-vector precision
+# matrices, and a single stacked `numpy.linalg.inv`, to the batched
+# Cholesky (LAPACK potrf/potri) inversion of `odin.ml.Tmatrix`
+#  python tmatrix_batched_posterior.py 400 600
+# NOTE: `T_invS_Tt` for tv_dim=600 and 2048 mixtures takes ~3GB of memory,
+# tv_dim=400 needs more than 6GB in total
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+
+import numpy as np
+from scipy import linalg
+
+from odin.ml.gmm_tmat import GMM, Tmatrix, _inverse_spd
+
+TV_DIMS = [int(i) for i in sys.argv[1:]] if len(sys.argv) > 1 else [400, 600]
+NMIX = 2048
+FEAT_DIM = 20
+NB_FILES = 256
+NB_INVERSE = 32
+
+
+def expectation_reference(tmat, Z, F):
+  L1 = np.dot(Z, tmat.T_invS_Tt)
+  B1 = np.dot(F, tmat.T_invS.T)
+  Ex = np.empty((Z.shape[0], tmat.tv_dim), dtype=tmat.dtype)
+  Exx = np.empty((Z.shape[0], tmat.t2_dim), dtype=tmat.dtype)
+  llk = np.empty((Z.shape[0], 1), dtype=tmat.dtype)
+  for ix in range(Z.shape[0]):
+    L = np.zeros((tmat.tv_dim, tmat.tv_dim), dtype=tmat.dtype)
+    L[tmat._itril] = L1[ix]
+    L = L + np.tril(L, k=-1).T + tmat.Im
+    Cxx = linalg.inv(L)
+    B = B1[ix][:, np.newaxis]
+    this_Ex = np.dot(Cxx, B)
+    Ex[ix] = this_Ex.T
+    llk[ix] = -0.5 * this_Ex.T.dot(B - this_Ex) + this_Ex.T.dot(B)
+    Exx[ix] = (Cxx + this_Ex.dot(this_Ex.T))[tmat._itril]
+  return np.dot(Z.T, Exx), np.dot(Ex.T, F), llk.sum()
+
+
+def precision_matrices(tmat, Z):
+  L = np.zeros((Z.shape[0], tmat.tv_dim, tmat.tv_dim), dtype=tmat.dtype)
+  L[(slice(None),) + tmat._itril] = np.dot(Z, tmat.T_invS_Tt)
+  return L + np.swapaxes(np.tril(L, k=-1), 1, 2) + tmat.Im
+
+
+def inverse_loop(L):
+  return np.stack([linalg.inv(l) for l in L])
+
+
+def inverse_stacked(L):
+  return np.linalg.inv(L)
+
+
+def cache_hit_rate(Z):
+  """ Hit rate of a posterior covariance cache keyed on the rows of `Z`,
+  within a single E-step (the T-matrix changes after every M-step) """
+  n_unique = len(set(z.tobytes() for z in Z))
+  return 1. - n_unique / Z.shape[0]
+
+
+def timing(f, *args, **kwargs):
+  start = time.time()
+  y = f(*args, **kwargs)
+  return y, time.time() - start
+
+
+rand = np.random.RandomState(8)
+gmm = GMM(nmix=NMIX, nmix_start=NMIX, device='cpu')
+gmm.initialize(rand.randn(NMIX, FEAT_DIM).astype('float32'))
+# zero-order statistics of utterances from 2 to 30 seconds
+Z = rand.dirichlet(np.ones(NMIX) * 0.1, size=NB_FILES) * \
+    rand.randint(200, 3000, size=(NB_FILES, 1))
+F = rand.randn(NB_FILES, NMIX * FEAT_DIM)
+# quantized zero-order statistics, only 16 distinct patterns
+Zq = np.round(Z[rand.randint(0, 16, size=NB_FILES)])
+# a cache keyed on the zero-order statistics could only hit on repeated
+# rows within one E-step: never for real-valued posterior sums, only for
+# artificially quantized statistics
+print("cache hit-rate of the zero-order statistics: real-valued:%.1f%% "
+      "quantized:%.1f%%" % (cache_hit_rate(Z) * 100,
+                            cache_hit_rate(Zq) * 100))
+for tv_dim in TV_DIMS:
+  tmat = Tmatrix(tv_dim=tv_dim, gmm=gmm, device='cpu', ncpu=1)
+  (LU_ref, RU_ref, llk_ref), t_ref = timing(expectation_reference, tmat, Z, F)
+  (LU, RU, llk, _), t_new = timing(tmat._fast_expectation, Z, F, on_gpu=False)
+  assert np.allclose(LU, LU_ref) and np.allclose(RU, RU_ref) and \
+      np.allclose(llk, llk_ref)
+  print("tv_dim:%d nmix:%d #files:%d reference:%.3f(s) batched:%.3f(s) "
+        "speedup:%.1fx" % (tv_dim, NMIX, NB_FILES, t_ref, t_new,
+                           t_ref / t_new))
+  del LU_ref, RU_ref, LU, RU
+  # only the inversion of the posterior precision matrices, for a subset of
+  # the files to keep the memory of the stacked copies bounded
+  Zi = Z[:NB_INVERSE]
+  L = precision_matrices(tmat, Zi)
+  Cxx_loop, t_loop = timing(inverse_loop, L)
+  Cxx_stacked, t_stacked = timing(inverse_stacked, L)
+  Cxx, t_chol = timing(_inverse_spd, L.copy())
+  assert np.allclose(Cxx, Cxx_loop) and np.allclose(Cxx, Cxx_stacked) and \
+      np.allclose(Cxx, tmat._inverse_precision(Zi))
+  print("  inversion #files:%d loop-inv:%.3f(s) stacked-inv:%.3f(s) "
+        "potri:%.3f(s) speedup-vs-stacked:%.1fx" %
+        (NB_INVERSE, t_loop, t_stacked, t_chol, t_stacked / t_chol))
+  del L, Cxx_loop, Cxx_stacked, Cxx
+  del tmat
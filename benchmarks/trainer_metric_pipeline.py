@@ -0,0 +1,55 @@
+# Throughput (steps/sec) of `Trainer.fit` for a small dense VAE on CPU,
+# checking NaN every iteration (i.e. a host sync every step as the previous
+# loop) versus the on-device accumulators read every `nan_check_freq` steps,
+# and running `steps_per_execution` steps in one call of the compiled function
+#  python trainer_metric_pipeline.py 2000
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import numpy as np
+import tensorflow as tf
+
+from odin.bay.random_variable import RVmeta
+from odin.bay.vi.autoencoder import VariationalAutoencoder
+from odin.networks import NetConf
+
+tf.random.set_seed(8)
+np.random.seed(8)
+
+MAX_ITER = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+BATCH_SIZE = 32
+X = (np.random.rand(20000, 64) > 0.5).astype('float32')
+X_VALID = (np.random.rand(2000, 64) > 0.5).astype('float32')
+
+
+def create_vae():
+  vae = VariationalAutoencoder(
+      observation=RVmeta(64, 'bernoulli', projection=True, name='x'),
+      encoder=NetConf([64, 64], name='encoder'),
+      decoder=NetConf([64, 64], name='decoder'),
+      latents=RVmeta(8, 'mvndiag', projection=True, name='latents'))
+  vae.build((None, 64))
+  return vae
+
+
+for nan_check_freq, steps_per_execution in ((1, 1), (100, 1), (100, 10),
+                                            (100, 50)):
+  vae = create_vae()
+  # warm-up, tracing the graph
+  vae.fit(X, valid=X_VALID, max_iter=2 * steps_per_execution + 1,
+          batch_size=BATCH_SIZE, nan_check_freq=nan_check_freq,
+          steps_per_execution=steps_per_execution, logging_interval=1e8)
+  start = time.time()
+  vae.fit(X, valid=X_VALID, max_iter=MAX_ITER, batch_size=BATCH_SIZE,
+          valid_freq=500, nan_check_freq=nan_check_freq,
+          steps_per_execution=steps_per_execution, logging_interval=3)
+  duration = time.time() - start
+  print("nan_check_freq:%d steps_per_execution:%d #iter:%d time:%.2f(s) "
+        "%.1f(steps/sec)" % (nan_check_freq, steps_per_execution, MAX_ITER,
+                             duration, MAX_ITER / duration))
@@ -0,0 +1,71 @@
+# Latents per second on CPU of the eager `VariationalAutoencoder.encode`
+# (batch by batch, returning distributions) versus the compiled and bucketed
+# `VariationalAutoencoder.infer_latents`, using variable batch sizes
+#  python vae_inference_throughput.py 20000
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import numpy as np
+import tensorflow as tf
+
+from odin.bay.random_variable import RVmeta
+from odin.bay.vi.autoencoder import VariationalAutoencoder
+from odin.networks import NetConf
+
+tf.random.set_seed(8)
+np.random.seed(8)
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+X = (np.random.rand(N, 64) > 0.5).astype('float32')
+# variable batch sizes, e.g. requests of a serving endpoint
+BATCH_SIZES = np.random.randint(1, 257, size=N // 64)
+
+vae = VariationalAutoencoder(
+    observation=RVmeta(64, 'bernoulli', projection=True, name='x'),
+    encoder=NetConf([256, 256], name='encoder'),
+    decoder=NetConf([256, 256], name='decoder'),
+    latents=RVmeta(16, 'mvndiag', projection=True, name='latents'))
+vae.build((None, 64))
+
+
+def eager_encode():
+  n, start = 0, 0
+  for size in BATCH_SIZES:
+    z = vae.encode(X[start:start + size], training=False).mean().numpy()
+    n += z.shape[0]
+    start = (start + size) % (N - 256)
+  return n
+
+
+def compiled_encode():
+  n, start = 0, 0
+  for size in BATCH_SIZES:
+    z = vae.infer_latents(X[start:start + size], statistics='mean')['mean']
+    n += z.shape[0]
+    start = (start + size) % (N - 256)
+  return n
+
+
+def all_at_once():
+  return vae.infer_latents(X, statistics='mean')['mean'].shape[0]
+
+
+# check the results and trace the buckets
+assert np.allclose(vae.encode(X[:100], training=False).mean().numpy(),
+                   vae.infer_latents(X[:100])['mean'], atol=1e-5)
+for size in 2**np.arange(9):
+  vae.infer_latents(X[:size])
+for name, fn in [('eager encode', eager_encode),
+                 ('infer_latents', compiled_encode),
+                 ('infer_latents (single call)', all_at_once)]:
+  start = time.time()
+  n = fn()
+  duration = time.time() - start
+  print("%-28s #latents:%d time:%.2f(s) %.1f(latents/sec)" %
+        (name, n, duration, n / duration))
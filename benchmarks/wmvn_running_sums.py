@@ -0,0 +1,83 @@
+# Compare the reference frame-by-frame windowed mean-variance normalization
+# to the running-sums implementation `odin.preprocessing.signal.wmvn`
+#  python wmvn_running_sums.py 1000 10000 100000 1000000
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+
+import numpy as np
+
+from odin.preprocessing.signal import mvn, wmvn
+
+NB_FRAMES = [int(i) for i in sys.argv[1:]] if len(sys.argv) > 1 else \
+    [10**3, 10**4, 10**5, 10**6]
+NB_FEATS = 60
+WINDOW = 301
+# the reference implementation is too slow for very long utterances
+MAX_REFERENCE_FRAMES = 10**5
+
+_fnorm1 = lambda x, x_stat, keepdims: x - x_stat.mean(axis=0,
+                                                      keepdims=keepdims)
+_fnorm2 = lambda x, x_stat, keepdims: (
+    (x - x_stat.mean(axis=0, keepdims=keepdims)) /
+    (x_stat.std(axis=0, keepdims=keepdims) + 1e-18))
+
+
+def wmvn_reference(x, w=301, varnorm=True, indices=None):
+  nobs, ndim = x.shape
+  # same fallback as the library for utterances shorter than the window
+  if nobs < w:
+    return mvn(x, varnorm=varnorm, indices=indices)
+  fnorm = _fnorm2 if varnorm else _fnorm1
+  hlen = int((w - 1) / 2)
+  y = np.zeros((nobs, ndim), dtype=x.dtype)
+  x_stat = x[:w] if indices is None else x[:w][indices[:w]]
+  y[:hlen] = fnorm(x[:hlen], x_stat, True)
+  for ix in range(hlen, nobs - hlen):
+    if indices is None:
+      x_stat = x[ix - hlen:ix + hlen + 1]
+    else:
+      sad = indices[ix - hlen:ix + hlen + 1]
+      x_stat = x[ix - hlen:ix + hlen + 1][sad]
+    y[ix] = fnorm(x[ix], x_stat, False)
+  x_stat = x[nobs - w:] if indices is None else x[nobs - w:][indices[nobs - w:]]
+  y[nobs - hlen:nobs] = fnorm(x[nobs - hlen:nobs], x_stat, True)
+  return y
+
+
+def timing(f, *args, **kwargs):
+  start = time.time()
+  y = f(*args, **kwargs)
+  return y, time.time() - start
+
+
+rand = np.random.RandomState(8)
+for n in NB_FRAMES:
+  x = rand.randn(n, NB_FEATS).astype('float32') * 3 + 12
+  # speech segments of 0.5-5 seconds separated by silences
+  sad = np.repeat(np.arange(n // 50 + 1) % 3 != 0,
+                  50)[:n] & (rand.rand(n) > 0.05)
+  for varnorm in (False, True):
+    y_new, t_new = timing(wmvn, x, w=WINDOW, varnorm=varnorm, indices=sad)
+    if n <= MAX_REFERENCE_FRAMES:
+      y_ref, t_ref = timing(wmvn_reference,
+                            x,
+                            w=WINDOW,
+                            varnorm=varnorm,
+                            indices=sad)
+      # an utterance without any speech frame is normalized to nan by both
+      assert np.allclose(y_ref, y_new, rtol=1e-3, atol=1e-3, equal_nan=True)
+    else:
+      t_ref = np.nan
+    print("#frames:%-8d varnorm:%-5s reference:%.3f(s) running-sums:%.3f(s) "
+          "speedup:%.1fx" % (n, varnorm, t_ref, t_new, t_ref / t_new))
+  # a batch of utterances with the same length
+  nb = int(np.clip(10**6 // n, 1, 16))
+  yb, t_batch = timing(wmvn,
+                       np.stack([x] * nb),
+                       w=WINDOW,
+                       varnorm=True,
+                       indices=np.stack([sad] * nb))
+  assert np.allclose(yb[-1], y_new, rtol=1e-5, atol=1e-5, equal_nan=True)
+  print("#frames:%-8d batch:%-2d running-sums:%.3f(s)" % (n, nb, t_batch))
@@ -657,6 +657,218 @@ def det_curve(y_true, y_score, pos_label=None, sample_weight=None):
   return Pfa, Pmiss
 
 
+class DetectionEvaluator(object):
+  """ Streaming evaluation of a binary detection task (e.g. speaker
+  verification trials), the scores are accumulated chunk-by-chunk with
+  `update`, then EER, minDCF at several operating points and DET points
+  are computed together by `compute`.
+
+  Following `det_curve`, a trial is accepted if its score is greater
+  than the threshold.
+
+  Parameters
+  ----------
+  approximate : bool (default: False)
+      if False, the target and non-target scores are stored (no copy of
+      the labels), then each is sorted once and the curves are evaluated
+      by binary search of the target scores into the non-target scores.
+      if True, only the histograms of target and non-target scores
+      are accumulated, the memory is bounded by `n_bins`, and the error
+      rates are quantized to the bin edges.
+  n_bins : int (default: 65536)
+      number of histogram bins for approximate mode
+  score_range : {None, tuple of (min, max)}
+      the histogram range for approximate mode, scores outside the given
+      range are counted in the outermost bins. If None, inferred from the
+      first chunk with 10% margin on both sides, then doubled (merging
+      pairs of bins) whenever a later chunk has scores outside the range
+
+  Example
+  -------
+  >>> evaluator = DetectionEvaluator()
+  >>> for y_true, y_score in chunks:
+  ...   evaluator.update(y_true, y_score)
+  >>> results = evaluator.compute(operating_points=[(1, 1, 0.01)])
+  >>> results['EER'], results['minDCF']
+  """
+
+  def __init__(self, approximate=False, n_bins=2**16, score_range=None):
+    super(DetectionEvaluator, self).__init__()
+    self.approximate = bool(approximate)
+    self.n_bins = int(n_bins)
+    self._given_range = None if score_range is None else \
+        (float(score_range[0]), float(score_range[1]))
+    self.reset()
+
+  def reset(self):
+    self.score_range = self._given_range
+    self._target = []
+    self._nontarget = []
+    self._target_hist = np.zeros((self.n_bins,), dtype='int64')
+    self._nontarget_hist = np.zeros((self.n_bins,), dtype='int64')
+    self._edges = None
+    return self
+
+  @property
+  def n_target(self):
+    if self.approximate:
+      return int(self._target_hist.sum())
+    return sum(len(i) for i in self._target)
+
+  @property
+  def n_nontarget(self):
+    if self.approximate:
+      return int(self._nontarget_hist.sum())
+    return sum(len(i) for i in self._nontarget)
+
+  def update(self, y_true, y_score, pos_label=1):
+    """ Add a chunk of trials
+
+    Parameters
+    ----------
+    y_true : array, shape = [n_samples]
+        binary labels of the trials
+    y_score : array, shape = [n_samples]
+        scores of the trials, the more positive the score, the more
+        likely is the target hypothesis
+    """
+    y_score = np.ravel(y_score)
+    is_target = np.ravel(y_true) == pos_label
+    if is_target.shape[0] != y_score.shape[0]:
+      raise ValueError("Provided %d labels but %d scores" %
+                       (is_target.shape[0], y_score.shape[0]))
+    # ====== exact ====== #
+    if not self.approximate:
+      self._target.append(y_score[is_target])
+      self._nontarget.append(y_score[~is_target])
+      return self
+    # ====== histogram ====== #
+    finite = y_score[np.isfinite(y_score)]
+    if self._edges is None:
+      if self.score_range is None:
+        if y_score.shape[0] == 0:
+          return self
+        smin, smax = (float(np.min(finite)), float(np.max(finite))) \
+            if finite.shape[0] > 0 else (0., 0.)
+        margin = 0.1 * max(smax - smin, 1e-8)
+        self.score_range = (smin - margin, smax + margin)
+      self._edges = np.linspace(self.score_range[0], self.score_range[1],
+                                self.n_bins + 1)
+    elif self._given_range is None and finite.shape[0] > 0:
+      self._widen(float(np.min(finite)), float(np.max(finite)))
+    bins = np.clip(np.searchsorted(self._edges, y_score, side='left') - 1,
+                   0, self.n_bins - 1)
+    self._target_hist += np.bincount(bins[is_target],
+                                     minlength=self.n_bins)
+    self._nontarget_hist += np.bincount(bins[~is_target],
+                                        minlength=self.n_bins)
+    return self
+
+  def _widen(self, smin, smax):
+    """ Double the histogram range until it covers `[smin, smax]`, each
+    new bin is the union of two old bins so the counts are not
+    redistributed, only the resolution is halved """
+    lo, hi = self.score_range
+    while smin < lo or smax > hi:
+      # the old bins are shifted by `n_bins` when extending to the left
+      offset = self.n_bins if smin < lo else 0
+      lo, hi = (lo - (hi - lo), hi) if smin < lo else (lo, hi + (hi - lo))
+      index = (np.arange(self.n_bins) + offset) // 2
+      for name in ('_target_hist', '_nontarget_hist'):
+        hist = np.zeros((self.n_bins,), dtype='int64')
+        np.add.at(hist, index, getattr(self, name))
+        setattr(self, name, hist)
+    if (lo, hi) != self.score_range:
+      self.score_range = (lo, hi)
+      self._edges = np.linspace(lo, hi, self.n_bins + 1)
+
+  def _exact_curves(self, n_det_points):
+    target = np.concatenate(self._target) if len(self._target) > 0 else \
+        np.empty((0,))
+    nontarget = np.concatenate(self._nontarget) \
+        if len(self._nontarget) > 0 else np.empty((0,))
+    target.sort()
+    nontarget.sort()
+    n_tgt, n_non = float(len(target)), float(len(nontarget))
+
+    def rates(thresholds):
+      Pmiss = np.searchsorted(target, thresholds, side='right') / n_tgt
+      Pfa = 1. - np.searchsorted(nontarget, thresholds, side='right') / n_non
+      return Pfa, Pmiss
+
+    # ====== minDCF: for thresholds between two consecutive target
+    # scores, Pmiss is constant, hence, the minimum is right below the
+    # next target score ====== #
+    Pmiss_dcf = np.arange(0, len(target) + 1) / n_tgt
+    Pfa_dcf = 1. - np.searchsorted(
+        nontarget, np.append(target, np.inf), side='left') / n_non
+    # ====== EER: Pmiss - Pfa is increasing with the threshold, refine
+    # the curve within the two target scores around the crossing ====== #
+    Pfa, Pmiss = rates(target)
+    k = np.searchsorted(Pmiss - Pfa, 0., side='left')
+    lo = target[k - 1] if k > 0 else -np.inf
+    hi = target[k] if k < len(target) else np.inf
+    local = nontarget[np.searchsorted(nontarget, lo, side='right'):
+                      np.searchsorted(nontarget, hi, side='left')]
+    # -inf accepts all trials, so there is always a point with Pmiss < Pfa
+    Pfa_eer, Pmiss_eer = rates(np.concatenate([[-np.inf, lo], local, [hi]]))
+    # ====== DET points at the quantiles of both classes ====== #
+    thresholds = np.unique(np.concatenate([
+        target[np.linspace(0, len(target) - 1, n_det_points, dtype='int64')],
+        nontarget[np.linspace(0, len(nontarget) - 1, n_det_points,
+                              dtype='int64')]
+    ]))
+    Pfa_det, Pmiss_det = rates(thresholds)
+    return (Pfa_dcf, Pmiss_dcf), (Pfa_eer, Pmiss_eer), \
+        (Pfa_det, Pmiss_det, thresholds)
+
+  def _approximate_curves(self):
+    Pmiss = np.cumsum(self._target_hist) / float(self._target_hist.sum())
+    Pfa = 1. - np.cumsum(self._nontarget_hist) / \
+        float(self._nontarget_hist.sum())
+    # include the point accepting all trials
+    Pmiss = np.append(0., Pmiss)
+    Pfa = np.append(1., Pfa)
+    return Pfa, Pmiss, self._edges
+
+  def compute(self, operating_points=((1., 1., 0.01),), n_det_points=1000):
+    """
+    Parameters
+    ----------
+    operating_points : list of tuple (Cmiss, Cfa, Ptrue)
+        the operating points for `compute_minDCF`
+    n_det_points : int
+        the maximum number of DET points from each class in exact mode
+
+    Return
+    ------
+    dictionary of:
+      'EER' : scalar
+      'minDCF' : list of (min_DCF, Pfa_optimum, Pmiss_optimum) for each
+        operating point
+      'Pfa', 'Pmiss', 'thresholds' : the DET points
+    """
+    if self.n_target == 0 or self.n_nontarget == 0:
+      raise RuntimeError("Both target and non-target trials are required, "
+                         "given %d target and %d non-target trials" %
+                         (self.n_target, self.n_nontarget))
+    if self.approximate:
+      Pfa, Pmiss, thresholds = self._approximate_curves()
+      dcf = eer = (Pfa, Pmiss)
+    else:
+      dcf, eer, (Pfa, Pmiss, thresholds) = \
+          self._exact_curves(max(2, int(n_det_points)))
+    minDCF = [
+        compute_minDCF(dcf[0], dcf[1], Cmiss=Cmiss, Cfa=Cfa, Ptrue=Ptrue)
+        for Cmiss, Cfa, Ptrue in operating_points
+    ]
+    return dict(EER=compute_EER(eer[0], eer[1]),
+                minDCF=minDCF,
+                Pfa=Pfa,
+                Pmiss=Pmiss,
+                thresholds=thresholds)
+
+
 # ===========================================================================
 # Distance measurement
 # ===========================================================================
@@ -1,11 +1,13 @@
 from __future__ import absolute_import, division, print_function
 
+import contextlib
 import copy
 import glob
 import inspect
 import os
 import pickle
 import warnings
+from collections import defaultdict
 from dataclasses import dataclass
 from functools import partial
 from itertools import zip_longest
@@ -35,6 +37,7 @@ from tensorflow.python.keras.layers import Layer
 from tensorflow.python.keras.optimizer_v2.optimizer_v2 import OptimizerV2
 from tensorflow.python.ops.summary_ops_v2 import SummaryWriter
 from tensorflow.python.platform import tf_logging as logging
+from tensorflow.python.training.tracking import base as trackable
 from tensorflow_probability.python import distributions as tfd
 from tensorflow_probability.python import layers as tfl
 from tensorflow_probability.python.distributions import Distribution
@@ -105,6 +108,18 @@ def _parse_layers(network, is_decoding=False, name=None) -> Layer:
   return layer
 
 
+def _logsumexp_update(state: Tuple[Tensor, Tensor],
+                      x: Tensor) -> Tuple[Tensor, Tensor]:
+  r""" Running log-sum-exp along the first axis of `x`, `state` is the pair
+  `(max, sum(exp(x - max)))`, the final value is `max + log(sum)` """
+  m, s = state
+  m_new = tf.maximum(m, tf.reduce_max(x, axis=0))
+  # all values are -inf so far
+  m_new = tf.where(tf.math.is_finite(m_new), m_new, tf.zeros_like(m_new))
+  s = s * tf.exp(m - m_new) + tf.reduce_sum(tf.exp(x - m_new), axis=0)
+  return m_new, s
+
+
 def _iter_lists(X, Y):
   r""" Try to match the length of list-Y to list-X,
   the yield a pair of (x, y) with the condition x is not None """
@@ -235,6 +250,12 @@ class VariationalAutoencoder(VariationalModel):
     else:
       self._observation = _parse_layers(network=observation, name="observation")
       self._observation_args = _get_args(self.observation)
+    # keyword arguments of `encode` and `decode`, for splitting the kwargs
+    # given to `call`
+    spec = inspect.getfullargspec(self.encode)
+    self._encode_func_args = set(spec.args + spec.kwonlyargs)
+    spec = inspect.getfullargspec(self.decode)
+    self._decode_func_args = set(spec.args + spec.kwonlyargs)
 
   @property
   def encoder(self) -> Layer:
@@ -490,7 +511,7 @@ class VariationalAutoencoder(VariationalModel):
       llk_pz = pz.log_prob(z)
       llk_qz_x = qz.log_prob(z)
       llk.append(llk_pz)
-      llk.append(llk_qz_x)
+      llk.append(-llk_qz_x)
     # sum all llk
     iw_const = tf.math.log(tf.cast(tf.reduce_prod(sample_shape), self.dtype))
     mllk = 0.
@@ -503,6 +524,184 @@ class VariationalAutoencoder(VariationalModel):
     }
     return mllk, distortion
 
+  @contextlib.contextmanager
+  def _override_sample_shape(self, sample_shape):
+    r""" Temporary change the `sample_shape` used by `decode` for reshaping
+    the latents, only affects the functions traced within the context """
+    org_sample_shape = self._sample_shape
+    self._sample_shape = sample_shape
+    try:
+      yield self
+    finally:
+      self._sample_shape = org_sample_shape
+
+  def _importance_log_weights(self, qz_x, inputs, n_samples, training, mask,
+                              **kwargs):
+    r""" Log importance weights `log p(x|z) + log p(z) - log q(z|x)` and the
+    distortions for `n_samples` samples of `z`, shape `[n_samples, batch]` """
+    z = tf.nest.map_structure(lambda qz: qz.sample(n_samples), qz_x)
+    # decode the chunk of samples as the `sample_shape` of the model
+    with self._override_sample_shape(n_samples):
+      px_z = self.decode(z, training=training, mask=mask, **kwargs)
+    log_w = 0.
+    distortion = {}
+    for px, x in zip(as_tuple(px_z), as_tuple(inputs)):
+      x_llk = px.log_prob(x)
+      log_w += x_llk
+      distortion[px.name.split('_')[0]] = x_llk
+    for qz, z_i in zip(tf.nest.flatten(qz_x), tf.nest.flatten(z)):
+      if isinstance(qz, (tfd.Deterministic, tfd.VectorDeterministic)):
+        continue
+      pz = qz.KL_divergence.prior
+      if pz is None:
+        pz = tfd.Normal(loc=tf.zeros(qz.event_shape, dtype=z_i.dtype),
+                        scale=tf.ones(qz.event_shape, dtype=z_i.dtype),
+                        name='pz')
+      log_w += pz.log_prob(z_i) - qz.log_prob(z_i)
+    return log_w, distortion
+
+  @tf.function(autograph=False)
+  def chunked_marginal_log_prob(self,
+                                inputs: Union[TensorTypes, List[TensorTypes]],
+                                n_samples: int = 1000,
+                                chunk_size: int = 100,
+                                training: Optional[bool] = None,
+                                mask: Optional[Tensor] = None,
+                                **kwargs) -> Tuple[Tensor, Dict[str, Tensor]]:
+    """Importance weighted estimation of the marginal log-likelihood
+    `log(p(X))` (IWAE bound), the `n_samples` are drawn in chunks of
+    `chunk_size` and combined by a running log-sum-exp, so the memory is
+    constant regardless of the number of samples.
+
+    The same restrictions on the prior as `marginal_log_prob` apply.
+
+    Parameters
+    ----------
+    inputs : TensorTypes
+        inputs' Tensors
+    n_samples : int, optional
+        total number of importance samples, by default 1000
+    chunk_size : int, optional
+        number of samples evaluated at once, by default 100
+    training : Optional[bool], optional
+        training or evaluation mode, by default None
+    mask : Optional[Tensor], optional
+        mask Tensor, by default None
+
+    Returns
+    -------
+    Tuple[Tensor, Dict[str, Tensor]]
+      marginal log-likelihood : a Tensor of shape `[batch_size]`
+      distortion : a Dictionary mapping from distribution name to Tensor
+        of shape `[batch_size]`, the importance weighted log-likelihood.
+
+    Reference
+    ---------
+      Yuri Burda, Roger Grosse, Ruslan Salakhutdinov. Importance Weighted
+        Autoencoders. In ICLR, 2015. https://arxiv.org/abs/1509.00519
+    """
+    n_samples = int(n_samples)
+    chunk_size = max(1, min(int(chunk_size), n_samples))
+    n_chunks, remain = divmod(n_samples, chunk_size)
+    qz_x = self.encode(
+        inputs,
+        training=training,
+        mask=mask,
+        **{k: v for k, v in kwargs.items() if k in self._encode_func_args})
+    for qz in as_tuple(qz_x):
+      if hasattr(qz, '_keras_mask') and qz._keras_mask is not None:
+        mask = qz._keras_mask
+        break
+    decode_kw = {k: v for k, v in kwargs.items() if k in self._decode_func_args}
+    log_weights = partial(self._importance_log_weights,
+                          qz_x,
+                          inputs,
+                          training=training,
+                          mask=mask,
+                          **decode_kw)
+    # the first chunk gives the shapes of the running states
+    log_w, distortion = log_weights(chunk_size)
+    init = lambda x: _logsumexp_update(
+        (tf.fill(tf.shape(x)[1:], tf.constant(-np.inf, x.dtype)),
+         tf.zeros(tf.shape(x)[1:], x.dtype)), x)
+    states = (init(log_w), {k: init(v) for k, v in distortion.items()})
+
+    def body(i, states):
+      log_w, distortion = log_weights(chunk_size)
+      return i + 1, (_logsumexp_update(states[0], log_w), {
+          k: _logsumexp_update(states[1][k], v) for k, v in distortion.items()
+      })
+
+    _, states = tf.while_loop(lambda i, states: i < n_chunks,
+                              body,
+                              loop_vars=(tf.constant(1), states),
+                              parallel_iterations=1)
+    if remain > 0:
+      log_w, distortion = log_weights(remain)
+      states = (_logsumexp_update(states[0], log_w), {
+          k: _logsumexp_update(states[1][k], v) for k, v in distortion.items()
+      })
+    # log(mean(exp(log_w)))
+    reduce = lambda m, s: m + tf.math.log(s) - tf.math.log(
+        tf.cast(n_samples, s.dtype))
+    mllk = reduce(*states[0])
+    distortion = {k: reduce(*v) for k, v in states[1].items()}
+    return mllk, distortion
+
+  def evaluate_marginal_log_prob(self,
+                                 dataset: Union[TensorTypes, DatasetV2],
+                                 n_samples: int = 1000,
+                                 chunk_size: int = 100,
+                                 batch_size: int = 32,
+                                 verbose: bool = True
+                                ) -> Tuple[float, Dict[str, float]]:
+    """Dataset-level importance weighted marginal log-likelihood (e.g. the
+    test-set LLK with 5000 samples), the batches are evaluated by
+    `chunked_marginal_log_prob` and averaged with streaming sums.
+
+    Parameters
+    ----------
+    dataset : Union[TensorTypes, DatasetV2]
+        `tf.data.Dataset` of mini-batches or the data which will be batched
+        by `batch_size`
+    n_samples : int, optional
+        total number of importance samples, by default 1000
+    chunk_size : int, optional
+        number of samples evaluated at once, by default 100
+    batch_size : int, optional
+        only used when `dataset` is not a `tf.data.Dataset`, by default 32
+    verbose : bool, optional
+        show the progress bar, by default True
+
+    Returns
+    -------
+    Tuple[float, Dict[str, float]]
+      the average marginal log-likelihood and distortions over all examples
+    """
+    from tqdm import tqdm
+    if not isinstance(dataset, DatasetV2):
+      dataset = tf.data.Dataset.from_tensor_slices(dataset).batch(
+          int(batch_size))
+    total_llk = 0.
+    total_distortion = {}
+    n = 0
+    for inputs in tqdm(dataset, desc='Marginal LLK', disable=not verbose):
+      if isinstance(inputs, dict):
+        mllk, distortion = self.chunked_marginal_log_prob(
+            n_samples=n_samples, chunk_size=chunk_size, training=False,
+            **inputs)
+      else:
+        mllk, distortion = self.chunked_marginal_log_prob(
+            inputs, n_samples=n_samples, chunk_size=chunk_size,
+            training=False)
+      n += int(mllk.shape[0])
+      total_llk += float(tf.reduce_sum(tf.cast(mllk, tf.float64)))
+      for k, v in distortion.items():
+        total_distortion[k] = total_distortion.get(k, 0.) + \
+          float(tf.reduce_sum(tf.cast(v, tf.float64)))
+    n = max(n, 1)
+    return total_llk / n, {k: v / n for k, v in total_distortion.items()}
+
   def elbo_components(
       self,
       inputs: Union[TensorTypes, List[TensorTypes]],
@@ -532,6 +731,117 @@ class VariationalAutoencoder(VariationalModel):
         kl[f'kl_{z.name}'] = tf.constant(0., dtype=self.dtype)
     return llk, kl
 
+  ################## For inference
+  def _inference_function(self, method: str, statistics: Tuple[str, ...],
+                          n_samples: int) -> Callable:
+    key = (method, statistics, n_samples)
+    if not hasattr(self, '_inference_functions'):
+      with trackable.no_automatic_dependency_tracking_scope(self):
+        self._inference_functions = dict()
+    if key in self._inference_functions:
+      return self._inference_functions[key]
+
+    def fn(inputs):
+      if method == 'encode':
+        dists = self.encode(inputs, training=False)
+      else:  # the latents have no sample dimensions
+        with self._override_sample_shape(()):
+          dists = self.decode(inputs, training=False)
+      outputs = {}
+      for name in statistics:
+        if name == 'sample':
+          stat = lambda d: d.sample(n_samples)
+        else:
+          stat = lambda d: getattr(d, name)()
+        outputs[name] = tf.nest.map_structure(stat, dists)
+      return outputs
+
+    fn = tf.function(fn, autograph=False)
+    with trackable.no_automatic_dependency_tracking_scope(self):
+      self._inference_functions[key] = fn
+    return fn
+
+  def _batched_inference(self, method, inputs, statistics, n_samples,
+                         batch_size) -> Dict[str, Any]:
+    statistics = tuple(as_tuple(statistics, t=str))
+    for name in statistics:
+      if name not in ('mean', 'stddev', 'variance', 'mode', 'sample'):
+        raise ValueError(f"No support for statistic '{name}', only: "
+                         "'mean', 'stddev', 'variance', 'mode' or 'sample'")
+    fn = self._inference_function(method, statistics, int(n_samples))
+    batch_size = int(batch_size)
+    n = int(tf.nest.flatten(inputs)[0].shape[0])
+    outputs = defaultdict(list)
+    for start in range(0, n, batch_size):
+      x = tf.nest.map_structure(
+          lambda a: tf.convert_to_tensor(a[start:start + batch_size],
+                                         dtype_hint=self.dtype), inputs)
+      size = int(tf.nest.flatten(x)[0].shape[0])
+      # pad to the next power of 2, so variable batch sizes only trace
+      # `log2(batch_size)` graphs
+      bucket = min(batch_size, 2**int(np.ceil(np.log2(size))))
+      if bucket > size:
+        x = tf.nest.map_structure(
+            lambda a: tf.concat(
+                [a, tf.repeat(a[-1:], bucket - size, axis=0)], axis=0), x)
+      for name, y in fn(x).items():
+        # the samples have the sample dimension first
+        axis = 1 if name == 'sample' else 0
+        outputs[name].append(
+            tf.nest.map_structure(
+                lambda t: tf.gather(t, tf.range(size), axis=axis).numpy(),
+                y))
+    return {
+        name: tf.nest.map_structure(
+            lambda *t: np.concatenate(t, axis=1 if name == 'sample' else 0),
+            *y) for name, y in outputs.items()
+    }
+
+  def infer_latents(self,
+                    inputs: Union[TensorTypes, List[TensorTypes]],
+                    statistics: Union[str, List[str]] = 'mean',
+                    n_samples: int = 1,
+                    batch_size: int = 256) -> Dict[str, Any]:
+    """Compiled and batched inference of the latents statistics, return only
+    the requested statistics as `numpy.ndarray` instead of the distributions
+    returned by `encode`.
+
+    The encoding is traced once for each bucket of batch size (powers of 2
+    up to `batch_size`), the last incomplete batch is padded to its bucket.
+
+    Parameters
+    ----------
+    inputs : Union[TensorTypes, List[TensorTypes]]
+        inputs' Tensors, the first dimension is the number of examples
+    statistics : Union[str, List[str]], optional
+        {'mean', 'stddev', 'variance', 'mode', 'sample'}, by default 'mean'
+    n_samples : int, optional
+        number of samples, only for 'sample', by default 1
+    batch_size : int, optional
+        number of examples for each call of the compiled function,
+        by default 256
+
+    Returns
+    -------
+    Dict[str, Any]
+        mapping from statistic name to `numpy.ndarray` of shape
+        `[n_examples, ...]` (or `[n_samples, n_examples, ...]` for 'sample'),
+        a list of arrays for multiple latents
+    """
+    return self._batched_inference('encode', inputs, statistics, n_samples,
+                                   batch_size)
+
+  def infer_outputs(self,
+                    latents: Union[TensorTypes, List[TensorTypes]],
+                    statistics: Union[str, List[str]] = 'mean',
+                    n_samples: int = 1,
+                    batch_size: int = 256) -> Dict[str, Any]:
+    """Compiled and batched decoding of latent codes (e.g. the 'mean'
+    returned by `infer_latents`), see `infer_latents` for the arguments and
+    returns """
+    return self._batched_inference('decode', latents, statistics, n_samples,
+                                   batch_size)
+
   ################## For training
   def train_steps(self,
                   inputs: TensorTypes,
@@ -28,7 +28,7 @@ import tensorflow as tf
 from odin.utils import fifodict
 from odin.bay.vi.downstream_metrics import *
 from odin.utils import catch_warnings_ignore
-from odin.utils.mpi import MPI, get_cpu_count
+from odin.utils.mpi import MPI, WorkerPool, get_cpu_count
 from sklearn.cluster import KMeans
 from sklearn.linear_model import Lasso
 from sklearn.metrics import adjusted_mutual_info_score, adjusted_rand_score
@@ -208,12 +208,29 @@ def _clustering_scores(y, X=None, z=None, algo='kmeans', random_state=1):
     )
 
 
+def _factor_clustering_scores(idx, factors, factor_type, representations,
+                              predictions, algorithm, random_state):
+  y = factors[:, idx]
+  if factor_type == 'multinomial':
+    uni = {v: i for i, v in enumerate(sorted(np.unique(y)))}
+    y = np.array([uni[i] for i in y])
+  else:
+    y = y.astype(np.int32)
+  return _clustering_scores(X=representations,
+                            z=predictions,
+                            y=y,
+                            algo=algorithm,
+                            random_state=random_state)
+
+
 def unsupervised_clustering_scores(factors: np.ndarray,
                                    representations: Optional[np.ndarray] = None,
                                    predictions: Optional[np.ndarray] = None,
                                    algorithm: str = 'both',
                                    random_state: int = 1,
                                    n_cpu: int = 1,
+                                   pool: Optional[Union[bool,
+                                                        WorkerPool]] = None,
                                    verbose: bool = True) -> Dict[str, float]:
   """ Calculating the unsupervised clustering Scores:
 
@@ -247,6 +264,8 @@ def unsupervised_clustering_scores(factors: np.ndarray,
       Categorical factors (i.e. one-hot encoded), or multiple factors.
     algorithm : {'kmeans', 'gmm', 'both'}.
       The clustering algorithm for assigning the cluster from representations
+    pool : {None, True, WorkerPool}.
+      reuse a persistent `odin.utils.mpi.WorkerPool` for `n_cpu > 1`
 
   Return:
     Dict mapping score alias to its scalar value
@@ -276,20 +295,13 @@ def unsupervised_clustering_scores(factors: np.ndarray,
                               algo=algorithm,
                               random_state=random_state)
   if factor_type in ('multinomial', 'multibinary'):
-
-    def _get_scores(idx):
-      y = factors[:, idx]
-      if factor_type == 'multinomial':
-        uni = {v: i for i, v in enumerate(sorted(np.unique(y)))}
-        y = np.array([uni[i] for i in y])
-      else:
-        y = y.astype(np.int32)
-      return _clustering_scores(X=representations,
-                                z=predictions,
-                                y=y,
-                                algo=algorithm,
-                                random_state=random_state)
-
+    _get_scores = partial(_factor_clustering_scores,
+                          factors=factors,
+                          factor_type=factor_type,
+                          representations=representations,
+                          predictions=predictions,
+                          algorithm=algorithm,
+                          random_state=random_state)
     scores = defaultdict(list)
     if factors.shape[1] == 1:
       verbose = False
@@ -302,7 +314,8 @@ def unsupervised_clustering_scores(factors: np.ndarray,
       it = MPI(jobs=list(range(factors.shape[1])),
                func=_get_scores,
                batch=1,
-               ncpu=n_cpu)
+               ncpu=n_cpu,
+               pool=pool)
     for s in it:
       prog.update(1)
       for k, v in s.items():
@@ -360,6 +373,21 @@ def discrete_entropy(labels):
   return h
 
 
+def _mutual_info_factor(idx, representations, factors,
+                        continuous_representations, continuous_factors,
+                        n_neighbors, seed):
+  from sklearn.feature_selection import (mutual_info_classif,
+                                         mutual_info_regression)
+  mutual_info = mutual_info_regression if continuous_factors else \
+    mutual_info_classif
+  mi = mutual_info(representations,
+                   factors[:, idx],
+                   discrete_features=not continuous_representations,
+                   n_neighbors=n_neighbors,
+                   random_state=seed)
+  return idx, mi
+
+
 def mutual_info_estimate(
     representations: np.ndarray,
     factors: np.ndarray,
@@ -370,12 +398,16 @@ def mutual_info_estimate(
     seed: int = 1,
     verbose: bool = False,
     cache_key: Optional[str] = None,
+    pool: Optional[Union[bool, WorkerPool]] = None,
 ) -> np.ndarray:
   r""" Nonparametric method for estimating entropy from k-nearest neighbors
   distances (note: this implementation use multi-processing)
 
   Parameters
   -----------
+  pool : {None, True, WorkerPool}
+    reuse a persistent `odin.utils.mpi.WorkerPool` (`True` for the shared
+    pool) instead of forking new processes when `n_cpu > 1`
 
   Return
   --------
@@ -393,30 +425,26 @@ def mutual_info_estimate(
   """
   if cache_key is not None and cache_key in _cached_mi_matrix:
     return _cached_mi_matrix[cache_key]
-  from sklearn.feature_selection import (mutual_info_classif,
-                                         mutual_info_regression)
-  mutual_info = mutual_info_regression if continuous_factors else \
-    mutual_info_classif
   num_latents = representations.shape[1]
   num_factors = factors.shape[1]
   # iterate over each factor
   mi_matrix = np.empty(shape=(num_latents, num_factors), dtype=np.float64)
 
   # repeat for each factor
-  def func(idx):
-    mi = mutual_info(representations,
-                     factors[:, idx],
-                     discrete_features=not continuous_representations,
-                     n_neighbors=n_neighbors,
-                     random_state=seed)
-    return idx, mi
+  func = partial(_mutual_info_factor,
+                 representations=representations,
+                 factors=factors,
+                 continuous_representations=continuous_representations,
+                 continuous_factors=continuous_factors,
+                 n_neighbors=n_neighbors,
+                 seed=seed)
 
   ## compute the MI matrix
   jobs = list(range(num_factors))
   if n_cpu < 2:
     it = (func(i) for i in jobs)
   else:
-    it = MPI(jobs=jobs, func=func, ncpu=n_cpu, batch=1)
+    it = MPI(jobs=jobs, func=func, ncpu=n_cpu, batch=1, pool=pool)
   if verbose:
     from tqdm import tqdm
     it = tqdm(it, desc='MutualInfo', total=len(jobs))
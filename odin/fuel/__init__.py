@@ -3,6 +3,7 @@ import inspect
 from odin.fuel.audio_data import *
 from odin.fuel.bio_data import *
 from odin.fuel.databases import *
+from odin.fuel.dataset import *
 from odin.fuel.dataset_base import *
 from odin.fuel.image_data import *
 from odin.fuel.nlp_data import *
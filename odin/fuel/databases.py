@@ -3,8 +3,11 @@ from __future__ import print_function, division, absolute_import
 import os
 import io
 import mmap
+import struct
+import hashlib
 import marshal
 import sqlite3
+import threading
 from itertools import chain
 from six import add_metaclass
 from six.moves import cPickle
@@ -136,10 +139,10 @@ class NoSQL(MutableMapping):
   def close(self):
     if self._is_closed:
       return
-    self._is_closed = True
     # check if in read only mode
     if not self.read_only:
       self.flush(save_all=True)
+    self._is_closed = True
     # delete Singleton instance
     del NoSQL._INSTANCES[self.__class__.__name__][self.path]
     # close but some of the attribute may not be initialized
@@ -229,19 +232,209 @@ def _safe_loading_indices(file_obj, class_name, path):
     traceback.print_exc()
     raise e
 
+
+# fixed-width record of the binary index, sorted by `hash`
+_INDEX_DTYPE = np.dtype([('hash', '<u8'), ('offset', '<u8'),
+                         ('length', '<u8'), ('key_offset', '<u8'),
+                         ('key_length', '<u8')])
+_INDEX_HEADER = b'mmapidx1'
+# values separated by less than this many bytes are read at once
+_COALESCE_GAP = 64 * 1024
+
+
+def _key_hash(key):
+  return int.from_bytes(
+      hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class _MmapIndex(MutableMapping):
+  """ Mapping: key -> (offset, length), a sorted hash table stored on disk
+  (memory-mapped, never fully loaded) with an in-memory overlay for the
+  keys added or deleted since the last time the index was written.
+
+  The index block is: |'mmapidx1'|8-bytes(n)|8-bytes(keys_size)|records|keys|
+  """
+
+  def __init__(self, buffer=None, offset=0):
+    self._overlay = {}
+    self._deleted = set()
+    self._offset = offset
+    self.remap(buffer)
+
+  def remap(self, buffer):
+    """ Attach the on-disk records to a new memory-mapped `buffer` of the
+    same file (the index block is at the same offset), no data is copied """
+    self._records = np.empty((0,), dtype=_INDEX_DTYPE)
+    self._keys = np.empty((0,), dtype=np.uint8)
+    if buffer is not None:
+      start = self._offset + len(_INDEX_HEADER)
+      n, keys_size = struct.unpack('<QQ', buffer[start:start + 16])
+      start += 16
+      self._records = np.frombuffer(buffer,
+                                    dtype=_INDEX_DTYPE,
+                                    count=n,
+                                    offset=start)
+      self._keys = np.frombuffer(buffer,
+                                 dtype=np.uint8,
+                                 count=keys_size,
+                                 offset=start + n * _INDEX_DTYPE.itemsize)
+
+  @property
+  def n_changes(self):
+    """ Number of keys added or deleted since the index was written """
+    return len(self._overlay) + len(self._deleted)
+
+  def release(self):
+    """ Drop all the references to the memory-mapped buffer, the on-disk
+    records are unavailable until `remap` is called """
+    self._records = np.empty((0,), dtype=_INDEX_DTYPE)
+    self._keys = np.empty((0,), dtype=np.uint8)
+
+  # ==================== on-disk lookup ==================== #
+  def _key_at(self, i):
+    rec = self._records[i]
+    start = int(rec['key_offset'])
+    return self._keys[start:start + int(rec['key_length'])].tobytes().decode(
+        'utf-8')
+
+  def _position(self, key):
+    """ Position of the key in on-disk records, or -1 """
+    if len(self._records) == 0:
+      return -1
+    h = _key_hash(key)
+    hashes = self._records['hash']
+    i = int(np.searchsorted(hashes, np.uint64(h), side='left'))
+    while i < len(hashes) and hashes[i] == h:
+      if self._key_at(i) == key:
+        return i
+      i += 1
+    return -1
+
+  def locate(self, keys):
+    """ Vectorized lookup of many keys
+
+    Return
+    ------
+    offsets, lengths : `numpy.ndarray` (int64), -1 for the missing keys
+    """
+    n = len(keys)
+    offsets = np.full((n,), -1, dtype='int64')
+    lengths = np.full((n,), -1, dtype='int64')
+    # ====== on-disk records ====== #
+    if len(self._records) > 0 and n > 0:
+      hashes = self._records['hash']
+      query = np.fromiter((_key_hash(k) for k in keys), dtype='<u8', count=n)
+      pos = np.minimum(np.searchsorted(hashes, query, side='left'),
+                       len(hashes) - 1)
+      found = hashes[pos] == query
+      for i in np.nonzero(found)[0]:
+        key = keys[i]
+        j = pos[i] if self._key_at(pos[i]) == key else self._position(key)
+        if j >= 0:
+          offsets[i] = self._records[j]['offset']
+          lengths[i] = self._records[j]['length']
+    # ====== overlay ====== #
+    if len(self._overlay) > 0 or len(self._deleted) > 0:
+      for i, key in enumerate(keys):
+        if key in self._overlay:
+          offsets[i], lengths[i] = self._overlay[key]
+        elif key in self._deleted:
+          offsets[i] = lengths[i] = -1
+    return offsets, lengths
+
+  # ==================== Mapping ==================== #
+  def __getitem__(self, key):
+    if key in self._overlay:
+      return self._overlay[key]
+    if key not in self._deleted:
+      i = self._position(key)
+      if i >= 0:
+        rec = self._records[i]
+        return int(rec['offset']), int(rec['length'])
+    raise KeyError(key)
+
+  def __contains__(self, key):
+    if key in self._overlay:
+      return True
+    return key not in self._deleted and self._position(key) >= 0
+
+  def __setitem__(self, key, value):
+    # old on-disk value is shadowed by the overlay
+    if key not in self._overlay and self._position(key) >= 0:
+      self._deleted.add(key)
+    self._overlay[key] = value
+
+  def __delitem__(self, key):
+    if key in self._overlay:
+      del self._overlay[key]
+    elif key in self._deleted or self._position(key) < 0:
+      raise KeyError(key)
+    if self._position(key) >= 0:
+      self._deleted.add(key)
+
+  def __len__(self):
+    return len(self._records) - len(self._deleted) + len(self._overlay)
+
+  def __iter__(self):
+    for key, _ in self.items():
+      yield key
+
+  def items(self):
+    records = self._records
+    for i in range(len(records)):
+      key = self._key_at(i)
+      if key not in self._deleted:
+        yield key, (int(records[i]['offset']), int(records[i]['length']))
+    for key, val in list(self._overlay.items()):
+      yield key, val
+
+  # ==================== serialization ==================== #
+  def to_bytes(self):
+    """ Merge the overlay into the sorted records, the key bytes of deleted
+    records are left as dead bytes (reclaimed by `MmapDict.compact`) """
+    records = self._records
+    if len(self._deleted) > 0:
+      records = np.delete(records,
+                          [self._position(key) for key in self._deleted])
+    new_keys = [key.encode('utf-8') for key in self._overlay.keys()]
+    new_records = np.empty((len(new_keys),), dtype=_INDEX_DTYPE)
+    key_offset = len(self._keys)
+    for i, (key, (offset, length)) in enumerate(self._overlay.items()):
+      new_records[i] = (_key_hash(key), offset, length, key_offset,
+                        len(new_keys[i]))
+      key_offset += len(new_keys[i])
+    records = np.concatenate([records, new_records])
+    records = records[np.argsort(records['hash'], kind='mergesort')]
+    keys = self._keys.tobytes() + b''.join(new_keys)
+    return b''.join([
+        _INDEX_HEADER,
+        struct.pack('<QQ', len(records), len(keys)),
+        records.tobytes(), keys
+    ])
+
+
 class MmapDict(NoSQL):
   """ MmapDict
   Handle enormous dictionary (up to thousand terabytes of data) in
   memory mapped dictionary, extremely fast to load, and for randomly access.
   The alignment of saved files:
 
-  ==> |'mmapdict'|48-bytes(max_pos)|48-bytes(dict_size)|MmapData|indices-dict|
+  ==> |'mmapdic2'|48-bytes(end_pos)|48-bytes(index_pos)|MmapData|index|...
+
+  * The first 48-bytes number: is ending position of the file, new values
+  and indices are always appended from this position, hence, a crash never
+  corrupts the last saved index.
+
+  * The next 48-bytes number: is the starting position of the binary index,
+  a sorted hash table with fixed-width (hash, offset, length) records which
+  is memory-mapped and searched in O(log n) without loading it.
 
-  * The first 48-bytes number: is ending position of the Mmmap, start from
-  the (8 + 48 + 48) bytes.
+  Old indices and overwritten values become dead space which could be
+  reclaimed by `MmapDict.compact`.
 
-  * The next 48-bytes number: is length of pickled indices (i.e. the
-  indices start from max_pos to max_pos + dict_size)
+  Files in the legacy format (|'mmapdict'|...|pickled-indices-dict|) are
+  loaded in read-only mode, and converted to the new format when opened
+  for writing.
 
   Note
   ----
@@ -249,55 +442,100 @@ class MmapDict(NoSQL):
   MmapDict read speed is double faster than SQLiteDict.
   MmapDict also support multiprocessing
   """
-  HEADER = b'mmapdict'
+  HEADER = b'mmapdic2'
+  LEGACY_HEADER = b'mmapdict'
   SIZE_BYTES = 48
   # the indices are flushed after it is increased this amount of size
   MAX_INDICES_SIZE = 25 # in megabyte
 
   def _restore_dict(self, path, read_only, cache_size):
+    self._increased_indices_size = 0. # in MB
+    # store all the (key, value) recently added
+    self._cache_dict = {}
     # ====== already exist ====== #
     if os.path.exists(path):
       if os.path.getsize(path) == 0:
         if read_only:
           raise Exception('File at path:"%s" has zero size, no data '
                           'found in (read-only mode).' % path)
-      file = open(str(path), mode='rb+')
-      if file.read(len(MmapDict.HEADER)) != MmapDict.HEADER:
-        file.close() # close the file before Exception
+      with open(str(path), mode='rb') as file:
+        header = file.read(len(MmapDict.HEADER))
+      if header == MmapDict.LEGACY_HEADER:
+        self._restore_legacy(path)
+        if not read_only:
+          self.compact()
+        return
+      if header != MmapDict.HEADER:
         raise Exception('Given file is not in the right format '
                         'for MmapDict.')
-      # 48 bytes for the file size
-      max_position = int(file.read(MmapDict.SIZE_BYTES))
-      # length of pickled indices dictionary
-      dict_size = int(file.read(MmapDict.SIZE_BYTES))
-      # read dictionary
-      file.seek(max_position)
-      pickled_indices = file.read(dict_size)
-      self._indices_dict = async_thread(_safe_loading_indices)(
-          pickled_indices, self.__class__.__name__, path)
+      self._open(path, mode='rb' if read_only else 'rb+')
     # ====== create new file from scratch ====== #
     else:
-      file = open(str(path), mode='wb+')
-      file.write(MmapDict.HEADER)
-      # just write the header
-      header = ('%' + str(MmapDict.SIZE_BYTES) + 'd') % \
-          (len(MmapDict.HEADER) + MmapDict.SIZE_BYTES * 2)
-      file.write(header.encode())
-      # write the length of Pickled indices dictionary
-      data_size = ('%' + str(MmapDict.SIZE_BYTES) + 'd') % 0
-      file.write(data_size.encode())
-      file.flush()
-      # init indices dict
-      self._indices_dict = {}
-    # ====== create Mmap from offset file ====== #
+      with open(str(path), mode='wb') as file:
+        self._write_header(file,
+                           end_position=len(MmapDict.HEADER) +
+                           MmapDict.SIZE_BYTES * 2,
+                           index_position=0)
+      self._open(path, mode='rb+')
+
+  # ==================== file format ==================== #
+  @staticmethod
+  def _write_header(file, end_position, index_position):
+    # a single write, the two positions are never updated separately
+    fmt = '%' + str(MmapDict.SIZE_BYTES) + 'd'
+    file.seek(0)
+    file.write(MmapDict.HEADER + (fmt % end_position).encode() +
+               (fmt % index_position).encode())
+
+  def _open(self, path, mode):
+    file = open(str(path), mode=mode)
+    file.seek(len(MmapDict.HEADER))
+    self._end_position = int(file.read(MmapDict.SIZE_BYTES))
+    index_position = int(file.read(MmapDict.SIZE_BYTES))
     self._file = file
-    self._mmap = mmap.mmap(file.fileno(), length=0, offset=0,
-                           flags=mmap.MAP_SHARED)
-    self._increased_indices_size = 0. # in MB
-    # store all the (key, value) recently added
-    self._cache_dict = {}
+    self._mmap = mmap.mmap(file.fileno(),
+                           length=0,
+                           offset=0,
+                           access=mmap.ACCESS_READ)
+    self._indices_dict = _MmapIndex(
+        self._mmap if index_position > 0 else None, index_position)
+
+  def _restore_legacy(self, path):
+    file = open(str(path), mode='rb')
+    file.seek(len(MmapDict.LEGACY_HEADER))
+    # 48 bytes for the file size
+    max_position = int(file.read(MmapDict.SIZE_BYTES))
+    # length of pickled indices dictionary
+    dict_size = int(file.read(MmapDict.SIZE_BYTES))
+    # read dictionary
+    file.seek(max_position)
+    pickled_indices = file.read(dict_size)
+    self._indices_dict = async_thread(_safe_loading_indices)(
+        pickled_indices, self.__class__.__name__, path)
+    self._file = file
+    self._mmap = mmap.mmap(file.fileno(),
+                           length=0,
+                           offset=0,
+                           access=mmap.ACCESS_READ)
+    self._end_position = None
+
+  def _reopen_mmap(self, remap_index=True):
+    index = self._indices_dict \
+      if isinstance(self._indices_dict, _MmapIndex) else None
+    if index is not None:
+      index.release()
+    self._mmap.close()
+    self._mmap = mmap.mmap(self._file.fileno(),
+                           length=0,
+                           offset=0,
+                           access=mmap.ACCESS_READ)
+    # the old index block is never overwritten, map it again
+    if remap_index and index is not None and index._offset > 0:
+      index.remap(self._mmap)
 
   def _close(self):
+    if isinstance(self._indices_dict, _MmapIndex):
+      self._indices_dict.release()
     self._mmap.close()
     self._file.close()
     del self._indices_dict
@@ -314,53 +552,104 @@ class MmapDict(NoSQL):
     # check if closed or in read only mode
     if self.is_closed or self.read_only:
       return
-    # ====== write new data ====== #
-    # get old position
+    # nothing changed, keep the file untouched (e.g. its modified time)
+    if len(self._cache_dict) == 0 and \
+      not (save_all and self.indices.n_changes > 0):
+      return
+    # ====== append new values ====== #
     file = self._file
-    # start from header (i.e. "mmapdict")
-    file.seek(len(MmapDict.HEADER))
-    max_position = int(file.read(MmapDict.SIZE_BYTES))
-    # ====== serialize the data ====== #
-    # start from old_max_position, append new values
-    file.seek(max_position)
+    position = self._end_position
+    file.seek(position)
+    indices = self.indices
     for key, value in self._cache_dict.items():
       try:
         value = _dump(value)
       except ValueError:
         raise RuntimeError("Cannot marshal.dump %s" % str(value))
-      self.indices[key] = (max_position, len(value))
-      max_position += len(value)
+      indices[key] = (position, len(value))
+      position += len(value)
       file.write(value)
       # increase indices size (in MegaBytes)
       self._increased_indices_size += (8 + 8 + len(key)) / 1024. / 1024.
-    # ====== write the dumped indices ====== #
-    indices_length = 0
-    if save_all or \
+    # ====== append the binary index ====== #
+    index_position = None
+    if (save_all and indices.n_changes > 0) or \
     self._increased_indices_size > MmapDict.MAX_INDICES_SIZE:
-      indices_dump = cPickle.dumps(self.indices,
-                                   protocol=cPickle.HIGHEST_PROTOCOL)
-      indices_length = len(indices_dump)
-      file.write(indices_dump)
+      index_position = position
+      index = indices.to_bytes()
+      file.write(index)
+      position += len(index)
       self._increased_indices_size = 0.
-    # ====== update the position ====== #
-    # write new max size
-    file.seek(len(MmapDict.HEADER))
-    max_position = ('%' + str(MmapDict.SIZE_BYTES) + 'd') % max_position
-    file.write(max_position.encode())
-    # update length of pickled indices dictionary
-    if indices_length > 0:
-      indices_length = ('%' + str(MmapDict.SIZE_BYTES) + 'd') % indices_length
-      file.write(indices_length.encode())
-    # flush everything
+    # the values and index must be on disk before the header points to them
     file.flush()
-    # upate the mmap
-    self._mmap.close(); del self._mmap
-    self._mmap = mmap.mmap(file.fileno(), length=0, offset=0,
-                           flags=mmap.MAP_SHARED)
+    os.fsync(file.fileno())
+    # ====== update the header, the old index is valid until here ====== #
+    if index_position is not None:
+      self._write_header(file,
+                         end_position=position,
+                         index_position=index_position)
+    else:
+      file.seek(len(MmapDict.HEADER))
+      file.write((('%' + str(MmapDict.SIZE_BYTES) + 'd') % position).encode())
+    file.flush()
+    os.fsync(file.fileno())
+    self._end_position = position
+    # ====== upate the mmap ====== #
+    self._reopen_mmap(remap_index=index_position is None)
+    if index_position is not None:
+      self._indices_dict = _MmapIndex(self._mmap, index_position)
     # reset some values
     del self._cache_dict
     self._cache_dict = {}
 
+  def compact(self):
+    """ Rewrite the file with only the live values and a single index,
+    reclaiming the space of old indices and overwritten values.
+
+    Return
+    ------
+    number of reclaimed bytes
+    """
+    if self.read_only or self.is_closed:
+      raise RuntimeError("Cannot compact a read-only or closed MmapDict.")
+    if self._end_position is not None:
+      self._flush(save_all=True)
+    old_size = os.path.getsize(self.path)
+    tmp_path = self.path + '.compact'
+    index = _MmapIndex()
+    with open(tmp_path, 'wb') as f:
+      position = len(MmapDict.HEADER) + MmapDict.SIZE_BYTES * 2
+      self._write_header(f, end_position=position, index_position=0)
+      # copy values in the order on disk, i.e. sequential read
+      for key, (start, size) in sorted(self.indices.items(),
+                                       key=lambda x: x[1][0]):
+        f.write(self._mmap[start:start + size])
+        index[key] = (position, size)
+        position += size
+      # legacy values cached in memory
+      for key, value in self._cache_dict.items():
+        value = _dump(value)
+        f.write(value)
+        index[key] = (position, len(value))
+        position += len(value)
+      index_bytes = index.to_bytes()
+      f.write(index_bytes)
+      self._write_header(f,
+                         end_position=position + len(index_bytes),
+                         index_position=position)
+      f.flush()
+      os.fsync(f.fileno())
+    # ====== swap the file ====== #
+    if isinstance(self._indices_dict, _MmapIndex):
+      self._indices_dict.release()
+    self._mmap.close()
+    self._file.close()
+    os.replace(tmp_path, self.path)
+    self._cache_dict = {}
+    self._increased_indices_size = 0.
+    self._open(self.path, mode='rb+')
+    return old_size - os.path.getsize(self.path)
+
   # ==================== I/O methods ==================== #
   @property
   def indices(self):
@@ -400,38 +689,83 @@ class MmapDict(NoSQL):
       return self._cache_dict[key]
     # ====== load from mmap ====== #
     start, size = self.indices[key]
-    self._mmap.seek(start)
-    return marshal.loads(self._mmap.read(size))
+    return marshal.loads(self._mmap[start:start + size])
+
+  def get_many(self, keys):
+    """ Return the values of given `keys` (in the same order), the
+    values are read in the order of their position on disk, and adjacent
+    values are coalesced into a single read.
+    """
+    keys = [str(k) for k in keys]
+    results = [None] * len(keys)
+    indices = self.indices
+    # ====== locate all the values ====== #
+    if isinstance(indices, _MmapIndex):
+      offsets, lengths = indices.locate(keys)
+    else:
+      offsets = np.full((len(keys),), -1, dtype='int64')
+      lengths = np.full((len(keys),), -1, dtype='int64')
+      for i, key in enumerate(keys):
+        if key in indices:
+          offsets[i], lengths[i] = indices[key]
+    for i, key in enumerate(keys):
+      if key in self._cache_dict:
+        results[i] = self._cache_dict[key]
+        offsets[i] = -2
+      elif offsets[i] < 0:
+        raise KeyError(key)
+    # ====== sequential and coalesced reads ====== #
+    ids = np.nonzero(offsets >= 0)[0]
+    ids = ids[np.argsort(offsets[ids], kind='mergesort')]
+    if len(ids) == 0:
+      return results
+    starts = offsets[ids]
+    ends = starts + lengths[ids]
+    # a new read starts whenever the gap to previous value is too large
+    max_end = np.maximum.accumulate(ends)
+    breaks = np.nonzero(starts[1:] > max_end[:-1] + _COALESCE_GAP)[0] + 1
+    for chunk in np.split(np.arange(len(ids)), breaks):
+      begin = int(starts[chunk[0]])
+      buffer = self._mmap[begin:int(max_end[chunk[-1]])]
+      for j in chunk:
+        start = int(starts[j]) - begin
+        end = int(ends[j]) - begin
+        results[ids[j]] = marshal.loads(buffer[start:end])
+    return results
 
   def __contains__(self, key):
-    return key in self.indices or key in self._cache_dict
+    return key in self._cache_dict or key in self.indices
 
   def __len__(self):
-    return len(self.indices) + len(self._cache_dict)
+    return len(self.indices) + \
+      sum(1 for key in self._cache_dict if key not in self.indices)
 
   def __delitem__(self, key):
     if self.read_only:
       return
     if key in self._cache_dict:
-      del self._cache_dict
+      del self._cache_dict[key]
+      if key in self.indices:
+        del self.indices[key]
     else:
       del self.indices[key]
 
   def keys(self):
-    return chain(self.indices.keys(), self._cache_dict.keys())
+    return chain((k for k in self.indices.keys() if k not in self._cache_dict),
+                 self._cache_dict.keys())
 
   def values(self):
     for name, (start, size) in self.indices.items():
-      self._mmap.seek(start)
-      yield marshal.loads(self._mmap.read(size))
+      if name not in self._cache_dict:
+        yield marshal.loads(self._mmap[start:start + size])
     for val in self._cache_dict.values():
       yield val
 
   def items(self):
     for name, (start, size) in self.indices.items():
-      self._mmap.seek(start)
-      yield name, marshal.loads(self._mmap.read(size))
-    for key, val in self._cache_dict.values():
+      if name not in self._cache_dict:
+        yield name, marshal.loads(self._mmap[start:start + size])
+    for key, val in self._cache_dict.items():
       yield key, val
 
 
@@ -467,7 +801,7 @@ class TableDict(MutableMapping):
   def table_context(self):
     """Return temporary context that switch the SQLite to given table"""
     curr_tab = self._sqlite.current_table
-    self._sqlite.set_table(self._table_name)
+    self._sqlite.set_table(self._name)
     yield None
     self._sqlite.set_table(curr_tab)
 
@@ -602,6 +936,14 @@ class SQLiteDict(NoSQL):
   >>> [p.start() for p in pros]
   >>> [p.join() for p in pros]
 
+  Parameters
+  ----------
+  concurrent : bool
+      if True, enable the concurrent-reader mode: WAL journaling,
+      memory-mapped I/O and a connection for each process and thread
+      (i.e. safe to use after `fork`, e.g. `torch.utils.data.DataLoader`
+      workers), otherwise, a single connection holding an exclusive lock.
+
   Note
   ----
   numpy.ndarray will be converted to list before dumped to the database,
@@ -610,42 +952,113 @@ class SQLiteDict(NoSQL):
   """
 
   _DEFAULT_TABLE = '_default_'
+  # below SQLITE_MAX_VARIABLE_NUMBER of old sqlite versions (i.e. 999)
+  MAX_QUERY_KEYS = 900
+  # size of memory-mapped I/O in concurrent mode (in bytes)
+  MMAP_SIZE = 256 * 1024 * 1024
+  # seconds waiting for the lock of other writer in concurrent mode
+  TIMEOUT = 30.
+
+  def __init__(self, path, read_only=False, cache_size=250, override=False,
+               concurrent=False):
+    self._concurrent = bool(concurrent)
+    super(SQLiteDict, self).__init__(path,
+                                     read_only=read_only,
+                                     cache_size=cache_size,
+                                     override=override)
 
   def _restore_dict(self, path, read_only, cache_size):
     # specific cache dictionary for each table
     self._cache = defaultdict(dict)
     # ====== db manager ====== #
-    self._conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
-    self._conn.text_factory = str
-    self._cursor = self._conn.cursor()
-    # adjust pragma
-    # SQLITE_OPEN_EXCLUSIVE
-    self.connection.execute('PRAGMA main.locking_mode = EXCLUSIVE;')
-    self.connection.execute("PRAGMA main.synchronous = 0;")
-    self.connection.execute("PRAGMA journal_mode = MEMORY;")
-    self.connection.commit()
+    # mapping (pid, thread_id) -> (connection, cursor)
+    self._connections = {}
+    self._connections_lock = threading.Lock()
+    if not self.concurrent:
+      self._conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+      self._conn.text_factory = str
+      self._cursor = self._conn.cursor()
+      # adjust pragma
+      # SQLITE_OPEN_EXCLUSIVE
+      self.connection.execute('PRAGMA main.locking_mode = EXCLUSIVE;')
+      self.connection.execute("PRAGMA main.synchronous = 0;")
+      self.connection.execute("PRAGMA journal_mode = MEMORY;")
+      self.connection.commit()
     # ====== create default table ====== #
     self._current_table = SQLiteDict._DEFAULT_TABLE
+    if read_only and self.concurrent:
+      return
     self.set_table(SQLiteDict._DEFAULT_TABLE)
 
+  def _connect(self):
+    """ New connection for the concurrent mode """
+    if self.read_only:
+      conn = sqlite3.connect('file:%s?mode=ro' % self.path,
+                             uri=True,
+                             timeout=SQLiteDict.TIMEOUT,
+                             detect_types=sqlite3.PARSE_DECLTYPES)
+    else:
+      conn = sqlite3.connect(self.path,
+                             timeout=SQLiteDict.TIMEOUT,
+                             detect_types=sqlite3.PARSE_DECLTYPES)
+      # WAL is persistent, readers opened later will use it
+      conn.execute("PRAGMA journal_mode = WAL;")
+      conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.text_factory = str
+    conn.execute("PRAGMA mmap_size = %d;" % SQLiteDict.MMAP_SIZE)
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn, conn.cursor()
+
+  def _get_connection(self):
+    key = (os.getpid(), threading.get_ident())
+    conn = self._connections.get(key, None)
+    if conn is None:
+      with self._connections_lock:
+        # connections inherited by `fork` must never be used (or closed)
+        # in the child process, just drop them
+        self._connections = {
+            k: v for k, v in self._connections.items() if k[0] == key[0]
+        }
+        conn = self._connect()
+        self._connections[key] = conn
+    return conn
+
   def _flush(self, save_all=False):
-    curr_tab = self.current_table
-    tables = self.get_all_tables() if save_all else [curr_tab]
-    for tab in tables:
-      self.set_table(tab)
-      if len(self.current_cache) > 0:
-        self.cursor.executemany(
-            "INSERT INTO {tb} VALUES (?, ?)".format(tb=tab),
+    tables = list(self._cache.keys()) if save_all else [self.current_table]
+    tables = [tab for tab in tables if len(self._cache[tab]) > 0]
+    if len(tables) == 0:
+      return self
+    # all tables are written in a single transaction
+    with self.connection as conn:
+      for tab in tables:
+        cache = self._cache[tab]
+        conn.executemany(
+            "INSERT OR REPLACE INTO {tb} VALUES (?, ?)".format(tb=tab),
             [(str(k), _dump(v.tolist()) if isinstance(v, np.ndarray)
               else _dump(v))
-             for k, v in self.current_cache.items()])
-        self.connection.commit()
-        self.current_cache.clear()
-    # restore the last table
-    return self.set_table(curr_tab)
+             for k, v in cache.items()])
+        cache.clear()
+    return self
 
   def _close(self):
-    self._conn.close()
+    if not self.concurrent:
+      self._conn.close()
+    pid = os.getpid()
+    for (conn_pid, _), (conn, _) in self._connections.items():
+      if conn_pid == pid:
+        try:
+          conn.close()
+        except sqlite3.ProgrammingError: # created in other thread
+          pass
+    self._connections = {}
+
+  # ==================== pickling ==================== #
+  def __getstate__(self):
+    return super(SQLiteDict, self).__getstate__() + (self._concurrent,)
+
+  def __setstate__(self, states):
+    self._concurrent = states[-1]
+    super(SQLiteDict, self).__setstate__(states[:-1])
 
   # ==================== DB manager ==================== #
   def as_table(self, table_name):
@@ -717,12 +1130,20 @@ class SQLiteDict(NoSQL):
     self.set_table(curr_tab) # back to original table
     return s[:-1]
 
+  @property
+  def concurrent(self):
+    return self._concurrent
+
   @property
   def connection(self):
+    if self.concurrent:
+      return self._get_connection()[0]
     return self._conn
 
   @property
   def cursor(self):
+    if self.concurrent:
+      return self._get_connection()[1]
     return self._cursor
 
   # ==================== Dictionary ==================== #
@@ -735,29 +1156,42 @@ class SQLiteDict(NoSQL):
       self.flush()
       self.current_cache.clear()
 
+  def get_many(self, keys):
+    """ Return the values of given `keys` (in the same order), using
+    parameterised queries of at most `SQLiteDict.MAX_QUERY_KEYS` keys """
+    keys = [str(k) for k in keys]
+    cache = self.current_cache
+    found = {}
+    db_keys = list(set(k for k in keys if k not in cache))
+    query = """SELECT key, value FROM {tb} WHERE key IN ({params});"""
+    for i in range(0, len(db_keys), SQLiteDict.MAX_QUERY_KEYS):
+      chunk = db_keys[i:i + SQLiteDict.MAX_QUERY_KEYS]
+      for k, v in self.connection.execute(
+          query.format(tb=self._current_table,
+                       params=', '.join(['?'] * len(chunk))), chunk):
+        found[k] = v
+    results = []
+    for k in keys:
+      if k in cache:
+        results.append(cache[k])
+      elif k in found:
+        results.append(marshal.loads(found[k]))
+      else:
+        raise KeyError("Cannot find `key`='%s' in the dictionary." % k)
+    return results
+
   def __getitem__(self, key):
     # ====== multiple keys select ====== #
     if isinstance(key, (tuple, list, np.ndarray)):
-      query = """SELECT value FROM {tb}
-                       WHERE key IN {keyval};"""
-      keyval = '(' + ', '.join(['"%s"' % str(k) for k in key]) + ')'
-      self.cursor.execute(
-          query.format(tb=self._current_table, keyval=keyval))
-      results = self.cursor.fetchall()
-      # check if any not found keys
-      if len(results) != len(key):
-        raise KeyError("Cannot find all `key`='%s' in the dictionary." % keyval)
-      # load binary data
-      results = [marshal.loads(r[0]) for r in results]
+      results = self.get_many(key)
     # ====== single key select ====== #
     else:
       key = str(key)
       if key in self.current_cache:
         return self.current_cache[key]
-      query = """SELECT value FROM {tb} WHERE key="{keyval}" LIMIT 1;"""
+      query = """SELECT value FROM {tb} WHERE key=? LIMIT 1;"""
       results = self.connection.execute(
-          query.format(tb=self._current_table, keyval=key)).fetchone()
-      # results = self.cursor.fetchone()
+          query.format(tb=self._current_table), (key,)).fetchone()
       if results is None:
         raise KeyError("Cannot find `key`='%s' in the dictionary." % key)
       results = marshal.loads(results[0])
@@ -769,12 +1203,9 @@ class SQLiteDict(NoSQL):
     if key in self.current_cache:
       return True
     # check in database
-    query = """SELECT 1 FROM {tb} WHERE key="{keyval}" LIMIT 1;"""
-    self.cursor.execute(
-        query.format(tb=self._current_table, keyval=key))
-    if self.cursor.fetchone() is None:
-      return False
-    return True
+    query = """SELECT 1 FROM {tb} WHERE key=? LIMIT 1;"""
+    return self.connection.execute(query.format(tb=self._current_table),
+                                   (key,)).fetchone() is not None
 
   def __len__(self):
     query = """SELECT COUNT(1) FROM {tb}""".format(tb=self._current_table)
@@ -785,7 +1216,7 @@ class SQLiteDict(NoSQL):
   def __delitem__(self, key):
     if self.read_only:
       return
-    query = """DELETE FROM {tb} WHERE {cond};"""
+    query = """DELETE FROM {tb} WHERE key=?;"""
     if isinstance(key, (tuple, list, Iterator, np.ndarray)):
       key = [str(k) for k in key]
     else:
@@ -798,27 +1229,26 @@ class SQLiteDict(NoSQL):
       else:
         db_key.append(k)
     # ====== remove key from db ====== #
-    self.cursor.execute(
-        query.format(tb=self._current_table,
-                     cond='key IN ("%s")' % ', '.join(db_key)))
-    self.connection.commit()
+    with self.connection as conn:
+      conn.executemany(query.format(tb=self._current_table),
+                       [(k,) for k in db_key])
 
   def keys(self):
-    for k in self.cursor.execute(
+    for k in self.connection.execute(
         """SELECT key from {tb};""".format(tb=self._current_table)):
       yield k[0]
     for k in self.current_cache.keys():
       yield k
 
   def values(self):
-    for val in self.cursor.execute(
+    for val in self.connection.execute(
         """SELECT value from {tb};""".format(tb=self._current_table)):
       yield marshal.loads(val[0])
     for v in self.current_cache.values():
       yield v
 
   def items(self):
-    for item in self.cursor.execute(
+    for item in self.connection.execute(
         """SELECT key, value from {tb};""".format(tb=self._current_table)):
       yield (item[0], marshal.loads(item[1]))
     for k, v in self.current_cache.items():
@@ -827,7 +1257,7 @@ class SQLiteDict(NoSQL):
   def update(self, items):
     if self.read_only:
       return
-    query = """UPDATE {tb} SET value=(?) WHERE key=("?");"""
+    query = """UPDATE {tb} SET value=? WHERE key=?;"""
     if isinstance(items, Mapping):
       items = items.items()
     # ====== check if update is in cache ====== #
@@ -839,8 +1269,8 @@ class SQLiteDict(NoSQL):
       else:
         db_update.append((_dump(value), key))
     # ====== perform DB update ====== #
-    self.cursor.executemany(query.format(tb=self._current_table), db_update)
-    self.connection.commit()
+    with self.connection as conn:
+      conn.executemany(query.format(tb=self._current_table), db_update)
     return self
 
   def clear(self):
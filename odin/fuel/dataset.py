@@ -3,7 +3,9 @@ from __future__ import absolute_import, division, print_function
 import os
 import pickle
 import shutil
+import sqlite3
 from collections import Mapping, OrderedDict
+from multiprocessing.pool import ThreadPool
 from typing import Any, Text
 
 import numpy as np
@@ -11,6 +13,7 @@ from six import string_types
 from six.moves import cPickle, range, zip
 
 from bigarray import MmapArray, MmapArrayWriter, read_mmaparray_header
+from bigarray.mmap_array import _HEADER as _MMAPARRAY_HEADER
 from odin.fuel.databases import MmapDict, SQLiteDict
 from odin.utils import (Progbar, UnitTimer, as_tuple, ctext, eprint,
                         flatten_list, get_file, is_callable, is_string, wprint)
@@ -48,7 +51,25 @@ _audio_ext = ('.3gp', '.aa', '.aac', '.aax', '.act', '.aiff', '.amr', '.ape',
 _image_ext = ('.tif', '.tiff', '.gif', '.jpeg', '.jpg', '.jif', '.jfif', '.jp2',
               '.jpx', '.j2k', '.j2c', '.fpx', '.pcd', '.png', '.pdf')
 
-_ignore_files = ('.DS_Store',)
+# checkpoint of a resumable `FeatureProcessor` run
+PROCESSOR_CHECKPOINT = '.processor_checkpoint'
+
+# cached results of the type detection of all files in the Dataset
+DATASET_MANIFEST = '.dataset_manifest'
+_MANIFEST_VERSION = 2
+
+_ignore_files = ('.DS_Store', PROCESSOR_CHECKPOINT,
+                 PROCESSOR_CHECKPOINT + '.tmp', DATASET_MANIFEST,
+                 DATASET_MANIFEST + '.tmp')
+# temporary files created by SQLite
+_ignore_suffixes = ('-wal', '-shm', '-journal')
+
+_PICKLE_MAGIC = b'\x80'
+_NUMPY_MAGIC = b'\x93NUMPY'
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+# directory with more files than this is scanned by multiple threads
+_PARALLEL_SCAN_THRESHOLD = 32
+_SCAN_THREADS = 8
 
 
 def _parse_data_descriptor(path, read_only):
@@ -126,7 +147,7 @@ def _parse_data_descriptor(path, read_only):
   # ====== load SQLiteDict ====== #
   if '.db' in os.path.splitext(path)[1]:
     try:
-      db = SQLiteDict(path, read_only=read_only)
+      db = SQLiteDict(path, read_only=read_only, concurrent=read_only)
       name = os.path.basename(path).replace('.db', '')
       return [(tab if tab != SQLiteDict._DEFAULT_TABLE else name,
                ('sqlite', len(db.set_table(tab)), db.as_table(tab), path))
@@ -137,6 +158,105 @@ def _parse_data_descriptor(path, read_only):
   return [(file_name, ('unknown', 'unknown', None, path))]
 
 
+class _LazyData(object):
+  """ Placeholder for the data which is only loaded at the first
+  `Dataset.__getitem__` """
+
+  def __init__(self, path, table=None):
+    self.path = path
+    self.table = table
+
+  def load(self, read_only):
+    """ Return the actual descriptor (dtype, shape, Data, path) """
+    if self.table is not None:
+      db = SQLiteDict(self.path, read_only=read_only, concurrent=read_only)
+      return ('sqlite', len(db.set_table(self.table)),
+              db.as_table(self.table), self.path)
+    return _parse_data_descriptor(self.path, read_only)[0][1]
+
+
+def _is_ignored(file_name):
+  return file_name in _ignore_files or \
+    any(file_name.endswith(i) for i in _ignore_suffixes)
+
+
+def _sniff_data_descriptor(path):
+  """ Same as `_parse_data_descriptor` but only the header of the file
+  is read, the data is loaded later by `_LazyData`
+
+  Return mapping: name -> (dtype, shape, _LazyData or None, path)
+  """
+  file_name = os.path.basename(path)
+  if not os.path.isfile(path) or _is_ignored(file_name):
+    return None
+  file_ext = os.path.splitext(path)[-1].lower()
+  # ====== known extensions ====== #
+  if file_ext in _audio_ext:
+    return [(file_name, ('audio', 'unknown', None, path))]
+  if file_ext in _image_ext:
+    return [(file_name, ('image', 'unknown', None, path))]
+  if file_ext in ('.txt',):
+    return [(file_name, ('txt', 'unknown', None, path))]
+  if file_ext in ('.csv', '.tsv'):
+    return [('.'.join(file_name.split('.')[:-1]),
+             ('csv', 'unknown', _LazyData(path), path))]
+  # ====== sniff the header ====== #
+  with open(path, 'rb') as f:
+    magic = f.read(len(_SQLITE_MAGIC))
+  if magic[:len(_MMAPARRAY_HEADER)] == _MMAPARRAY_HEADER:
+    try:
+      dtype, shape = read_mmaparray_header(path)
+      return [(file_name, (np.dtype(dtype), shape, _LazyData(path), path))]
+    except Exception:
+      pass
+  if magic[:len(MmapDict.HEADER)] in (MmapDict.HEADER,
+                                      MmapDict.LEGACY_HEADER):
+    return [(file_name, ('memdict', 'unknown', _LazyData(path), path))]
+  if magic == _SQLITE_MAGIC and '.db' in file_ext:
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    try:
+      tables = [i[0] for i in conn.execute(
+          "SELECT name FROM sqlite_master where type='table';")]
+    finally:
+      conn.close()
+    name = file_name.replace('.db', '')
+    return [(tab if tab != SQLiteDict._DEFAULT_TABLE else name,
+             ('sqlite', 'unknown', _LazyData(path, tab), path))
+            for tab in tables]
+  if magic[:1] == _PICKLE_MAGIC or magic[:len(_NUMPY_MAGIC)] == _NUMPY_MAGIC:
+    return [(file_name, ('pickle', 'unknown', _LazyData(path), path))]
+  # all the loaders will be tried when it is accessed
+  return [(file_name, ('unknown', 'unknown', _LazyData(path), path))]
+
+
+def _file_signature(path):
+  stat = os.stat(path)
+  return (stat.st_mtime_ns, stat.st_size)
+
+
+def _scan_file(path):
+  """ Return (signature, descriptors) of a file """
+  return _file_signature(path), _sniff_data_descriptor(path)
+
+
+def _pack_descriptors(descriptors):
+  """ Drop the absolute paths from the descriptors of a file, so the
+  manifest is still valid after the Dataset folder is moved or copied """
+  if descriptors is None:
+    return None
+  return [(key, (dtype, shape, isinstance(data, _LazyData),
+                 data.table if isinstance(data, _LazyData) else None))
+          for key, (dtype, shape, data, _) in descriptors]
+
+
+def _unpack_descriptors(packed, path):
+  """ Reverse of `_pack_descriptors` for the file at `path` """
+  if packed is None:
+    return None
+  return [(key, (dtype, shape, _LazyData(path, table) if is_lazy else None,
+                 path)) for key, (dtype, shape, is_lazy, table) in packed]
+
+
 # ===========================================================================
 # Datasets
 # ===========================================================================
@@ -151,6 +271,10 @@ class Dataset(object):
    - .txt or .csv files:
    -
 
+  Only the header of each file is read when the Dataset is opened, the
+  data is loaded at its first access, and the type detection results are
+  cached in a manifest file (invalidated by the file modified time and size).
+
   Note
   ----
   for developer: _data_map contains: name -> (dtype, shape, Data or pathtoData)
@@ -218,7 +342,7 @@ class Dataset(object):
     elif not os.path.isdir(path):
       raise ValueError('Dataset path must be a folder.')
     # ====== Load all Data ====== #
-    files = os.listdir(path)
+    files = sorted(os.listdir(path))
     for fname in files:
       # found README
       if 'readme' == fname[:6].lower():
@@ -229,8 +353,7 @@ class Dataset(object):
           readme.append(' => For more information: ' + readme_path)
           self._readme_info = [ctext('README:', 'yellow'), '------'] + readme
           self._readme_path = readme_path
-      # parse data
-      data = _parse_data_descriptor(os.path.join(path, fname), read_only)
+    for data in self._scan_files(files, read_only):
       if data is None:
         continue
       for key, d in data:
@@ -240,6 +363,66 @@ class Dataset(object):
         else:
           self._data_map[key] = d
 
+  def _scan_files(self, files, read_only):
+    """ Return the lazy descriptors of all files, files unchanged since
+    the last scan are taken from the manifest, the others are sniffed
+    (by multiple threads for large directory) """
+    # the manifest (and the checkpoint) change every time they are written,
+    # they must not invalidate the cache
+    files = [f for f in files if not _is_ignored(f)]
+    manifest_path = os.path.join(self.path, DATASET_MANIFEST)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+      try:
+        with open(manifest_path, 'rb') as f:
+          version, manifest = cPickle.load(f)
+        if version != _MANIFEST_VERSION:
+          manifest = {}
+      except Exception:  # corrupted or old manifest, just scan again
+        manifest = {}
+    # ====== check the cached descriptors ====== #
+    results = {}
+    changed = set(manifest.keys()) != set(files)
+    for fname in files:
+      fpath = os.path.join(self.path, fname)
+      if fname in manifest and os.path.isfile(fpath) and \
+        manifest[fname][0] == _file_signature(fpath):
+        results[fname] = manifest[fname]
+    todo = [f for f in files if f not in results]
+    # ====== scan new or modified files ====== #
+    todo_path = [os.path.join(self.path, f) for f in todo]
+    if len(todo) > _PARALLEL_SCAN_THRESHOLD:
+      pool = ThreadPool(processes=_SCAN_THREADS)
+      scanned = pool.map(_scan_file, todo_path)
+      pool.close()
+      pool.join()
+    else:
+      scanned = [_scan_file(f) for f in todo_path]
+    for f, (signature, descriptors) in zip(todo, scanned):
+      results[f] = (signature, _pack_descriptors(descriptors))
+    # ====== save the manifest ====== #
+    if not read_only and (changed or len(todo) > 0):
+      try:
+        with open(manifest_path + '.tmp', 'wb') as f:
+          cPickle.dump((_MANIFEST_VERSION, results),
+                       f,
+                       protocol=cPickle.HIGHEST_PROTOCOL)
+        os.replace(manifest_path + '.tmp', manifest_path)
+      except (IOError, OSError):  # e.g. read-only file system
+        pass
+    return [
+        _unpack_descriptors(results[f][1], os.path.join(self.path, f))
+        for f in files
+    ]
+
+  def _load_data(self, key):
+    """ Load the data of a lazy descriptor """
+    dtype, shape, data, path = self._data_map[key]
+    if isinstance(data, _LazyData):
+      dtype, shape, data, path = data.load(self.read_only)
+      self._data_map[key] = (dtype, shape, data, path)
+    return dtype, shape, data, path
+
   # ==================== Pickle ==================== #
   def __getstate__(self):
     if not self._new_args_called:
@@ -348,8 +531,9 @@ class Dataset(object):
 
   def iterinfo(self):
     """Return iteration of: (dtype, shape, loaded_data, path)"""
-    for name, (dtype, shape, data, path) in self._data_map.items():
-      yield (dtype, shape, self.__getitem__(name), path)
+    for name in list(self._data_map.keys()):
+      dtype, shape, data, path = self._load_data(name)
+      yield (dtype, shape, path if data is None else data, path)
 
   def keys(self):
     """
@@ -404,6 +588,8 @@ class Dataset(object):
 
   def flush(self):
     for dtype, shape, data, path in self._data_map.values():
+      if isinstance(data, _LazyData):  # never loaded, nothing changed
+        continue
       if hasattr(data, 'flush'):
         data.flush()
       elif data is not None:  # Flush pickling data
@@ -431,7 +617,9 @@ class Dataset(object):
     # ====== close a particular file ====== #
     elif name in self._data_map:
       (dtype, shape, data, path) = self._data_map[name]
-      if dtype == 'sqlite':
+      if isinstance(data, _LazyData):
+        pass
+      elif dtype == 'sqlite':
         data.sqlite.close()
       elif hasattr(data, 'close'):
         data.close()
@@ -465,7 +653,7 @@ class Dataset(object):
     if is_string(key):
       if key not in self._data_map:
         raise KeyError('%s not found in this dataset' % key)
-      dtype, shape, data, path = self._data_map[key]
+      dtype, shape, data, path = self._load_data(key)
       return path if data is None else data
     raise ValueError('Only accept key type is string.')
 
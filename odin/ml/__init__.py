@@ -17,8 +17,9 @@ from odin.ml.gmm_tmat import GMM, Tmatrix
 from odin.ml.ivector import Ivector
 from odin.ml.neural_nlp import *
 from odin.ml.plda import PLDA
-from odin.ml.scoring import (Scorer, VectorNormalizer, compute_class_avg,
-                             compute_wccn, compute_within_cov)
+from odin.ml.scoring import (ScoreNormalizer, Scorer, VectorNormalizer,
+                             compute_class_avg, compute_wccn,
+                             compute_within_cov, score_trial_list)
 from odin.utils import get_function_arguments
 from sklearn.base import ClassifierMixin
 from typing_extensions import Literal
@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function
 
 import math
+from functools import partial
 from multiprocessing import Array, Value
 from numbers import Number
 from typing import Optional
@@ -758,6 +759,59 @@ class RandomizedPCA(BaseEstimator, TransformerMixin):
     return X_original
 
 
+def _pca_transform_batch(batch, pca, X, n_components):
+  start, end = batch
+  x = IncrementalPCA.transform(pca, X=X[start:end])
+  # doing dim reduction here save a lot of memory for
+  # inter-processors transfer
+  if n_components is not None:
+    x = x[:, :n_components]
+  # just need to return the start for ordering
+  yield start, x
+
+
+def _merge_pca_stats(stats1, stats2, Q=None):
+  """ Merge two partial statistics `(n, mean, sum_sq, M2Q)` computed on
+  disjoint rows, where `sum_sq` and `M2Q` are the centered sum of squares
+  and the centered Gram matrix (projected on `Q`), using the pairwise update
+  of Chan et al. (1979) """
+  n1, mean1, sum_sq1, M2Q1 = stats1
+  n2, mean2, sum_sq2, M2Q2 = stats2
+  if n1 == 0:
+    return stats2
+  if n2 == 0:
+    return stats1
+  n = n1 + n2
+  delta = mean2 - mean1
+  factor = n1 * n2 / n
+  mean = mean1 + delta * (n2 / n)
+  sum_sq = sum_sq1 + sum_sq2 + factor * delta**2
+  M2Q = M2Q1 + M2Q2 + factor * np.outer(
+      delta, delta if Q is None else np.dot(delta, Q))
+  return n, mean, sum_sq, M2Q
+
+
+def _pca_partial_stats(job, X, batch_size, Q=None):
+  """ Centered Gram matrix `Xc^T Xc` (or the sketch `Xc^T Xc Q` if `Q` is
+  given) of the rows `[start, end)`, computed in float64 mini-batches """
+  start, end = job
+  n_features = X.shape[1]
+  n_cols = n_features if Q is None else Q.shape[1]
+  stats = (0, np.zeros(n_features), np.zeros(n_features),
+           np.zeros((n_features, n_cols)))
+  for s in range(start, end, batch_size):
+    x = np.array(X[s:min(s + batch_size, end)], dtype='float64')
+    if x.shape[0] == 0:
+      continue
+    mean = np.mean(x, axis=0)
+    x -= mean
+    M2Q = np.dot(x.T, x if Q is None else np.dot(x, Q))
+    stats = _merge_pca_stats(stats,
+                             (x.shape[0], mean, np.sum(x**2, axis=0), M2Q),
+                             Q=Q)
+  yield stats
+
+
 class MiniBatchPCA(IncrementalPCA):
   """ A modified version of IncrementalPCA to effectively
   support multi-processing (but not work)
@@ -1050,6 +1104,132 @@ class MiniBatchPCA(IncrementalPCA):
       self.noise_variance_ = 0.
     return self
 
+  def fit_mpi(self,
+              X,
+              algo='exact',
+              ncpu=4,
+              iterated_power=2,
+              n_oversamples=10,
+              random_state=None,
+              print_progress=False):
+    """ Out-of-core PCA, each process computes the centered Gram matrix
+    (or its randomized sketch) of a disjoint range of rows, the partial
+    results are merged in the main process and decomposed at once.
+
+    Different from `partial_fit`, the result is exact (i.e. the same as
+    `sklearn.decomposition.PCA`) and independent of the `batch_size`,
+    which is only used to limit the memory of each process.
+    `X` is only sliced by rows, so `MmapArray` or `numpy.memmap` never
+    need to be loaded into memory; the model is refitted from scratch.
+
+    Parameters
+    ----------
+    X : array-like, shape (n_samples, n_features)
+        Training data, `numpy.ndarray`, `numpy.memmap` or `MmapArray`
+    algo : {'exact', 'randomized'}
+        'exact' - eigen-decomposition of the full covariance matrix,
+          one pass over the data, `O(n_features^2)` memory per process.
+        'randomized' - randomized subspace iteration (Halko et al. 2009)
+          on the covariance matrix, `iterated_power + 1` passes over the
+          data, `O(n_features * (n_components + n_oversamples))` memory,
+          for the case `n_components << n_features`.
+    ncpu : int
+        number of processes
+    iterated_power : int
+        number of power iterations, only for `algo='randomized'`
+    n_oversamples : int
+        additional random vectors for the sketch, only for
+        `algo='randomized'`
+    random_state : {None, int, numpy.random.RandomState}
+    print_progress : bool
+        show the progress bar of each pass over the data
+
+    Returns
+    -------
+    self: object
+        Returns the instance itself.
+    """
+    algo = str(algo).lower()
+    if algo not in ('exact', 'randomized'):
+      raise ValueError("`algo` must be 'exact' or 'randomized', given: %s" %
+                       algo)
+    n_samples, n_features = X.shape
+    if self.n_components is None:
+      self.n_components_ = n_features
+    elif not 1 <= self.n_components <= n_features:
+      raise ValueError("n_components=%r invalid for n_features=%d" %
+                       (self.n_components, n_features))
+    else:
+      self.n_components_ = int(self.n_components)
+    if self.batch_size is None:
+      batch_size = 12 * n_features
+    else:
+      batch_size = self.batch_size
+    # more jobs than processes for balancing the load
+    ncpu = max(1, int(ncpu))
+    jobs = np.linspace(0, n_samples, num=min(n_samples, ncpu * 4) + 1,
+                       dtype='int64')
+    jobs = [(int(s), int(e)) for s, e in zip(jobs, jobs[1:]) if e > s]
+
+    def one_pass(Q, name):
+      map_func = partial(_pca_partial_stats, X=X, batch_size=batch_size, Q=Q)
+      if ncpu == 1:
+        results = (stats for job in jobs for stats in map_func(job))
+      else:
+        results = MPI(jobs, func=map_func, ncpu=ncpu, batch=1, hwm=ncpu * 2,
+                      backend='python')
+      prog = Progbar(target=n_samples, print_report=False,
+                     print_summary=False, name=name)
+      total = None
+      for stats in results:
+        total = stats if total is None else _merge_pca_stats(total, stats, Q=Q)
+        if print_progress:
+          prog.add(stats[0])
+      return total
+
+    # ====== exact decomposition of the covariance ====== #
+    if algo == 'exact':
+      n, mean, sum_sq, M2 = one_pass(None, "Exact PCA")
+      eigval, eigvec = linalg.eigh(M2)
+    # ====== randomized subspace iteration ====== #
+    else:
+      random_state = check_random_state(random_state)
+      n_random = min(n_features, self.n_components_ + int(n_oversamples))
+      Q = linalg.qr(random_state.normal(size=(n_features, n_random)),
+                    mode='economic')[0]
+      for i in range(int(iterated_power)):
+        M2Q = one_pass(Q, "Randomized PCA %d/%d" % (i + 1,
+                                                    iterated_power + 1))[-1]
+        Q = linalg.qr(M2Q, mode='economic')[0]
+      n, mean, sum_sq, M2Q = one_pass(
+          Q, "Randomized PCA %d/%d" % (iterated_power + 1, iterated_power + 1))
+      eigval, W = linalg.eigh(np.dot(Q.T, M2Q))
+      eigvec = np.dot(Q, W)
+    # descending order, same sign convention as `svd_flip`
+    eigval = np.maximum(eigval[::-1][:self.n_components_], 0.)
+    components = eigvec[:, ::-1][:, :self.n_components_].T
+    max_abs = np.argmax(np.abs(components), axis=1)
+    components *= np.sign(components[np.arange(components.shape[0]),
+                                     max_abs])[:, np.newaxis]
+    # ====== store the statistics ====== #
+    dtype = X.dtype if X.dtype in (np.float32, np.float64) else np.float64
+    total_var = np.sum(sum_sq)
+    self.n_samples_seen_ = n
+    self.mean_ = mean
+    self.var_ = sum_sq / n
+    self.components_ = components.astype(dtype)
+    self.singular_values_ = np.sqrt(eigval)
+    self.explained_variance_ = eigval / n
+    self.explained_variance_ratio_ = eigval / total_var
+    if self.n_components_ < n_features:
+      self.noise_variance_ = (total_var - np.sum(eigval)) / \
+          (n_features - self.n_components_) / n
+    else:
+      self.noise_variance_ = 0.
+    self._cache_batches = []
+    self._nb_cached_samples = 0
+    return self
+
   def transform(self, X, n_components=None):
     # ====== check number of components ====== #
     # specified percentage of explained variance
@@ -1079,8 +1259,18 @@ class MiniBatchPCA(IncrementalPCA):
   def invert_transform(self, X):
     return super(MiniBatchPCA, self).inverse_transform(X=X)
 
-  def transform_mpi(self, X, keep_order=True, ncpu=4, n_components=None):
-    """ Sample as transform but using multiprocessing """
+  def transform_mpi(self,
+                    X,
+                    keep_order=True,
+                    ncpu=4,
+                    n_components=None,
+                    pool=None):
+    """ Sample as transform but using multiprocessing
+
+    `pool` could be `True` or an `odin.utils.mpi.WorkerPool` for reusing
+    persistent processes, in which case `X` must be pickle-able (e.g.
+    `numpy.ndarray` or `MmapArray`).
+    """
     n = X.shape[0]
     if self.batch_size is None:
       batch_size = 12 * len(self.mean_)
@@ -1091,22 +1281,17 @@ class MiniBatchPCA(IncrementalPCA):
                   if i < n]
 
     # ====== run MPI jobs ====== #
-    def map_func(batch):
-      start, end = batch
-      x = super(MiniBatchPCA, self).transform(X=X[start:end])
-      # doing dim reduction here save a lot of memory for
-      # inter-processors transfer
-      if n_components is not None:
-        x = x[:, :n_components]
-      # just need to return the start for ordering
-      yield start, x
-
+    map_func = partial(_pca_transform_batch,
+                       pca=self,
+                       X=X,
+                       n_components=n_components)
     mpi = MPI(batch_list,
               func=map_func,
               ncpu=ncpu,
               batch=1,
               hwm=ncpu * 12,
-              backend='python')
+              backend='python',
+              pool=pool)
     # ====== process the return ====== #
     X_transformed = []
     for start, x in mpi:
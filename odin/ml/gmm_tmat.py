@@ -5,6 +5,7 @@ __author__ = 'Omid Sadjadi, Timothee Kheyrkhah'
 __email__ = 'omid.sadjadi@nist.gov'
 Modification and GPU-implementation by TrungNT
 """
+import multiprocessing
 import os
 import pickle
 import random
@@ -14,15 +15,15 @@ from collections import Mapping, OrderedDict, defaultdict
 
 import numpy as np
 import tensorflow as tf
-from scipy import linalg
+from scipy import linalg, sparse
 from six import string_types
 
 from odin import backend as K
 from bigarray import MmapArray
 from odin.ml.base import BaseEstimator, DensityMixin, TransformerMixin
-from odin.utils import (MPI, Progbar, array_size, as_tuple, batching, cpu_count,
-                        ctext, defaultdictkey, eprint, is_number, segment_list,
-                        uuid, wprint)
+from odin.utils import (MPI, Progbar, SharedCounter, array_size, as_tuple,
+                        batching, cpu_count, ctext, defaultdictkey, eprint,
+                        is_number, segment_list, uuid, wprint)
 
 EPS = 1e-6
 # minimum batch size that will be optimal to transfer
@@ -99,6 +100,38 @@ def logsumexp(X, axis):
   return y
 
 
+def _dot(a, b):
+  """ `numpy.dot` which also accepts `scipy.sparse` matrix for
+  either argument, always return `numpy.ndarray` """
+  if sparse.issparse(a):
+    y = a.dot(b)
+  elif sparse.issparse(b):
+    y = b.T.dot(a.T).T
+  else:
+    return np.dot(a, b)
+  return y.toarray() if sparse.issparse(y) else np.asarray(y)
+
+
+def _densify(x):
+  return x.toarray() if sparse.issparse(x) else x
+
+
+def _inverse_spd(L):
+  """ In-place inverse of a stack of symmetric positive definite matrices
+  [n, d, d] from their Cholesky factors (LAPACK `potrf` and `potri`, about
+  half the cost of a general `inv`), only the lower triangles are read """
+  potrf, potri = linalg.get_lapack_funcs(('potrf', 'potri'), (L,))
+  for i in range(L.shape[0]):
+    C, info = potrf(L[i], lower=1, clean=0)
+    if info == 0:
+      L[i], info = potri(C, lower=1)
+    if info != 0:
+      raise np.linalg.LinAlgError("Matrix is not positive definite")
+  itril = np.tril_indices(L.shape[1])
+  L[(slice(None),) + itril[::-1]] = L[(slice(None),) + itril]
+  return L
+
+
 def _split_jobs(n_samples, ncpu, device, gpu_factor):
   """ Return: jobs_cpu, jobs_gpu"""
   # number of GPU
@@ -264,6 +297,51 @@ class _ExpectationResults(object):
     finally:
       self.lock.release()
 
+def _split_indices(jobs, indices):
+  """ Convert the frame ranges `jobs` into lists of
+  `(name, (start, end))` with approximately the same number of frames,
+  `indices` is consumed in-place """
+  new_jobs = []
+  for s, e in jobs:
+    j = []
+    n = e - s
+    while n > 0 and len(indices) >= 1:
+      tmp = indices.pop()
+      n -= tmp[1][1] - tmp[1][0]
+      j.append(tmp)
+    new_jobs.append(j)
+  return new_jobs
+
+def _tree_reduce_worker(rank, n_workers, job, map_func, buffer, ready, counter):
+  """ Accumulate the statistics of `job` into row `rank` of the shared
+  `buffer`, then sum the rows pairwise: at each level, worker `rank` waits
+  for the worker `rank + stride` to finish its subtree and absorbs its row,
+  the total ends up in row 0 after `log2(n_workers)` levels """
+  stats = np.frombuffer(buffer, dtype='float64').reshape(n_workers, -1)
+  for res in map_func(job):
+    if is_number(res):
+      counter.add(int(res))
+    else:
+      stats[rank] = res
+  stride = 1
+  while rank % (2 * stride) == 0 and rank + stride < n_workers:
+    ready[rank + stride].wait()
+    stats[rank] += stats[rank + stride]
+    stride *= 2
+  ready[rank].set()
+
+def _online_update(stats, new_stats, n_steps, learning_offset,
+                   learning_decay):
+  """ Stepwise EM: interpolate the running (normalized) sufficient
+  statistics with the statistics of new mini-batch, the step size is
+  `(learning_offset + n_steps) ^ -learning_decay`, the first step
+  always replaces the running statistics """
+  if stats is None or n_steps == 0:
+    return [np.array(i) for i in new_stats]
+  rho = np.power(learning_offset + n_steps, -learning_decay)
+  return [(1. - rho) * old + rho * new
+          for old, new in zip(stats, new_stats)]
+
 # ===========================================================================
 # Main GMM
 # ===========================================================================
@@ -309,6 +387,26 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
       each iteration => the training is stochastic.
       if False, a deterministic selection of data is performed
       each iteration => the training is deterministic.
+  top_c : {None, int}
+      if given, Kaldi-style Gaussian selection: only the `top_c`
+      components with highest log-probability are kept for each frame,
+      the posteriors are renormalized over these components and the
+      statistics are accumulated from sparse posteriors, only applied
+      for extracting statistics (i.e. `transform`, `transform_to_disk`
+      and `segment_stats` on CPU), the EM training remains dense
+  out_of_core : bool (default: False)
+      if True and the training data is a `bigarray.MmapArray`, the
+      CPU Expectation is run by `ncpu` processes, each opens the
+      feature file by itself, accumulates the statistics of a disjoint
+      range of frames, and the statistics are summed by a tree reduction
+      in shared memory, hence, no features or statistics are sent
+      between processes
+  learning_decay : float (default: 0.6)
+      the step size of `partial_fit` decays as
+      `(learning_offset + n_steps) ^ -learning_decay`, should be in
+      (0.5, 1.] to guarantee convergence
+  learning_offset : float (default: 1.)
+      a (positive) parameter that downweights early steps of `partial_fit`
   seed : int
       random seed for reproducible
   path : {str, None}
@@ -342,7 +440,8 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
                allow_rollback=True, exit_on_error=False,
                batch_size_cpu='auto', batch_size_gpu='auto',
                downsample=1, stochastic_downsample=True,
-               device='cpu', ncpu=1, gpu_factor=80,
+               device='cpu', ncpu=1, gpu_factor=80, top_c=None,
+               out_of_core=False, learning_decay=0.6, learning_offset=1.,
                seed=1234, path=None, name=None):
     super(GMM, self).__init__()
     self._path = path if isinstance(path, string_types) else None
@@ -370,6 +469,14 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     self.ncpu = int(ncpu)
     # device
     self.set_device(device)
+    # Gaussian selection
+    self.top_c = None if top_c is None else int(top_c)
+    self.out_of_core = bool(out_of_core)
+    # stepwise EM
+    self.learning_decay = float(learning_decay)
+    self.learning_offset = float(learning_offset)
+    self._online_stats = None
+    self._online_step = 0
     # ====== state variable ====== #
     # store history of {nmix -> [llk_1, llk_2] ...}
     self._llk_hist = defaultdict(list)
@@ -397,9 +504,15 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
             self.downsample, self.stochastic_downsample,
             self._seed, self._llk_hist,
             self.ncpu, self._device, self.gpu_factor,
-            self._dtype, self._path, self._name)
+            self._dtype, self._path, self._name, self.top_c,
+            self.out_of_core, self.learning_decay, self.learning_offset,
+            self._online_stats, self._online_step)
 
   def __setstate__(self, states):
+    # GMM saved by older version, fill in the default for the new
+    # attributes (i.e. top_c, out_of_core and stepwise EM)
+    defaults = (None, False, 0.6, 1., None, 0)
+    states = tuple(states) + defaults[len(states) - 21:]
     (self.mean, self.sigma, self.w,
      self.allow_rollback, self.exit_on_error,
      self._nmix, self._curr_nmix, self._feat_dim,
@@ -407,7 +520,9 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
      self.downsample, self.stochastic_downsample,
      self._seed, self._llk_hist,
      self.ncpu, self._device, self.gpu_factor,
-     self._dtype, self._path, self._name) = states
+     self._dtype, self._path, self._name, self.top_c,
+     self.out_of_core, self.learning_decay, self.learning_offset,
+     self._online_stats, self._online_step) = states
     # basic constants
     self._stop_fitting = False
     self._feat_const = self.feat_dim * np.log(2 * np.pi)
@@ -563,7 +678,7 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     indices = None
     if isinstance(X, (tuple, list)):
       tmp = [i for i in X if hasattr(i, 'shape')][0]
-      indices = [i for i in X if i != tmp][0]
+      indices = [i for i in X if i is not tmp][0]
       X = tmp
     # ====== check X ====== #
     if not isinstance(X, np.ndarray):
@@ -673,17 +788,13 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     else:
       X = data
     # ====== start GMM ====== #
-    # supports 16384 components, modify for more components
-    niter = [1, 2, 4, 4, 4, 4, 6, 6, 10, 10, 10, 10, 10, 16, 16]
-    niter[int(np.log2(self._nmix))] = self._niter
     self._stop_fitting = False
     # run the algorithm
     while True:
       # fitting the mixtures
       curr_nmix = self._curr_nmix
       last_niter = len(self._llk_hist[curr_nmix])
-      idx = int(np.log2(curr_nmix))
-      curr_niter = niter[idx] - last_niter
+      curr_niter = self._get_niter(curr_nmix) - last_niter
       if curr_niter > 0:
         for i in range(curr_niter):
           self.expectation_maximization(X, sad=sad, print_progress=True)
@@ -698,6 +809,59 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
         break
     return self
 
+  def partial_fit(self, X, y=None, sad=None):
+    """ Stepwise (online) EM with a single mini-batch `X`.
+
+    The normalized sufficient statistics of `X` are interpolated with the
+    running statistics (see `learning_decay` and `learning_offset`), then
+    the parameters are re-estimated from the running statistics, hence,
+    the training could be continued when new data arrives. The mixtures
+    are doubled after the same number of steps as the number of
+    iterations used by `fit` for each stage.
+
+    Parameters
+    ----------
+    X : numpy.ndarray [n_samples, feat_dim]
+      mini-batch of features, it is recommended to shuffle the data so
+      each mini-batch contains frames from many utterances
+    sad : {None, numpy.ndarray}
+      frame selection for `X`
+    """
+    self.initialize(X)
+    curr_nmix = self._curr_nmix
+    Z, F, S, L = self.expectation(X, sad=sad, device=self._device,
+                                  print_progress=False)
+    nframes = Z.sum()
+    if nframes <= 0:
+      return self
+    self._online_stats = _online_update(self._online_stats,
+                                        (Z / nframes, F / nframes,
+                                         S / nframes),
+                                        n_steps=self._online_step,
+                                        learning_offset=self.learning_offset,
+                                        learning_decay=self.learning_decay)
+    self._online_step += 1
+    # the M-step is invariant to the scale of the statistics, rescale to
+    # the mini-batch size so `EPS` stays negligible
+    self.maximization(*[i * nframes for i in self._online_stats])
+    self._llk_hist[curr_nmix].append(L)
+    # ====== double the mixtures ====== #
+    if curr_nmix < self._nmix and \
+    len(self._llk_hist[curr_nmix]) >= self._get_niter(curr_nmix):
+      self.gmm_mixup()
+    # ====== save the checkpoint ====== #
+    elif self.path is not None:
+      with open(self.path, 'wb') as f:
+        pickle.dump(self, f)
+    return self
+
+  def _get_niter(self, nmix):
+    """ Number of EM iterations for the stage with `nmix` mixtures """
+    # supports 16384 components, modify for more components
+    niter = [1, 2, 4, 4, 4, 4, 6, 6, 10, 10, 10, 10, 10, 16, 16]
+    niter[int(np.log2(self._nmix))] = self._niter
+    return niter[int(np.log2(nmix))]
+
   def score(self, X, y=None):
     """ Compute the log-likelihood of each example to
     the Mixture of Components.
@@ -705,7 +869,8 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     post = self.logprob(X)  # (batch_size, nmix)
     return logsumexp(post, axis=1) # (batch_size, 1)
 
-  def transform(self, X, zero=True, first=True, device=None):
+  def transform(self, X, zero=True, first=True, device=None,
+                gselect=None, return_sparse=False):
     """ Compute centered statistics given X and fitted mixtures
 
     Parameters
@@ -719,6 +884,12 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
       if True, return the first order statistics
     device : {None, 'cpu', 'gpu'}
       select device for execute the expectation calculation
+    gselect : {None, ndarray [n_samples, top_c]}
+      cached Gaussian selection (see `GMM.gselect`)
+    return_sparse : bool (default: False)
+      if True, return the statistics as `scipy.sparse.csr_matrix`,
+      only the selected components are non-zeros when `top_c` is used,
+      (`Tmatrix` accepts sparse statistics)
 
     Return
     ------
@@ -744,27 +915,73 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     # ====== expectation ====== #
     Z = None
     F = None; F_hat = None
-    results = self._fast_expectation(X, zero=zero, first=first,
+    # Gaussian selection is only supported on CPU
+    on_gpu = device != 'cpu' and gselect is None and self.top_c is None
+    # centered first order statistics need the zero-th order
+    results = self._fast_expectation(X, zero=True, first=first,
                                      second=False, llk=False,
-                                     on_gpu=device != 'cpu')
+                                     on_gpu=on_gpu, top_c=self.top_c,
+                                     gselect=gselect)
+    to_output = sparse.csr_matrix if return_sparse else (lambda x: x)
     # ====== return the results ====== #
-    if zero and first:
+    if first:
       Z, F = results
       # this equal to: .ravel()[np.newaxis, :]
       F_hat = np.reshape(F - self.mean * Z,
-                         newshape=(1, self.feat_dim * self._curr_nmix),
+                         (1, self.feat_dim * self._curr_nmix),
                          order='F')
-      return Z, F_hat
-    elif zero and not first:
-      Z = results
-      return Z
-    elif not zero and first:
-      F = results
-      # this equal to: .ravel()[np.newaxis, :]
-      F_hat = np.reshape(F - self.mean * Z,
-                         newshape=(1, self.feat_dim * self._curr_nmix),
-                         order='F')
-      return F_hat
+      if zero:
+        return to_output(Z), to_output(F_hat)
+      return to_output(F_hat)
+    return to_output(results)
+
+  def segment_stats(self, X, segment_ids, n_segments, gselect=None):
+    """ Zero and first order statistics of many segments (e.g. utterances)
+    packed into a single block of frames, the posteriors of all frames are
+    computed by one GEMM, then the statistics are scatter-added to their
+    segment by sparse products (i.e. no tiny matrix product per segment).
+
+    Parameters
+    ----------
+    X : ndarray [n_frames, feat_dim]
+      all frames of the block
+    segment_ids : ndarray [n_frames,]
+      index of the segment of each frame, in range `[0, n_segments)`
+    n_segments : int
+      number of segments
+    gselect : {None, ndarray [n_frames, top_c]}
+      cached Gaussian selection (see `GMM.gselect`), otherwise,
+      `GMM.top_c` is used if given
+
+    Return
+    ------
+    zero-th statistics: [n_segments, nmix]
+    first statistics: [n_segments, feat_dim * nmix]
+      centered, in the same order as `GMM.transform`
+    """
+    n_frames, feat_dim = X.shape
+    nmix = self._curr_nmix
+    segment_ids = np.asarray(segment_ids, dtype='int64')
+    # ====== posteriors of the whole block ====== #
+    _, post = self._posterior(X, X ** 2, top_c=self.top_c, gselect=gselect)
+    # ====== scatter-add to each segment ====== #
+    # indicator [n_segments, n_frames]
+    indicator = sparse.csr_matrix(
+        (np.ones((n_frames,), dtype=post.dtype),
+         (segment_ids, np.arange(n_frames))),
+        shape=(n_segments, n_frames))
+    Z = _dot(indicator, post)
+    # frame `i` is placed at the columns of its segment:
+    # [n_frames, n_segments * feat_dim]
+    scatter = sparse.csr_matrix(
+        (X.ravel(),
+         (segment_ids[:, None] * feat_dim + np.arange(feat_dim)).ravel(),
+         np.arange(0, n_frames * feat_dim + 1, feat_dim)),
+        shape=(n_frames, n_segments * feat_dim))
+    F = _dot(scatter.T, post).reshape(n_segments, feat_dim, nmix)
+    F -= self.mean[None, :, :] * Z[:, None, :]
+    F = np.transpose(F, (0, 2, 1)).reshape(n_segments, nmix * feat_dim)
+    return Z, F
 
   def transform_to_disk(self, X, indices, sad=None,
                         pathZ=None, pathF=None, name_path=None,
@@ -994,8 +1211,67 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     llk = logsumexp(logprob, axis=1) # (batch_size, 1)
     return llk
 
+  def gselect(self, X, top_c=None):
+    """ Gaussian selection: the shortlist of `top_c` components with the
+    highest log-probability for each frame, could be cached and given to
+    `transform`, `segment_stats` or `_fast_expectation` as `gselect` to
+    skip the scoring of all components.
+
+    Return
+    ------
+    indices : ndarray [n_samples, top_c] (int32)
+    """
+    top_c = self.top_c if top_c is None else int(top_c)
+    if top_c is None:
+      raise ValueError("`top_c` must be given for Gaussian selection")
+    top_c = min(top_c, self._curr_nmix)
+    logprob = self.logprob(X)
+    return np.argpartition(-logprob, top_c - 1,
+                           axis=1)[:, :top_c].astype('int32')
+
+  def _posterior(self, X, X_2, top_c=None, gselect=None):
+    """ CPU posteriors
+
+    Return
+    ------
+    llk : ndarray [n_samples, 1]
+    post : ndarray [n_samples, nmix], or `scipy.sparse.csr_matrix` with
+      `top_c` non-zeros per row if `top_c` or `gselect` is given
+    """
+    precision = self.__expressions_cpu['precision']
+    mu_precision = self.__expressions_cpu['mu_precision']
+    C = self.__expressions_cpu['C']
+    nmix = self._curr_nmix
+    # ====== only score the cached shortlist ====== #
+    if gselect is not None:
+      cols = np.asarray(gselect)
+      # (n_samples, top_c, feat_dim)
+      D = np.einsum('nd,ncd->nc', X_2, precision.T[cols]) - \
+          2 * np.einsum('nd,ncd->nc', X, mu_precision.T[cols]) + \
+          self._feat_const
+      logprob = -0.5 * (C[0][cols] + D)
+      LLK = logsumexp(logprob, axis=1)
+    # ====== score all components ====== #
+    else:
+      D = np.dot(X_2, precision) - \
+          2 * np.dot(X, mu_precision) + \
+          self._feat_const
+      logprob = -0.5 * (C + D)
+      LLK = logsumexp(logprob, axis=1) # (batch_size, 1)
+      if top_c is None or top_c >= nmix:
+        return LLK, np.exp(logprob - LLK)
+      cols = np.argpartition(-logprob, top_c - 1, axis=1)[:, :top_c]
+      logprob = np.take_along_axis(logprob, cols, axis=1)
+    # ====== sparse posteriors, renormalized over the shortlist ====== #
+    post = np.exp(logprob - logsumexp(logprob, axis=1))
+    n, c = post.shape
+    post = sparse.csr_matrix(
+        (post.ravel(), cols.ravel(), np.arange(0, n * c + 1, c)),
+        shape=(n, nmix))
+    return LLK, post
+
   def _fast_expectation(self, X, zero=True, first=True, second=True,
-                        llk=True, on_gpu=False):
+                        llk=True, on_gpu=False, top_c=None, gselect=None):
     # ====== run on GPU ====== #
     if on_gpu:
       Z, F, S, L = [self.__expressions_gpu[name]
@@ -1011,28 +1287,19 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     # ====== run on numpy ====== #
     else:
       results = []
-      # (feat_dim, nmix)
-      precision = self.__expressions_cpu['precision']
-      mu_precision = self.__expressions_cpu['mu_precision']
-      C = self.__expressions_cpu['C']
       X_2 = X ** 2
-      D = np.dot(X_2, precision) - \
-          2 * np.dot(X, mu_precision) + \
-          self._feat_const
-      # (batch_size, nmix)
-      logprob = -0.5 * (C + D)
-      # ====== posterior and likelihood ====== #
-      LLK = logsumexp(logprob, axis=1) # (batch_size, 1)
-      post = np.exp(logprob - LLK) # (batch_size, nmix)
+      LLK, post = self._posterior(
+          X, X_2, top_c=top_c, gselect=gselect)
       # ====== expectation ====== #
       if zero:
-        Z = zeroStat(post)
+        Z = np.asarray(post.sum(axis=0)) if sparse.issparse(post) else \
+            zeroStat(post)
         results.append(Z)
       if first:
-        F = firstStat(X, post)
+        F = _dot(X.T, post)
         results.append(F)
       if second:
-        S = np.dot(X_2.T, post) # dont calculate X**2 again
+        S = _dot(X_2.T, post) # dont calculate X**2 again
         results.append(S)
       if llk:
         L = np.sum(LLK, axis=None)
@@ -1119,6 +1386,11 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     # ====== mapping method ====== #
     curr_niter = len(self._llk_hist[self._curr_nmix])
     curr_nmix = self._curr_nmix
+    if self.out_of_core and device == 'cpu' and isinstance(X, MmapArray):
+      Z, F, S, L, nfr = self._out_of_core_expectation(
+          X, sad, indices, n_samples, print_progress)
+      return self._pack_expectation(Z, F, S, L, nfr,
+                                    zero, first, second, llk)
 
     def map_expectation(start_end_gpu):
       reduction = np.floor(np.power(2, curr_nmix / 1024))
@@ -1169,27 +1441,8 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     if indices is not None:
       indices = list(indices)
       # convert GPU jobs first as priority
-      new_gpu_jobs = []
-      for s, e in jobs_gpu:
-        j = []
-        n = e - s
-        while n > 0 and len(indices) >= 1:
-          tmp = indices.pop()
-          n -= tmp[1][1] - tmp[1][0]
-          j.append(tmp)
-        new_gpu_jobs.append(j)
-      jobs_gpu = new_gpu_jobs
-      # convert CPU jobs
-      new_cpu_jobs = []
-      for s, e in jobs_cpu:
-        j = []
-        n = e - s
-        while n > 0 and len(indices) >= 1:
-          tmp = indices.pop()
-          n -= tmp[1][1] - tmp[1][0]
-          j.append(tmp)
-        new_cpu_jobs.append(j)
-      jobs_cpu = new_cpu_jobs
+      jobs_gpu = _split_indices(jobs_gpu, indices)
+      jobs_cpu = _split_indices(jobs_cpu, indices)
     # ====== run multiprocessing ====== #
     # Z, F, S, L, nfr
     results = _ExpectationResults(n_samples=n_samples, nb_results=5,
@@ -1216,8 +1469,11 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
     # finish all threads
     for t in gpu_threads:
       t.join()
-    # ====== summary ====== #
     Z, F, S, L, nfr = results.stats
+    return self._pack_expectation(Z, F, S, L, nfr,
+                                  zero, first, second, llk)
+
+  def _pack_expectation(self, Z, F, S, L, nfr, zero, first, second, llk):
     L = L / nfr if nfr > 0 else 0
     results = []
     if zero:
@@ -1230,6 +1486,110 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
       results.append(L)
     return results[0] if len(results) == 1 else results
 
+  def _out_of_core_expectation(self, X, sad, indices, n_samples,
+                               print_progress):
+    """ Each process memory-maps `X` from its path and accumulates the
+    statistics of a disjoint range of frames, the statistics are summed
+    by `_tree_reduce_worker` in a shared buffer
+
+    Return
+    ------
+    Z, F, S, L, nfr
+    """
+    path = X.filename
+    curr_niter = len(self._llk_hist[self._curr_nmix])
+    curr_nmix = self._curr_nmix
+    feat_dim = self.feat_dim
+    batch_size = int(self.batch_size_cpu /
+                     np.floor(np.power(2, curr_nmix / 1024)))
+    # ====== split the frames ====== #
+    ncpu = max(1, min(self.ncpu, n_samples))
+    jobs = np.linspace(start=0, stop=n_samples, num=ncpu + 1, dtype='int64')
+    jobs = list(zip(jobs, jobs[1:]))
+    if indices is not None:
+      jobs = _split_indices(jobs, list(indices))
+
+    def map_expectation(job):
+      # each process opens its own memory-map
+      X = MmapArray(path)
+      if indices is None:
+        start, end = job
+        batch_iterator = _create_batch(X, sad, start, end,
+            batch_size=batch_size,
+            downsample=self.downsample,
+            stochastic=self.stochastic_downsample,
+            seed=self._seed,
+            curr_nmix=curr_nmix,
+            curr_niter=curr_niter)
+      else:
+        batch_iterator = _create_batch_indices(X, sad, job,
+            batch_size=batch_size,
+            downsample=self.downsample,
+            stochastic=self.stochastic_downsample,
+            seed=self._seed,
+            curr_nmix=curr_nmix,
+            curr_niter=curr_niter)
+      # Z, F, S, L, n_frames packed in float64
+      stats = np.zeros((2 * feat_dim + 1) * curr_nmix + 2, dtype='float64')
+      Z = stats[:curr_nmix]
+      F = stats[curr_nmix:(feat_dim + 1) * curr_nmix]
+      S = stats[(feat_dim + 1) * curr_nmix:-2]
+      for y, n_selected_frame, n_original_sample in batch_iterator:
+        if y is not None and n_selected_frame > 0:
+          z, f, s, l = self._fast_expectation(y, on_gpu=False)
+          Z += np.ravel(z)
+          F += np.ravel(f)
+          S += np.ravel(s)
+          stats[-2] += l
+          stats[-1] += n_selected_frame
+        yield n_original_sample
+      yield stats
+
+    # ====== start the processes ====== #
+    n_workers = len(jobs)
+    size = int((2 * feat_dim + 1) * curr_nmix + 2)
+    buffer = multiprocessing.RawArray('d', n_workers * size)
+    ready = [multiprocessing.Event() for _ in range(n_workers)]
+    counter = SharedCounter()
+    processes = [
+        multiprocessing.Process(target=_tree_reduce_worker,
+                                args=(rank, n_workers, job, map_expectation,
+                                      buffer, ready, counter))
+        for rank, job in enumerate(jobs)
+    ]
+    for p in processes:
+      p.start()
+    # ====== wait for the reduction ====== #
+    prog = Progbar(target=n_samples, print_report=True, print_summary=False,
+                   name="[GMM] cmix:%d nmix:%d ndim:%d iter:%d" %
+                   (curr_nmix, self.nmix, self.feat_dim, curr_niter + 1))
+    n_processed = 0
+    try:
+      while not ready[0].wait(timeout=0.1):
+        if any(p.exitcode not in (None, 0) for p in processes):
+          raise RuntimeError("[GMM] Out-of-core Expectation process failed "
+                             "with exit code: %s" %
+                             str([p.exitcode for p in processes]))
+        if print_progress:
+          n = counter.value
+          prog.add(n - n_processed)
+          n_processed = n
+    finally:
+      for p in processes:
+        if p.is_alive() and not ready[0].is_set():
+          p.terminate()
+        p.join()
+    if print_progress:
+      prog.add(counter.value - n_processed)
+    # ====== unpack the statistics ====== #
+    stats = np.frombuffer(buffer, dtype='float64', count=size)
+    Z = stats[:curr_nmix].reshape(1, curr_nmix)
+    F = stats[curr_nmix:(feat_dim + 1) * curr_nmix].reshape(feat_dim,
+                                                            curr_nmix)
+    S = stats[(feat_dim + 1) * curr_nmix:-2].reshape(feat_dim, curr_nmix)
+    return (Z.astype(self.dtype), F.astype(self.dtype), S.astype(self.dtype),
+            float(stats[-2]), int(stats[-1]))
+
   def maximization(self, Z, F, S, floor_const=None):
     """
     Parameters
@@ -1329,6 +1689,9 @@ class GMM(DensityMixin, BaseEstimator, TransformerMixin):
       self.w = self.w[:, :self.nmix]
     # update current number of mixture information
     self._curr_nmix = min(2 * self._curr_nmix, self.nmix)
+    # the running statistics of stepwise EM are for the old mixtures
+    self._online_stats = None
+    self._online_step = 0
     self._refresh_gpu_posterior()
     self._resfresh_cpu_posterior()
     # ====== save the checkpoint ====== #
@@ -1376,6 +1739,11 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
       (i.e. `njob_gpu = gpu_factor * njob_cpu`)
   cache_path : str
     path to cache folder when fitting
+  learning_decay : float (default: 0.6)
+      the step size of `partial_fit` decays as
+      `(learning_offset + n_steps) ^ -learning_decay`
+  learning_offset : float (default: 1.)
+      a (positive) parameter that downweights early steps of `partial_fit`
   seed : int
       random seed for reproducible
   path : {str, None}
@@ -1404,6 +1772,9 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
   You should increase the `batch_size` instead of `ncpu` if there
   are idle resources.
 
+  On CPU, the posterior covariances of a block of utterances are
+  Cholesky-inverted in a single stacked call.
+
   """
 
   STANDARD_CPU_BATCH_SIZE = 64 * 1024 * 1024 # 64 Megabytes
@@ -1412,8 +1783,8 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
   def __init__(self, tv_dim, gmm, niter=16, dtype='float64',
                batch_size_cpu='auto', batch_size_gpu='auto',
                device='mix', ncpu=1, gpu_factor=3,
-               cache_path='/tmp', seed=1234,
-               path=None, name=None):
+               cache_path='/tmp', learning_decay=0.6, learning_offset=1.,
+               seed=1234, path=None, name=None):
     super(Tmatrix, self).__init__()
     if not (isinstance(gmm, GMM) and gmm.is_initialized and gmm.is_fitted):
       raise ValueError("`gmm` must be instance of odin.ml.gmm.GMM "
@@ -1460,6 +1831,11 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
       ncpu = cpu_count() // 2
     self.ncpu = int(ncpu)
     self.gpu_factor = int(gpu_factor)
+    # ====== stepwise EM ====== #
+    self.learning_decay = float(learning_decay)
+    self.learning_offset = float(learning_offset)
+    self._online_stats = None
+    self._online_step = 0
     # ====== load ubm ====== #
     self.Im = np.eye(self.tv_dim, dtype=self.dtype)
     self.Sigma = np.array(
@@ -1486,16 +1862,23 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
             self.batch_size_cpu, self.batch_size_gpu,
             self.niter, self.ncpu, self._device, self.gpu_factor,
             self.cache_path, self._dtype,
-            self._is_fitted, self._path, self._name)
+            self._is_fitted, self._path, self._name,
+            self.learning_decay, self.learning_offset,
+            self._online_stats, self._online_step)
 
   def __setstate__(self, states):
+    # Tmatrix saved before stepwise EM was introduced
+    if len(states) == 21:
+      states = tuple(states) + (0.6, 1., None, 0)
     (self.Im, self.Sigma, self.Tm, self._gmm,
      self._tv_dim, self._t2_dim, self._feat_dim, self._nmix,
      self._seed, self._llk_hist,
      self.batch_size_cpu, self.batch_size_gpu,
      self.niter, self.ncpu, self._device, self.gpu_factor,
      self.cache_path, self._dtype,
-     self._is_fitted, self._path, self._name) = states
+     self._is_fitted, self._path, self._name,
+     self.learning_decay, self.learning_offset,
+     self._online_stats, self._online_step) = states
     # ====== re-init ====== #
     self.T_invS_Tt = np.empty((self.nmix, self.t2_dim), dtype=self.dtype)
     self._itril = np.tril_indices(self.tv_dim)
@@ -1691,37 +2074,61 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
       self._gpu_m_inputs = [LU, RU]
       self._gpu_m_outputs = Tm
 
+  @property
+  def _solver_batch_size(self):
+    """ Number of utterances solved together, keep the stacked
+    `(tv_dim, tv_dim)` matrices within `STANDARD_CPU_BATCH_SIZE` """
+    return max(1, Tmatrix.STANDARD_CPU_BATCH_SIZE //
+               (3 * self.tv_dim ** 2 * self.dtype.itemsize))
+
+  def _inverse_precision(self, Z):
+    """ Posterior covariance of the i-vector for each row of `Z`, i.e.
+    `Cxx = (I + sum_c Z_c * T_c' * Sigma_c^-1 * T_c)^-1`
+
+    The lower triangles of the precision matrices of all rows are
+    assembled from the packed `T_invS_Tt` with a single GEMM, then
+    inverted from their Cholesky factors (see `_inverse_spd`)
+
+    Return
+    ------
+    Cxx : numpy.ndarray [n_samples, tv_dim, tv_dim]
+    """
+    Z = _densify(Z)
+    L = np.zeros((Z.shape[0], self.tv_dim, self.tv_dim), dtype=self.dtype)
+    L[(slice(None),) + self._itril] = np.dot(Z, self.T_invS_Tt)
+    L += self.Im
+    return _inverse_spd(L)
+
   def _fast_expectation(self, Z, F, on_gpu):
+    """ `Z` and `F` could be `scipy.sparse` matrices (e.g. the statistics
+    from top-C Gaussian selection, see `GMM.transform`) """
     nframes = np.ceil(Z.sum())
     nfiles = F.shape[0]
     # ====== GPU ====== #
     if on_gpu:
       LU, RU, llk = K.eval(self._gpu_e_outputs,
         feed_dict={i: j for i, j in zip(self._gpu_e_inputs,
-                                        (Z, F, self.Tm, self.T_invS_Tt))}
+                                        (_densify(Z), _densify(F),
+                                         self.Tm, self.T_invS_Tt))}
       )
       return LU, RU, llk, nframes
     # ====== CPU ====== #
-    # (nfiles, tv_dim * (tv_dim + 1) / 2)
-    L1 = np.dot(Z, self.T_invS_Tt)
     # (nfiles, tv_dim)
-    B1 = np.dot(F, self.T_invS.T)
+    B1 = _dot(F, self.T_invS.T)
     Ex, Exx, llk = self._Ex_Exx_llk[nfiles]
-    for ix in range(nfiles):
-      L = np.zeros((self.tv_dim, self.tv_dim), dtype=self.dtype)
-      L[self._itril] = L1[ix]
-      L = L + np.tril(L, k=-1).T + self.Im
-      Cxx = linalg.inv(L)
-      B = B1[ix][:, np.newaxis]
-      this_Ex = np.dot(Cxx, B)
-      this_ExT = this_Ex.T
-      Ex[ix] = this_ExT
-      llk[ix] = -0.5 * this_ExT.dot(B - this_Ex) + this_ExT.dot(B)
-      Exx[ix] = (Cxx + this_Ex.dot(this_ExT))[self._itril]
+    i, j = self._itril
+    for s, e in batching(batch_size=self._solver_batch_size, n=nfiles):
+      Cxx = self._inverse_precision(Z[s:e])
+      B = B1[s:e]
+      this_Ex = np.einsum('nij,nj->ni', Cxx, B)
+      Ex[s:e] = this_Ex
+      llk[s:e, 0] = -0.5 * np.sum(this_Ex * (B - this_Ex), axis=1) + \
+          np.sum(this_Ex * B, axis=1)
+      Exx[s:e] = Cxx[:, i, j] + this_Ex[:, i] * this_Ex[:, j]
     # (tdim, nmix * feat_dim)
-    RU = np.dot(Ex.T, F)
+    RU = _dot(Ex.T, F)
     # (nmix, tdim * (tdim + 1) / 2)
-    LU = np.dot(Z.T, Exx)
+    LU = _dot(Z.T, Exx)
     return LU, RU, llk.sum(), nframes
 
   def expectation(self, Z, F, device=None, print_progress=True):
@@ -1894,6 +2301,42 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
         pickle.dump(self, f)
     return self
 
+  def partial_fit(self, X, y=None, device=None):
+    """ Stepwise (online) EM with a single mini-batch of utterances.
+
+    The statistics `LU`, `RU` and `nframes` normalized by the number of
+    utterances are interpolated with the running statistics (see
+    `learning_decay` and `learning_offset`), and the T-matrix is
+    re-estimated from the running statistics.
+
+    Parameters
+    ----------
+    X : {tuple, list}
+      Z-[n_samples, nmix]; F-[n_samples, nmix*feat_dim]
+    """
+    Z, F = X
+    nfiles = Z.shape[0]
+    if nfiles == 0:
+      return self
+    LU, RU, LLK, nframes = self.expectation(Z=Z, F=F, device=device,
+                                            print_progress=False)
+    self._online_stats = _online_update(self._online_stats,
+                                        (LU / nfiles, RU / nfiles,
+                                         nframes / nfiles),
+                                        n_steps=self._online_step,
+                                        learning_offset=self.learning_offset,
+                                        learning_decay=self.learning_decay)
+    self._online_step += 1
+    LU, RU, nframes = self._online_stats
+    self.maximization(LU, RU, nframes,
+                      min_div_est=True, orthogonalize=True)
+    self._llk_hist.append(LLK / nfiles)
+    # ====== save the checkpoint ====== #
+    if self.path is not None:
+      with open(self.path, 'wb') as f:
+        pickle.dump(self, f)
+    return self
+
   # ==================== sklearn ==================== #
   def transform(self, X):
     """ Extract i-vector from trained T-matrix
@@ -1902,12 +2345,12 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
     ----------
     X : {tuple, list, numpy.ndarray, odin.fuel.data.MmapArray}
       if tuple or list is given, the inputs include:
-      Z-[1, nmix]; F-[1, nmix*feat_dim]
+      Z-[1, nmix]; F-[1, nmix*feat_dim] (could be `scipy.sparse` matrices)
       if numpy.ndarray is given, shape must be [n_samples, feat_dim]
 
     Return
     ------
-    I-vector : (1, tv_dim)
+    I-vector : (n_samples, tv_dim)
 
     Note
     ----
@@ -1928,18 +2371,13 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
     else:
       Z, F = self.gmm.transform(X)
     # ====== pass ====== #
-    L = np.zeros((self.tv_dim, self.tv_dim),
-                 dtype=self.dtype)
-    L[self._itril] = np.dot(Z, self.T_invS_Tt)
-    L += np.tril(L, -1).T + self.Im
-    # (tv_dim, tv_dim)
-    Cxx = linalg.inv(L)
-    # (tv_dim, 1)
-    B = np.dot(self.T_invS, F.T)
-    # (tv_dim, 1)
-    Ex = np.dot(Cxx, B)
-    # (1, tv_dim)
-    return Ex.T
+    # (n_samples, tv_dim)
+    B1 = _dot(F, self.T_invS.T)
+    Ex = np.empty((Z.shape[0], self.tv_dim), dtype=self.dtype)
+    for s, e in batching(batch_size=self._solver_batch_size, n=Z.shape[0]):
+      Ex[s:e] = np.einsum('nij,nj->ni', self._inverse_precision(Z[s:e]),
+                          B1[s:e])
+    return Ex
 
   def transform_to_disk(self, Z, F, path=None,
                         dtype='float32', device='gpu', ncpu=None,
@@ -1998,8 +2436,8 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
     # ====== run on GPU ====== #
     if (device == 'gpu' or device == 'mix') and get_ngpu() > 0:
       for s, e in batching(batch_size=self.batch_size_gpu, n=n_samples):
-        z_minibatch = Z[s:e]
-        f_minibatch = F[s:e]
+        z_minibatch = _densify(Z[s:e])
+        f_minibatch = _densify(F[s:e])
         Ex = K.eval(self._gpu_t_outputs,
           feed_dict={i: j for i, j in zip(self._gpu_t_inputs,
                                           (z_minibatch, f_minibatch, self.Tm, self.T_invS_Tt))}
@@ -2009,31 +2447,17 @@ class Tmatrix(DensityMixin, BaseEstimator, TransformerMixin):
     # ====== run on CPU ====== #
     else:
       def extract_ivec(idx):
-        vecs = []
-        for i in idx:
-          L = np.zeros((self.tv_dim, self.tv_dim),
-                       dtype=self.dtype)
-          L[self._itril] = np.dot(Z[i:i + 1], self.T_invS_Tt)
-          L += np.tril(L, -1).T + self.Im
-          # (tv_dim, tv_dim)
-          Cxx = linalg.inv(L)
-          # (tv_dim, 1)
-          B = np.dot(self.T_invS, F[i:i + 1].T)
-          # (tv_dim, 1)
-          Ex = np.dot(Cxx, B)
-          # (1, tv_dim)
-          ivec = Ex.T
-          if ivec.dtype != dtype:
-            ivec = ivec.astype(dtype)
-          vecs.append((i, ivec))
-        return vecs
+        idx = np.asarray(idx)
+        ivec = self.transform((Z[idx], F[idx]))
+        if ivec.dtype != dtype:
+          ivec = ivec.astype(dtype)
+        return idx, ivec
       mpi = MPI(jobs=list(range(n_samples)), func=extract_ivec,
                 ncpu=self.ncpu if ncpu is None else int(ncpu),
                 batch=max(12, self.batch_size_cpu))
-      for vecs in mpi:
-        for i, v in vecs:
-          dat[i:i + 1] = v
-        prog.add(len(vecs))
+      for idx, vecs in mpi:
+        dat[idx] = vecs
+        prog.add(len(idx))
     # ====== flush and close ====== #
     if path is not None:
       dat.flush()
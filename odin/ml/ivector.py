@@ -2,79 +2,148 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import pickle
+from collections import Mapping
 
 import numpy as np
+from six import string_types
 
 from bigarray import MmapArray, MmapArrayWriter
 from odin.ml.base import BaseEstimator, DensityMixin, TransformerMixin
-from odin.ml.gmm_tmat import GMM, Tmatrix, _split_jobs
+from odin.ml.gmm_tmat import GMM, Tmatrix
 from odin.utils import (Progbar, UnitTimer, batching, crypto, ctext,
-                        is_primitive, mpi, uuid)
+                        is_primitive, uuid)
 
 
 # ===========================================================================
 # Helper
 # ===========================================================================
+def _iter_segment_blocks(X, sad, segments, block_size):
+  """ Pack the frames of many segments (i.e. utterances) into blocks of
+  about `block_size` frames, long segments are split across blocks.
+
+  Parameters
+  ----------
+  segments : {None, list of (start, end)}
+    if None, each row of `X` is a segment
+
+  Yield
+  -----
+  (frames, segment_ids, n_finished): the frames of the block, the index of
+  the segment of each frame, and the number of segments which are complete
+  after this block
+  """
+  if sad is not None:
+    sad = sad.ravel()
+  # ====== every row is a segment ====== #
+  if segments is None:
+    n_samples = X.shape[0]
+    for start in range(0, n_samples, block_size):
+      end = min(start + block_size, n_samples)
+      ids = np.arange(start, end)
+      x = X[start:end]
+      if sad is not None:
+        mask = sad[start:end].astype('bool')
+        x, ids = x[mask], ids[mask]
+      yield x, ids, end
+    return
+  # ====== pack the segments ====== #
+  buffer_x, buffer_ids, n_frames = [], [], 0
+  for seg_id, (start, end) in enumerate(segments):
+    for s in range(start, end, block_size):
+      e = min(s + block_size, end)
+      x = X[s:e]
+      if sad is not None:
+        x = x[sad[s:e].astype('bool')]
+      buffer_x.append(x)
+      buffer_ids.append(np.full((x.shape[0],), seg_id, dtype='int64'))
+      n_frames += x.shape[0]
+      if n_frames >= block_size:
+        yield (np.concatenate(buffer_x, axis=0),
+               np.concatenate(buffer_ids, axis=0),
+               seg_id + 1 if e == end else seg_id)
+        buffer_x, buffer_ids, n_frames = [], [], 0
+  if len(buffer_x) > 0:
+    yield (np.concatenate(buffer_x, axis=0),
+           np.concatenate(buffer_ids, axis=0), len(segments))
+
+
 def _extract_zero_and_first_stats(X, sad, indices, gmm, z_path, f_path,
                                   name_path):
-  n_samples = X.shape[0]
-  # indices is None, every row is single sample (utterance or image ...)
+  """ Batched Baum-Welch statistics: many utterances are packed into
+  large blocks of frames, the posteriors of each block are computed by a
+  single GEMM (`GMM.segment_stats`) and the statistics of finished
+  utterances are written directly to the `MmapArrayWriter` """
+  # ====== prepare the segments ====== #
   if indices is None:
-    if os.path.exists(z_path):
-      os.remove(z_path)
-    if os.path.exists(f_path):
-      os.remove(f_path)
-    Z = MmapArrayWriter(path=z_path,
-                        dtype='float32',
-                        shape=(n_samples, gmm.nmix),
-                        remove_exist=True)
-    F = MmapArrayWriter(path=f_path,
-                        dtype='float32',
-                        shape=(n_samples, gmm.feat_dim * gmm.nmix),
-                        remove_exist=True)
-    jobs, _ = _split_jobs(n_samples,
-                          ncpu=mpi.cpu_count(),
-                          device='cpu',
-                          gpu_factor=1)
-
-    def map_transform(start_end):
-      start, end = start_end
-      for i in range(start, end):
-        # removed by SAD
-        if sad is not None and not bool(sad[i]):
-          yield None, None, None
-        else:
-          z, f = gmm.transform(X[i][np.newaxis, :],
-                               zero=True,
-                               first=True,
-                               device='cpu')
-          yield i, z, f
-
-    prog = Progbar(target=n_samples,
-                   print_report=True,
-                   print_summary=False,
-                   name="Extracting zero and first order statistics")
-    for i, z, f in mpi.MPI(jobs, map_transform, ncpu=None, batch=1):
-      if i is not None:  # i None means removed by SAD
-        Z[i] = z
-        F[i] = f
-      prog.add(1)
-    Z.flush()
-    F.flush()
-    Z.close()
-    F.close()
-  # use directly the transform_to_disk function
+    names = None
+    segments = None
+    n_samples = X.shape[0]
   else:
-    gmm.transform_to_disk(X,
-                          indices=indices,
-                          sad=sad,
-                          pathZ=z_path,
-                          pathF=f_path,
-                          name_path=name_path,
-                          dtype='float32',
-                          device=None,
-                          ncpu=None,
-                          override=True)
+    if isinstance(indices, Mapping):
+      indices = sorted(indices.items(), key=lambda x: x[1][0])
+    names = [name for name, _ in indices]
+    segments = [(int(start), int(end)) for _, (start, end) in indices]
+    n_samples = len(segments)
+  if sad is not None:
+    assert sad.shape[0] == X.shape[0], \
+    "Number of samples in `X` (%d) and `sad` (%d) are mismatched" % \
+    (len(X), len(sad))
+  # ====== outputs ====== #
+  for path in (z_path, f_path):
+    if os.path.exists(path):
+      os.remove(path)
+  Z = MmapArrayWriter(path=z_path,
+                      dtype='float32',
+                      shape=(n_samples, gmm.nmix),
+                      remove_exist=True)
+  F = MmapArrayWriter(path=f_path,
+                      dtype='float32',
+                      shape=(n_samples, gmm.feat_dim * gmm.nmix),
+                      remove_exist=True)
+  # same reduction of the batch size for large number of mixtures
+  # as `GMM.transform_to_disk`
+  reduction = np.floor(np.power(2, gmm.nmix / 1024))
+  block_size = max(1, int(gmm.batch_size_cpu / reduction))
+  prog = Progbar(target=n_samples,
+                 print_report=True,
+                 print_summary=False,
+                 name="Extracting zero and first order statistics")
+  # ====== process the blocks ====== #
+  # statistics of the last unfinished segment: (segment_id, z, f)
+  carry = None
+  n_written = 0
+  for x, ids, n_finished in _iter_segment_blocks(X, sad, segments,
+                                                 block_size):
+    if x.shape[0] > 0:
+      first = int(ids[0])
+      z, f = gmm.segment_stats(x, ids - first, int(ids[-1]) - first + 1)
+      if carry is not None:
+        if carry[0] == first:
+          z[0] += carry[1]
+          f[0] += carry[2]
+        else:  # the rest of the segment was removed by SAD
+          Z.write(carry[1][None, :], start_position=carry[0])
+          F.write(carry[2][None, :], start_position=carry[0])
+      carry = None
+      # the last segment is continued in the next block
+      if int(ids[-1]) >= n_finished:
+        carry = (int(ids[-1]), z[-1], f[-1])
+        z, f = z[:-1], f[:-1]
+      if z.shape[0] > 0:
+        Z.write(z, start_position=first)
+        F.write(f, start_position=first)
+    prog.add(n_finished - n_written)
+    n_written = n_finished
+  if carry is not None:
+    Z.write(carry[1][None, :], start_position=carry[0])
+    F.write(carry[2][None, :], start_position=carry[0])
+  Z.flush()
+  F.flush()
+  Z.close()
+  F.close()
+  # ====== save the order of the files ====== #
+  if names is not None and isinstance(name_path, string_types):
+    np.savetxt(fname=name_path, X=names, fmt='%s')
 
 
 # ===========================================================================
@@ -98,6 +167,7 @@ class Ivector(DensityMixin, BaseEstimator, TransformerMixin):
                ncpu=1,
                gpu_factor_gmm=80,
                gpu_factor_tmat=3,
+               top_c=None,
                dtype='float32',
                seed=1234,
                name=None):
@@ -138,6 +208,7 @@ class Ivector(DensityMixin, BaseEstimator, TransformerMixin):
                         device=self.device,
                         ncpu=self.ncpu,
                         gpu_factor=self.gpu_factor_gmm,
+                        top_c=getattr(self, 'top_c', None),
                         seed=1234,
                         path=self.gmm_path,
                         name="IvecGMM_%s" %
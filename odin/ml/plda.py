@@ -14,7 +14,7 @@ from six import string_types
 from odin.backend import calc_white_mat, length_norm
 from odin.ml.base import BaseEstimator, Evaluable, TransformerMixin
 from odin.ml.scoring import (VectorNormalizer, compute_class_avg,
-                             compute_within_cov)
+                             compute_within_cov, score_trial_list)
 from odin.utils import unique
 
 
@@ -421,3 +421,32 @@ class PLDA(BaseEstimator, TransformerMixin, Evaluable):
     # [num_samples, num_classes]
     scores = score_h1h2 + score_h1.T + score_h2
     return scores
+
+  def _trial_vectors(self, X, enroll):
+    """ The log-likelihood ratio of a trial is
+    `2 * e' * Lambda * t + e' * Q_hat * e + t' * Q_hat * t`,
+    hence, the enrollment vectors are pre-multiplied by `2 * Lambda` """
+    X = np.dot(self.normalizer.transform(X), self.Uk_) # [num_samples, n_phi]
+    bias = np.sum(np.dot(X, self.Q_hat_) * X, axis=1)
+    if enroll:
+      X = 2 * np.dot(X, self.Lambda_)
+    return X, bias
+
+  def score_trials(self, enroll, test, trials, path=None,
+                   chunk_size=2**16, header=False):
+    """ Log-likelihood ratios of the listed (enroll_id, test_id) pairs,
+    see `odin.ml.scoring.score_trial_list`
+
+    Parameters
+    ----------
+    enroll : {Mapping, tuple}
+      'id' -> vector, or tuple of (ids, [nb_enroll, feat_dim])
+    test : {Mapping, tuple}
+      'id' -> vector, or tuple of (ids, [nb_test, feat_dim])
+    trials : {str, list, numpy.ndarray}
+      path to the trial file, or list of (enroll_id, test_id)
+    path : {str, None}
+      if given, the scores are written incrementally to this file
+    """
+    return score_trial_list(self, enroll, test, trials, path=path,
+                            chunk_size=chunk_size, header=header)
@@ -1,6 +1,9 @@
 from __future__ import print_function, division, absolute_import
 
+from collections import Mapping
+
 import numpy as np
+from six import string_types
 from scipy.linalg import eigh, cholesky, inv, svd, solve
 
 from sklearn.svm import SVC
@@ -91,6 +94,223 @@ def compute_wccn(X, y, classes=None, class_avg=None):
   Sw = Sw + 1e-6 * np.eye(Sw.shape[0])
   return calc_white_mat(Sw)
 
+# ===========================================================================
+# Trial-list scoring
+# ===========================================================================
+def _as_ids_matrix(X):
+  """ Return: list of ids and the matrix [nb_ids, feat_dim] """
+  if isinstance(X, Mapping):
+    ids = list(X.keys())
+    X = np.concatenate([np.reshape(x, (1, -1)) for x in X.values()], axis=0)
+  elif isinstance(X, (tuple, list)) and len(X) == 2:
+    ids, X = X
+    ids = list(ids)
+    X = np.asarray(X)
+  else:
+    raise ValueError("Embeddings must be a Mapping of 'id' -> vector, or "
+                     "a tuple of (ids, matrix), but given: %s" % str(type(X)))
+  if len(ids) != X.shape[0]:
+    raise ValueError("Number of ids (%d) and number of vectors (%d) "
+                     "mismatch" % (len(ids), X.shape[0]))
+  return ids, X
+
+def _iter_trials(trials, chunk_size, header):
+  """ Yield list of (enroll_id, test_id) with at most `chunk_size` trials,
+  a trial file is read line-by-line and only the first two columns are
+  used """
+  if isinstance(trials, string_types):
+    with open(trials, 'r') as f:
+      if header:
+        next(f, None)
+      chunk = []
+      for line in f:
+        line = line.split()
+        if len(line) < 2:
+          continue
+        chunk.append((line[0], line[1]))
+        if len(chunk) >= chunk_size:
+          yield chunk
+          chunk = []
+      if len(chunk) > 0:
+        yield chunk
+  else:
+    for start in range(0, len(trials), chunk_size):
+      yield trials[start:start + chunk_size]
+
+def score_trial_list(model, enroll, test, trials, path=None,
+                     chunk_size=2**16, header=False, dense_ratio=4.,
+                     normalizer=None):
+  """ Score only the listed pairs of a (sparse) trial list
+
+  The embeddings are projected once for each unique id (the projection
+  is defined by `model._trial_vectors`), the score of a trial is
+  `dot(enroll_vec, test_vec) + enroll_bias + test_bias`. The trials are
+  processed in chunks, for each chunk, the scores are computed by
+  a single GEMM between its unique enrollments and tests if the
+  block is dense enough (i.e. `nb_enroll * nb_test <= dense_ratio *
+  nb_trials`), otherwise, by row-wise dot products of the listed pairs.
+
+  Parameters
+  ----------
+  model : {PLDA, Scorer}
+    fitted scoring back-end
+  enroll : {Mapping, tuple}
+    'id' -> vector, or tuple of (ids, [nb_enroll, feat_dim])
+  test : {Mapping, tuple}
+    'id' -> vector, or tuple of (ids, [nb_test, feat_dim])
+  trials : {str, list, numpy.ndarray}
+    path to the trial file (whitespace separated, the first two columns
+    are enrollment id and test id), or list of (enroll_id, test_id)
+  path : {str, None}
+    if given, the scores are written incrementally to this file
+    (tab separated: enroll_id, test_id, score), and the path is returned
+  chunk_size : int
+    number of trials scored at once
+  header : bool
+    if True, skip the first line of the trial file
+  normalizer : {None, ScoreNormalizer}
+    if given, the scores are normalized by the cohort statistics of
+    the enrollment and the test
+
+  Return
+  ------
+  scores : numpy.ndarray [nb_trials] (`nan` for trials with unknown ids),
+  or the output `path`
+  """
+  if not model.is_fitted:
+    raise RuntimeError("The scoring back-end hasn't been fitted!")
+  chunk_size = max(1, int(chunk_size))
+  # ====== project each unique vector once ====== #
+  enroll_ids, X_enroll = _as_ids_matrix(enroll)
+  test_ids, X_test = _as_ids_matrix(test)
+  enroll_map = {i: n for n, i in enumerate(enroll_ids)}
+  test_map = {i: n for n, i in enumerate(test_ids)}
+  A, a = model._trial_vectors(X_enroll, enroll=True)
+  B, b = model._trial_vectors(X_test, enroll=False)
+  if normalizer is not None:
+    mu_e, sd_e = normalizer._cohort_stats(enroll_ids, A, a, enroll=True)
+    mu_t, sd_t = normalizer._cohort_stats(test_ids, B, b, enroll=False)
+  # ====== score the chunks ====== #
+  fout = None if path is None else open(path, 'w')
+  all_scores = []
+  try:
+    for chunk in _iter_trials(trials, chunk_size, header):
+      ei = np.array([enroll_map.get(i, -1) for i, _ in chunk], dtype='int64')
+      ti = np.array([test_map.get(j, -1) for _, j in chunk], dtype='int64')
+      scores = np.full((len(chunk),), np.nan, dtype='float32')
+      valid = (ei >= 0) & (ti >= 0)
+      if np.any(valid):
+        e, t = ei[valid], ti[valid]
+        ue, e_inv = np.unique(e, return_inverse=True)
+        ut, t_inv = np.unique(t, return_inverse=True)
+        if len(ue) * len(ut) <= dense_ratio * len(e):
+          s = np.dot(A[ue], B[ut].T)[e_inv, t_inv]
+        else:
+          s = np.einsum('ij,ij->i', A[e], B[t])
+        s = s + a[e] + b[t]
+        if normalizer is not None:
+          s = 0.5 * ((s - mu_e[e]) / sd_e[e] + (s - mu_t[t]) / sd_t[t])
+        scores[valid] = s
+      if fout is not None:
+        fout.write(''.join('%s\t%s\t%f\n' % (i, j, k)
+                           for (i, j), k in zip(chunk, scores)))
+      else:
+        all_scores.append(scores)
+  finally:
+    if fout is not None:
+      fout.close()
+  if path is not None:
+    return path
+  if len(all_scores) == 0:
+    return np.empty((0,), dtype='float32')
+  return np.concatenate(all_scores)
+
+class ScoreNormalizer(BaseEstimator):
+  """ Symmetric score normalization (S-norm) or adaptive S-norm (AS-norm)
+  against a cohort of impostors
+
+  `s_norm = 0.5 * ((s - mu_e) / sd_e + (s - mu_t) / sd_t)`, where
+  `mu_e, sd_e` are the statistics of the scores between the enrollment and
+  the cohort, `mu_t, sd_t` of the scores between the cohort and the test.
+
+  Parameters
+  ----------
+  model : {PLDA, Scorer}
+    fitted scoring back-end
+  top_k : {None, int}
+    None for S-norm, i.e. statistics of the scores to the whole cohort,
+    otherwise, AS-norm, i.e. statistics of the `top_k` highest scores
+  block_size : int
+    number of enrollments (or tests) scored against the whole cohort
+    at once, i.e. the memory is bounded by `block_size * nb_cohort`
+
+  Note
+  ----
+  The statistics are cached by id until `fit` or `clear_cache` is
+  called, the ids must identify unique embeddings across calls.
+  """
+
+  def __init__(self, model, top_k=None, block_size=1024):
+    super(ScoreNormalizer, self).__init__()
+    self._model = model
+    self.top_k = None if top_k is None else int(top_k)
+    self.block_size = max(1, int(block_size))
+    self._cohort = None
+    self.clear_cache()
+
+  @property
+  def model(self):
+    return self._model
+
+  @property
+  def is_fitted(self):
+    return self._cohort is not None
+
+  def clear_cache(self):
+    # 'id' -> (mean, std)
+    self._enroll_cache = {}
+    self._test_cache = {}
+    return self
+
+  def fit(self, X, y=None):
+    """ X : [nb_cohort, feat_dim] the cohort embeddings """
+    if not self.model.is_fitted:
+      raise RuntimeError("The scoring back-end hasn't been fitted!")
+    # the cohort appears as test for the enrollment statistics and
+    # as enrollment for the test statistics
+    self._cohort = (self.model._trial_vectors(X, enroll=False),
+                    self.model._trial_vectors(X, enroll=True))
+    return self.clear_cache()
+
+  def _cohort_stats(self, ids, V, bias, enroll):
+    """ Return: the (mean, std) of cohort scores for each id """
+    if not self.is_fitted:
+      raise RuntimeError("The ScoreNormalizer hasn't been fitted!")
+    cache = self._enroll_cache if enroll else self._test_cache
+    (C, c) = self._cohort[0] if enroll else self._cohort[1]
+    missing = [n for n, i in enumerate(ids) if i not in cache]
+    for start in range(0, len(missing), self.block_size):
+      rows = missing[start:start + self.block_size]
+      # [block_size, nb_cohort]
+      s = np.dot(V[rows], C.T) + bias[rows][:, None] + c[None, :]
+      if self.top_k is not None and self.top_k < s.shape[1]:
+        k = self.top_k
+        s = -np.partition(-s, k - 1, axis=1)[:, :k]
+      mu = np.mean(s, axis=1)
+      sd = np.std(s, axis=1) + 1e-8
+      for n, m, d in zip(rows, mu, sd):
+        cache[ids[n]] = (m, d)
+    stats = np.array([cache[i] for i in ids], dtype='float64').reshape(-1, 2)
+    return stats[:, 0], stats[:, 1]
+
+  def score_trials(self, enroll, test, trials, path=None,
+                   chunk_size=2**16, header=False):
+    """ Normalized scores of the listed (enroll_id, test_id) pairs,
+    see `odin.ml.scoring.score_trial_list` """
+    return score_trial_list(self.model, enroll, test, trials, path=path,
+                            chunk_size=chunk_size, header=header,
+                            normalizer=self)
+
 class VectorNormalizer(BaseEstimator, TransformerMixin):
   """ Perform of sequence of normalization as following
     -> Centering: Substract sample mean
@@ -347,6 +567,19 @@ class Scorer(BaseEstimator, TransformerMixin, Evaluable):
   def predict_log_proba(self, X):
     return self.transform(X)
 
+  def _trial_vectors(self, X, enroll):
+    if self.method != 'cosine':
+      raise RuntimeError("Trial-list scoring only support 'cosine' method")
+    X = self._normalizer.transform(X)
+    return X, np.zeros((X.shape[0],), dtype=X.dtype)
+
+  def score_trials(self, enroll, test, trials, path=None,
+                   chunk_size=2**16, header=False):
+    """ Cosine scores of the listed (enroll_id, test_id) pairs,
+    see `odin.ml.scoring.score_trial_list` """
+    return score_trial_list(self, enroll, test, trials, path=path,
+                            chunk_size=chunk_size, header=header)
+
   def transform(self, X):
     # [nb_samples, nb_classes - 1] (if LDA applied)
     X = self._normalizer.transform(X)
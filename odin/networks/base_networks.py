@@ -509,6 +509,8 @@ class Networks(keras.Model, MD5object):
       logging_interval: float = 3,
       skip_fitted: Union[bool, int] = False,
       terminate_on_nan: bool = True,
+      nan_check_freq: int = 100,
+      steps_per_execution: int = 1,
       logdir: Optional[str] = None,
       allow_none_gradients: bool = False,
       track_gradients: bool = False,
@@ -562,6 +564,13 @@ class Networks(keras.Model, MD5object):
         steps, by default False
     terminate_on_nan : bool, optional
         terminate the training if NaNs returned, by default True
+    nan_check_freq : int, optional
+        the frequency, in steps, for reading back the NaN flag accumulated
+        on the device, by default 100
+    steps_per_execution : int, optional
+        number of optimization steps run within a single call of the compiled
+        function, logging, validation and callbacks (e.g. early stopping) are
+        performed at this granularity, by default 1
     logdir : Optional[str], optional
         tensorboard logging directory, by default None
     allow_none_gradients : bool, optional
@@ -632,6 +641,8 @@ class Networks(keras.Model, MD5object):
         log_tag=self.name,
         max_iter=max_iter,
         terminate_on_nan=terminate_on_nan,
+        nan_check_freq=nan_check_freq,
+        steps_per_execution=steps_per_execution,
         callback=callback,
     )
     return self
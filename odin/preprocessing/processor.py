@@ -5,6 +5,7 @@
 # ===========================================================================
 from __future__ import absolute_import, division, print_function
 
+import marshal
 import os
 import random
 import re
@@ -23,8 +24,11 @@ from six import add_metaclass, string_types
 from six.moves import cPickle, range, zip, zip_longest
 from sklearn.pipeline import Pipeline
 
-from bigarray import MmapArray
+from bigarray import MmapArray, MmapArrayWriter, read_mmaparray_header
+from bigarray.mmap_array import _HEADER as _MMAPARRAY_HEADER
+from bigarray.mmap_array import _aligned_memmap_offset
 from odin.fuel import Dataset, MmapDict
+from odin.fuel.dataset import PROCESSOR_CHECKPOINT
 from odin.preprocessing.base import Extractor, ExtractorSignal
 from odin.utils import (Progbar, add_notification, as_tuple, batching, ctext,
                         defaultdictkey, flatten_list, get_all_files,
@@ -33,15 +37,33 @@ from odin.utils import (Progbar, add_notification, as_tuple, batching, ctext,
 from odin.utils.mpi import MPI
 
 _default_module = re.compile(r"__.*__")
+# features files are grown by this number of bytes each time
+_EXTENT_SIZE = 64 * 1024 * 1024
 
 
 # ===========================================================================
 # PCA calculation
 # ===========================================================================
-def calculate_pca(dataset, feat_name='auto', batch_size=1234, override=False):
-  """ Using parallel MiniBatchPCA to do PCA for multiple features
-  at once.
+def calculate_pca(dataset,
+                  feat_name='auto',
+                  batch_size=1234,
+                  override=False,
+                  algo='exact',
+                  ncpu=None):
+  """ Using out-of-core `MiniBatchPCA.fit_mpi` to do PCA for multiple
+  features, the rows of each feature are split among `ncpu` processes
+  which read directly from the memory-mapped array.
 
+  Parameters
+  ----------
+  batch_size : int
+    number of rows loaded into memory at once by each process
+  override : bool
+    if False, skip the features that already have a `pca_` model
+  algo : {'exact', 'randomized'}
+    see `odin.ml.MiniBatchPCA.fit_mpi`
+  ncpu : {None, int}
+    number of processes, if None, use all available CPU
   """
   # TODO: add different pca prefix (e.g. pca_full_mspec, pca_sami_mspec)
   # add reading data from indices also
@@ -64,58 +86,23 @@ def calculate_pca(dataset, feat_name='auto', batch_size=1234, override=False):
         feat_name.append(k)
   else:
     feat_name = [name for name in as_tuple(feat_name, t=str) if name in dataset]
+  if not override:
+    feat_name = [name for name in feat_name if 'pca_' + name not in dataset]
+  ncpu = cpu_count() if ncpu is None else int(ncpu)
   # ====== load PCA ====== #
   from odin.ml import MiniBatchPCA
-  # init PCA
-  nb_samples = 0
-  for feat in feat_name:
-    nb_samples += dataset[feat].shape[0]
-  # ====== prepare MPI PCA ====== #
   add_notification("Selected features for PCA: " +
                    ctext(', '.join(feat_name), 'yellow'))
-
-  def map_pca(name):
-    X = dataset[name]
-    # found exist pca model
-    if 'pca_' + feat in dataset and not override:
-      pca = dataset['pca_' + feat]
-    # create new PCA
-    else:
-      pca = MiniBatchPCA(n_components=None,
-                         whiten=False,
-                         copy=True,
-                         batch_size=None)
-    # No shuffling make iter much faster
-    for x in X.set_batch(batch_size=batch_size, seed=None, shuffle_level=0):
-      pca.partial_fit(x)
-      yield x.shape[0]
+  # ====== running the out-of-core PCA ====== #
+  for name in feat_name:
+    pca = MiniBatchPCA(n_components=None,
+                       whiten=False,
+                       copy=True,
+                       batch_size=batch_size)
+    pca.fit_mpi(dataset[name], algo=algo, ncpu=ncpu, print_progress=True)
     # save PCA model
     with open(os.path.join(dataset.path, 'pca_' + name), 'wb') as f:
       cPickle.dump(pca, f, protocol=cPickle.HIGHEST_PROTOCOL)
-    # finish return feature name
-    yield name
-
-  mpi = MPI(jobs=feat_name,
-            func=map_pca,
-            ncpu=None,
-            batch=1,
-            hwm=1234,
-            backend='python')
-  # ====== running the MPI ====== #
-  remain_features = list(feat_name)
-  finished_features = []
-  prog = Progbar(target=nb_samples,
-                 print_summary=True,
-                 print_report=True,
-                 name='PCA')
-  for n in mpi:
-    if is_string(n):
-      remain_features.remove(n)
-      finished_features.append(n)
-    else:
-      prog['Remain'] = ', '.join(remain_features)
-      prog['Finished'] = ', '.join(finished_features)
-      prog.add(n)
   # ====== return ====== #
   if own_dataset:
     dataset.close()
@@ -385,6 +372,192 @@ def validate_features(ds_or_processor,
 # ===========================================================================
 # Features Processor
 # ===========================================================================
+def _job_key(job):
+  """ Identity of a job which is stable between runs """
+  return job if is_string(job) else repr(job)
+
+
+def _load_checkpoint(path):
+  if not os.path.exists(path):
+    return None
+  with open(path, 'rb') as f:
+    return cPickle.load(f)
+
+
+def _save_checkpoint(path, checkpoint):
+  """ Write to a temporary file then rename, the checkpoint on disk is
+  always either the old or the new one """
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    cPickle.dump(checkpoint, f, protocol=cPickle.HIGHEST_PROTOCOL)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, path)
+
+
+def _truncate_mmaparray(path, length):
+  """ Drop all rows of a `MmapArray` after given `length`, i.e. the rows
+  appended after the last committed checkpoint """
+  dtype, shape = read_mmaparray_header(path)
+  if shape[0] <= length:
+    return
+  shape = (int(length),) + tuple(shape[1:])
+  meta = marshal.dumps([dtype, shape])
+  with open(path, 'rb+') as f:
+    f.seek(len(_MMAPARRAY_HEADER))
+    f.write(('%8d' % len(meta)).encode())
+    f.write(meta)
+    f.truncate(
+        _aligned_memmap_offset(dtype) +
+        int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+
+def _is_mmapdict(path):
+  if not os.path.isfile(path):
+    return False
+  with open(path, 'rb') as f:
+    return f.read(len(MmapDict.HEADER)) in (MmapDict.HEADER,
+                                            MmapDict.LEGACY_HEADER)
+
+
+def _processor_state(path):
+  """ The file names, number of rows of each feature and the statistics
+  written in `path` by the previous runs, the new features are appended
+  after them """
+  names = set()
+  lengths = {}
+  stats = defaultdict(lambda: [0, 0])
+  for fname in (os.listdir(path) if os.path.isdir(path) else []):
+    fpath = os.path.join(path, fname)
+    if fname == 'config' or not os.path.isfile(fpath):
+      continue
+    if fname[-4:] in ('sum1', 'sum2'):
+      with open(fpath, 'rb') as f:
+        stats[fname[:-4]][int(fname[-1]) - 1] = cPickle.load(f)
+    elif fname[-4:] == 'mean' or fname[-3:] == 'std':
+      continue
+    elif _is_mmapdict(fpath):
+      db = MmapDict(fpath, read_only=True)
+      names.update(db.keys())
+      db.close()
+    else:
+      try:
+        _, shape = read_mmaparray_header(fpath)
+      except Exception:  # not a MmapArray
+        continue
+      lengths['indices_%s' % fname] = shape[0]
+  return dict(names=names,
+              lengths=lengths,
+              stats={k: tuple(v) for k, v in stats.items()})
+
+
+def _new_checkpoint(base):
+  """ Checkpoint of a run started from the `base` state, `base` is kept
+  for restarting the run from scratch """
+  return dict(jobs=set(),
+              names=set(base['names']),
+              lengths=dict(base['lengths']),
+              stats=dict(base['stats']),
+              base=base)
+
+
+class _ExtentWriter(object):
+  """ Write features directly into a `MmapArray` without intermediate
+  concatenation, the file is grown in large extents (instead of resizing
+  for every result) and truncated to the written length when closed. """
+
+  def __init__(self, path, shape, dtype, extent_size=_EXTENT_SIZE):
+    self._writer = MmapArrayWriter(path=path,
+                                   shape=(0,) + tuple(shape),
+                                   dtype=dtype,
+                                   remove_exist=False)
+    self._path = self._writer.path
+    self._length = self._writer.shape[0]
+    row_bytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    self._extent_rows = max(1, int(extent_size) // row_bytes)
+
+  @property
+  def path(self):
+    return self._path
+
+  def __len__(self):
+    return self._length
+
+  def write(self, X):
+    start = self._length
+    end = start + X.shape[0]
+    capacity = self._writer.shape[0]
+    if end > capacity:
+      # writing the last row of the new extent grows the file only once,
+      # the row is overwritten later or dropped when closed
+      new_capacity = max(end, capacity + self._extent_rows)
+      self._writer.write(X[-1:], start_position=new_capacity - 1)
+    self._writer.write(X, start_position=start)
+    self._length = end
+    return start, end
+
+  def flush(self):
+    self._writer.flush()
+
+  def close(self):
+    self._writer.close()
+    _truncate_mmaparray(self._path, self._length)
+
+
+class _ReorderBuffer(object):
+  """ Release items in the order of their index, at most `max_items` are
+  kept in memory, the others are spilled to temporary files. """
+
+  def __init__(self, max_items):
+    self._max_items = max(1, int(max_items))
+    self._items = {}
+    self._spilled = {}
+    self._spill_dir = None
+    self._next = 0
+
+  def __len__(self):
+    return len(self._items) + len(self._spilled)
+
+  def put(self, idx, item):
+    self._items[idx] = item
+    # spill the item which will be released latest
+    while len(self._items) > self._max_items:
+      last = max(self._items.keys())
+      if last == self._next:
+        break
+      if self._spill_dir is None:
+        self._spill_dir = get_tempdir()
+      path = os.path.join(self._spill_dir, 'reorder_%d' % last)
+      with open(path, 'wb') as f:
+        cPickle.dump(self._items.pop(last), f,
+                     protocol=cPickle.HIGHEST_PROTOCOL)
+      self._spilled[last] = path
+
+  def pop(self):
+    """ Iterate over all the consecutive items available """
+    while True:
+      if self._next in self._items:
+        item = self._items.pop(self._next)
+      elif self._next in self._spilled:
+        path = self._spilled.pop(self._next)
+        with open(path, 'rb') as f:
+          item = cPickle.load(f)
+        os.remove(path)
+      else:
+        break
+      self._next += 1
+      yield item
+
+  def close(self):
+    for path in self._spilled.values():
+      if os.path.exists(path):
+        os.remove(path)
+    self._spilled.clear()
+    self._items.clear()
+    if self._spill_dir is not None and os.path.isdir(self._spill_dir):
+      shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+
 def _check_logpath(log_path):
   main_path, ext = os.path.splitext(log_path)
   main_path = main_path.split('.')
@@ -419,7 +592,9 @@ class FeatureProcessor(object):
       path to a folder for saving output Dataset
 
   n_cache: float or int (> 0)
-      pass
+      number of processed files between each commit of the features,
+      indices and statistics to disk, if smaller than 1, a percentage
+      of the number of jobs.
 
   ncpu: int (>0)
       number of Processes will be used to parallel the processor
@@ -452,6 +627,23 @@ class FeatureProcessor(object):
 
       if True, terminate the processor if non-handled Exception
       appeared.
+
+  resume : bool (default: True)
+      every time the cache is flushed, the features, indices, statistics
+      and processed jobs are committed to a checkpoint in the output folder.
+      If True, a restarted run with the same `path` only processes the
+      jobs which haven't been committed, and drops all the uncommitted
+      data written by the crashed run. If False, all the data written by
+      the crashed run are dropped and the jobs are processed from scratch.
+      The checkpoint is removed after a successful run, the features of
+      a new run are appended to the features of the finished runs (unless
+      `override=True`).
+
+  keep_order : bool (default: False)
+      if True, the features are written in the same order as `jobs`
+      regardless of which process finishes first, at most `ncpu * 8`
+      out-of-order results are kept in memory, the rest are spilled
+      to a temporary folder.
   """
 
   def __init__(self,
@@ -463,7 +655,9 @@ class FeatureProcessor(object):
                override=False,
                identifier='name',
                log_path=None,
-               stop_on_failure=False):
+               stop_on_failure=False,
+               resume=True,
+               keep_order=False):
     super(FeatureProcessor, self).__init__()
     # ====== check outpath ====== #
     path = os.path.abspath(str(path))
@@ -521,6 +715,8 @@ class FeatureProcessor(object):
     self.config = {}
     self._error_log = []
     self.stop_on_failure = bool(stop_on_failure)
+    self.resume = bool(resume)
+    self.keep_order = bool(keep_order)
 
   @property
   def identifier(self):
@@ -555,41 +751,107 @@ class FeatureProcessor(object):
 
   # ==================== Abstract properties ==================== #
   def run(self):
-    njobs = len(self.jobs)
+    # ====== checkpoint ====== #
+    checkpoint_path = os.path.join(self.path, PROCESSOR_CHECKPOINT)
+    checkpoint = _load_checkpoint(checkpoint_path)
+    # a checkpoint means the last run was interrupted, its uncommitted data
+    # (or all its data if not resumed) must be dropped
+    is_interrupted = checkpoint is not None
+    is_resumed = is_interrupted and self.resume
+    if checkpoint is None:
+      # the state before this run is committed first, so a crash before
+      # the first commit only drops the data of this run
+      checkpoint = _new_checkpoint(_processor_state(self.path))
+      _save_checkpoint(checkpoint_path, checkpoint)
+    elif not self.resume:
+      checkpoint = _new_checkpoint(checkpoint['base'])
+      _save_checkpoint(checkpoint_path, checkpoint)
     dataset = Dataset(self.path)
+    jobs = [j for j in self.jobs if _job_key(j) not in checkpoint['jobs']]
+    njobs = len(jobs)
     if self.n_cache <= 1:
       cache_limit = max(2, int(0.12 * njobs))
     else:
       cache_limit = int(self.n_cache)
+    # ====== drop the uncommitted data ====== #
+    if is_interrupted:
+      for fname in os.listdir(self.path):
+        fpath = os.path.join(self.path, fname)
+        ids_name = 'indices_%s' % fname
+        if fname in ('config',):
+          continue
+        if fname[-4:] in ('sum1', 'sum2', 'mean') or fname[-3:] == 'std':
+          stats_name = fname[:-3] if fname[-3:] == 'std' else fname[:-4]
+          if stats_name not in checkpoint['stats']:
+            dataset.close(fname)
+            os.remove(fpath)
+        elif _is_mmapdict(fpath):
+          dataset.close(fname)
+          db = MmapDict(fpath, read_only=False)
+          for key in [k for k in db.keys() if k not in checkpoint['names']]:
+            del db[key]
+          db.flush(save_all=True)
+          db.close()
+        elif os.path.isfile(fpath):
+          try:
+            read_mmaparray_header(fpath)
+          except Exception:  # not a MmapArray
+            continue
+          dataset.close(fname)
+          if ids_name in checkpoint['lengths']:
+            _truncate_mmaparray(fpath, checkpoint['lengths'][ids_name])
+          else:
+            os.remove(fpath)
+    if is_resumed:
+      prog_notify = "Resumed from checkpoint, %d/%d jobs committed" % \
+        (len(self.jobs) - njobs, len(self.jobs))
+    else:
+      prog_notify = None
     # ====== indices ====== #
     databases = defaultdictkey(lambda key: MmapDict(
         path=os.path.join(dataset.path, key), cache_size=10000, read_only=False)
                               )
+    writers = {}
     last_start = defaultdict(int)
+    last_start.update(checkpoint['lengths'])
     # ====== statistic ====== #
     # load old statistics
     stats = defaultdict(lambda: [0, 0])  # name -> (sum1, sum2)
-    for key in dataset.keys():
-      if 'sum1' == key[-4]:
-        stats[key[:-4]][0] = dataset[key][:]
-      elif 'sum2' == key[-4:]:
-        stats[key[:-4]][1] = dataset[key][:]
-    # all data are cached for periodically flushed
-    cache = defaultdict(list)
+    # copied, the statistics are accumulated in-place and the base state
+    # of the checkpoint must not change
+    for key, (sum1, sum2) in checkpoint['stats'].items():
+      stats[key] = [np.copy(sum1), np.copy(sum2)]
+    # jobs and file names processed since the last commit
+    pending_jobs = []
+    pending_names = []
     n_processed = [0]  # store the value as reference
 
     # ====== helper ====== #
-    def flush_feature(feat_name, X_cached):
-      if len(X_cached) > 0:
-        X_cached = np.concatenate(X_cached, 0)
-        # flush data
-        if feat_name in dataset:
-          dataset[feat_name].append(X_cached)
-        else:
-          dataset[(feat_name, 'memmap')] = X_cached
+    def write_feature(feat_name, X):
+      if feat_name not in writers:
+        writers[feat_name] = _ExtentWriter(path=os.path.join(
+            dataset.path, feat_name),
+                                           shape=X.shape[1:],
+                                           dtype=X.dtype)
+      writers[feat_name].write(X)
+
+    def commit():
+      """ Flush the features, the MmapDict and then write the checkpoint,
+      the checkpoint is only updated when all data are on disk """
+      for w in writers.values():
+        w.flush()
+      for db in databases.values():
+        db.flush(save_all=True)
+      checkpoint['jobs'].update(pending_jobs)
+      checkpoint['names'].update(pending_names)
+      checkpoint['lengths'] = dict(last_start)
+      checkpoint['stats'] = {k: tuple(v) for k, v in stats.items()}
+      _save_checkpoint(checkpoint_path, checkpoint)
+      del pending_jobs[:]
+      del pending_names[:]
 
     # ====== repeated for each result returned ====== #
-    def post_processing(result):
+    def post_processing(job, result):
       # search for file name
       if self.identifier not in result:
         raise RuntimeError(
@@ -628,9 +890,9 @@ class FeatureProcessor(object):
           # save features array
           else:
             all_indices[feat_name] = X.shape[0]
-            # cache data, only if we have more than 0 sample
+            # write data directly to disk, only if we have more than 0 sample
             if X.shape[0] > 0:
-              cache[feat_name].append(X)
+              write_feature(feat_name, X)
         # else all other kind of data save to MmapDict
         else:
           databases[feat_name][file_name] = X
@@ -643,17 +905,18 @@ class FeatureProcessor(object):
           databases[ids_name][file_name] = (last_start[ids_name],
                                             last_start[ids_name] + n)
           last_start[ids_name] += n
-      # ====== flush cache ====== #
+      pending_jobs.append(job)
+      pending_names.append(file_name)
+      # ====== commit to disk ====== #
       n_processed[0] += 1
       if n_processed[0] % cache_limit == 0:  # 12 + 8
-        for feat_name, X_cached in cache.items():
-          flush_feature(feat_name, X_cached)
-        cache.clear()
+        commit()
       # ====== update progress ====== #
       return file_name
 
     # ====== mapping function ====== #
-    def _map_func(dat):
+    def _map_func(job):
+      idx, dat = job
       try:
         ret = self.extractor.transform(dat)
       except Exception as e:  # Non-handled exception
@@ -668,96 +931,127 @@ class FeatureProcessor(object):
                                                  tb,
                                                  limit=None).format(chain=True):
           ret += line
-      return ret
+      return idx, _job_key(dat), ret
 
     # ====== processing ====== #
-    mpi = MPI(jobs=self.jobs,
-              func=_map_func,
-              ncpu=self.n_cpu,
-              batch=1,
-              hwm=self.n_cpu * 3,
-              backend='python')
     # initialize
     prog = Progbar(target=njobs,
                    name=self.path,
                    interval=0.12,
                    print_report=True,
                    print_summary=True)
+    if prog_notify is not None:
+      prog.add_notification(prog_notify)
+    if njobs > 0:
+      mpi = MPI(jobs=list(enumerate(jobs)),
+                func=_map_func,
+                ncpu=self.n_cpu,
+                batch=1,
+                hwm=self.n_cpu * 3,
+                backend='python')
+    else:
+      mpi = []
+    # release the results in the order of jobs
+    if self.keep_order:
+      reorder = _ReorderBuffer(max_items=self.n_cpu * 8)
+
+      def ordered_results(it):
+        for idx, job, result in it:
+          reorder.put(idx, (job, result))
+          for item in reorder.pop():
+            yield item
+
+      results = ordered_results(mpi)
+    else:
+      reorder = None
+      results = ((job, result) for _, job, result in mpi)
     start_time = time.time()
     last_time = time.time()
     last_count = 0
-    with open(self._log_path, 'w') as flog:
-      # writing the log head
-      flog.write('============================\n')
-      flog.write('Start Time : %s\n' %
-                 get_formatted_datetime(only_number=False))
-      flog.write('Outpath    : %s\n' % self.path)
-      flog.write(
-          'Extractor  : %s\n' %
-          '->'.join([s[-1].__class__.__name__ for s in self.extractor.steps]))
-      flog.write('#Jobs      : %d\n' % njobs)
-      flog.write('#CPU       : %d\n' % self.n_cpu)
-      flog.write('#Cache     : %d\n' % cache_limit)
-      flog.write('============================\n')
-      flog.flush()
-      # start processing the file list
-      for count, result in enumerate(mpi):
-        # Non-handled exception
-        if isinstance(result, string_types):
-          flog.write(result)
-          flog.flush()
-          self._error_log.append(result)
-          if self.stop_on_failure:
-            raise RuntimeError(result)
-        # some error might happened
-        elif isinstance(result, ExtractorSignal):
-          flog.write(str(result))
-          flog.flush()
-          if result.action == 'error':
-            prog.add_notification(str(result))
-            raise RuntimeError(
-                "ExtractorSignal requests terminating processor!")
-          elif result.action == 'warn':
-            prog.add_notification(str(result))
-          elif result.action == 'ignore':
+    try:
+      with open(self._log_path, 'w') as flog:
+        # writing the log head
+        flog.write('============================\n')
+        flog.write('Start Time : %s\n' %
+                   get_formatted_datetime(only_number=False))
+        flog.write('Outpath    : %s\n' % self.path)
+        flog.write(
+            'Extractor  : %s\n' %
+            '->'.join([s[-1].__class__.__name__ for s in self.extractor.steps]))
+        flog.write('#Jobs      : %d\n' % njobs)
+        flog.write('#Committed : %d\n' % (len(self.jobs) - njobs))
+        flog.write('#CPU       : %d\n' % self.n_cpu)
+        flog.write('#Cache     : %d\n' % cache_limit)
+        flog.write('============================\n')
+        flog.flush()
+        # start processing the file list
+        for count, (job, result) in enumerate(results):
+          # extractor return nothing
+          if result is None:
+            pass
+          # Non-handled exception
+          elif isinstance(result, string_types):
+            flog.write(result)
+            flog.flush()
             self._error_log.append(result)
+            if self.stop_on_failure:
+              raise RuntimeError(result)
+          # some error might happened
+          elif isinstance(result, ExtractorSignal):
+            flog.write(str(result))
+            flog.flush()
+            if result.action == 'error':
+              prog.add_notification(str(result))
+              raise RuntimeError(
+                  "ExtractorSignal requests terminating processor!")
+            elif result.action == 'warn':
+              prog.add_notification(str(result))
+            elif result.action == 'ignore':
+              self._error_log.append(result)
+            else:
+              raise RuntimeError("Unknown action from ExtractorSignal: %s" %
+                                 result.action)
+            prog['File'] = '%-48s' % result.message[:48]
+          # otherwise, no error happened, do post-processing
           else:
-            raise RuntimeError("Unknown action from ExtractorSignal: %s" %
-                               result.action)
-          prog['File'] = '%-48s' % result.message[:48]
-        # otherwise, no error happened, do post-processing
-        else:
-          name = post_processing(result)
-          prog['File'] = '%-48s' % str(name)[:48]
-        # update progress
-        prog.add(1)
-        # manually write to external log file
-        if (count + 1) % max(1, int(0.01 * njobs)) == 0:
-          curr_time = time.time()
-          elap = curr_time - start_time
-          avg_speed = (count + 1) / elap
-          cur_speed = (count + 1 - last_count) / (curr_time - last_time)
-          avg_est = (njobs - count - 1) / avg_speed
-          cur_est = (njobs - count - 1) / cur_speed
-          flog.write(
-              '[%s] Processed: %d(files)   Remain: %d(files)   Elap.: %.2f(secs)\n'
-              '   Avg.Spd: %.2f(obj/sec)  Avg.Est.: %.2f(secs)\n'
-              '   Cur.Spd: %.2f(obj/sec)  Cur.Est.: %.2f(secs)\n' %
-              (get_formatted_datetime(only_number=False), count + 1,
-               njobs - count - 1, elap, avg_speed, avg_est, cur_speed, cur_est))
-          flog.flush()
-          last_time = curr_time
-          last_count = count + 1
+            name = post_processing(job, result)
+            prog['File'] = '%-48s' % str(name)[:48]
+          # update progress
+          prog.add(1)
+          # manually write to external log file
+          if (count + 1) % max(1, int(0.01 * njobs)) == 0:
+            curr_time = time.time()
+            elap = curr_time - start_time
+            avg_speed = (count + 1) / elap
+            cur_speed = (count + 1 - last_count) / (curr_time - last_time)
+            avg_est = (njobs - count - 1) / avg_speed
+            cur_est = (njobs - count - 1) / cur_speed
+            flog.write(
+                '[%s] Processed: %d(files)   Remain: %d(files)   Elap.: %.2f(secs)\n'
+                '   Avg.Spd: %.2f(obj/sec)  Avg.Est.: %.2f(secs)\n'
+                '   Cur.Spd: %.2f(obj/sec)  Cur.Est.: %.2f(secs)\n' %
+                (get_formatted_datetime(only_number=False), count + 1,
+                 njobs - count - 1, elap, avg_speed, avg_est, cur_speed, cur_est))
+            flog.flush()
+            last_time = curr_time
+            last_count = count + 1
+    except BaseException:
+      # stop all the workers, the committed jobs are kept in the checkpoint
+      if isinstance(mpi, MPI):
+        mpi.terminate()
+      if reorder is not None:
+        reorder.close()
+      raise
     # ====== end, flush the last time ====== #
-    for feat_name, X_cached in cache.items():
-      flush_feature(feat_name, X_cached)
-    cache.clear()
-    cache = None
+    if reorder is not None:
+      reorder.close()
+    commit()
+    for w in writers.values():
+      w.close()
     dataset.flush()
     prog.add_notification("Flushed all data to disk")
     # ====== saving indices ====== #
     for name, db in databases.items():
-      db.flush(save_all=True)
       db_size = len(db)
       db.close()
       prog.add_notification(
@@ -766,7 +1060,7 @@ class FeatureProcessor(object):
 
     # ====== save mean and std ====== #
     def save_mean_std(sum1, sum2, name):
-      N = dataset[name.split('_')[0]].shape[0]
+      N = last_start['indices_%s' % name.split('_')[0]]
       mean = sum1 / N
       std = np.sqrt(sum2 / N - np.power(mean, 2))
       if np.any(np.isnan(mean)):
@@ -811,6 +1105,9 @@ class FeatureProcessor(object):
     config.close()
     prog.add_notification("Saved configuration at: %s" %
                           ctext(config_path, 'yellow'))
+    # ====== all jobs are on disk, the checkpoint is obsolete ====== #
+    if os.path.exists(checkpoint_path):
+      os.remove(checkpoint_path)
     # ====== final notification ====== #
     prog.add_notification("Closed all dataset.")
     prog.add_notification("Dataset at path: %s" % ctext(dataset.path, 'yellow'))
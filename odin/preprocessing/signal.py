@@ -881,46 +881,87 @@ def wmvn(x, w=301, varnorm=True, indices=None):
 
   Parameters
   ----------
-  x : [t, f]
-      [time, frequency]
+  x : [t, f] or [b, t, f]
+      [time, frequency], or a batch of utterances with the same length,
+      a list of [t, f] (different lengths) is also accepted
   w : int
     width of normalization window.
   varnorm : bool
     if True, normalized by standard deviation
-  indices : numpy.ndarray [time,]
+  indices : numpy.ndarray [time,] or [b, time]
     `numpy.bool` array, the speech activities boolean indices,
     which frames will be taken into account for calculating
     the `mean` and `std`
 
+  Note
+  ----
+  The statistics of all windows are computed from the (masked) running
+  sums, i.e. O(t * f) instead of O(t * w * f). The first and the last
+  `(w - 1) / 2` frames are normalized by the first and the last window.
   """
   if w < 3 or (w & 1) != 1:
     raise ValueError('Window length should be an odd integer >= 3')
-  nobs, ndim = x.shape
+  # ====== list of utterances ====== #
+  if isinstance(x, (tuple, list)):
+    if indices is None:
+      indices = [None] * len(x)
+    return [wmvn(i, w=w, varnorm=varnorm, indices=sad)
+            for i, sad in zip(x, indices)]
+  if x.ndim == 2:
+    return wmvn(x[None], w=w, varnorm=varnorm,
+                indices=None if indices is None else indices[None])[0]
+  batch, nobs, ndim = x.shape
   if nobs < w:
-    return mvn(x, varnorm=varnorm, indices=indices)
-  fnorm = _fnorm2 if varnorm else _fnorm1
-  # ====== init ====== #
+    return np.stack([
+        mvn(x[i], varnorm=varnorm,
+            indices=None if indices is None else indices[i])
+        for i in range(batch)])
+  # ====== window of each frame ====== #
   hlen = int((w - 1) / 2)
-  y = np.zeros((nobs, ndim), dtype=x.dtype)
-  # ====== first window ====== #
-  # applying indices
-  x_stat = x[:w] if indices is None else x[:w][indices[:w]]
-  # normalize
-  y[:hlen] = fnorm(x[:hlen], x_stat, True)
-  # ====== iterate ====== #
-  for ix in range(hlen, nobs - hlen):
-    # applying indices
-    if indices is None:
-      x_stat = x[ix - hlen:ix + hlen + 1]
-    else:
-      sad = indices[ix - hlen:ix + hlen + 1]
-      x_stat = x[ix - hlen:ix + hlen + 1][sad]
-    # normalize
-    y[ix] = fnorm(x[ix], x_stat, False)
-  # ====== last window ====== #
-  # applying indices
-  x_stat = x[nobs - w:] if indices is None else x[nobs - w:][indices[nobs - w:]]
-  y[nobs - hlen:nobs] = fnorm(x[nobs - hlen:nobs], x_stat, True)
+
+  def window_sums(csum):
+    # sums of all windows [i, i + w), then the first and the last window
+    # are repeated for the first and last `hlen` frames
+    sums = csum[:, w:] - csum[:, :-w]
+    return np.concatenate(
+        [np.repeat(sums[:, :1], hlen, axis=1), sums,
+         np.repeat(sums[:, -1:], hlen, axis=1)], axis=1)
+
+  if indices is None:
+    mask = None
+    count = float(w)
+  else:
+    mask = np.asarray(indices, dtype=bool)
+    cmask = np.zeros((batch, nobs + 1), dtype='int64')
+    np.cumsum(mask, axis=1, out=cmask[:, 1:])
+    count = window_sums(cmask)[:, :, None]
+  # ====== running sums, block of features to bound the memory ====== #
+  y = np.empty_like(x)
+  block = max(1, (1 << 24) // (batch * nobs))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    for fstart in range(0, ndim, block):
+      feat = slice(fstart, fstart + block)
+      xf = x[:, :, feat].astype('float64')
+      # centering to reduce the cancellation of long running sums
+      xf -= xf.mean(axis=1, keepdims=True)
+      xm = xf if mask is None else xf * mask[:, :, None]
+      csum = np.zeros((batch, nobs + 1, xf.shape[-1]), dtype='float64')
+      np.cumsum(xm, axis=1, out=csum[:, 1:])
+      mean = window_sums(csum)
+      mean /= count
+      if varnorm:
+        xm = xm * xf if xm is xf else np.multiply(xm, xf, out=xm)
+        np.cumsum(xm, axis=1, out=csum[:, 1:])
+        std = window_sums(csum)
+        std /= count
+        std -= mean**2
+        np.maximum(std, 0, out=std)
+        np.sqrt(std, out=std)
+        std += 1e-18
+      xf -= mean
+      if varnorm:
+        xf /= std
+      y[:, :, feat] = xf
   return y
 
 def rastafilt(x):
@@ -6,7 +6,7 @@ import itertools
 from numbers import Number
 
 import numpy as np
-from numba import njit
+from numba import njit, prange
 from scipy.optimize import linear_sum_assignment
 from six import string_types
 
@@ -33,8 +33,7 @@ def _nan_policy(mtx, policy):
                    "support: 'propagate', 'omit', 'raise' or a number.")
 
 
-@njit()
-def diagonal_bruteforce_search(matrix):
+def diagonal_bruteforce_search(matrix, pruning=False):
   r""" Find the best permutation of columns to maximize the summarization of
   diagonal entries.
 
@@ -49,6 +48,13 @@ def diagonal_bruteforce_search(matrix):
   The function is acclerated by numba which decrease the duration by at least
   5 times.
 
+  Arguments:
+    pruning : bool
+      if True, use depth-first branch-and-bound instead of enumerating all
+      permutations, a partial assignment is dropped if its score plus the
+      maximum of each remaining row over the unused columns cannot beat the
+      best solution, the result is still exact and feasible for n up to ~14
+
   Return:
     indices : array
       the columns order that give the maximum diagonal sum
@@ -56,6 +62,14 @@ def diagonal_bruteforce_search(matrix):
   Reference:
     Heap's Algorithm: https://en.wikipedia.org/wiki/Heap%27s_algorithm
   """
+  if pruning:
+    return [int(i) for i in _branch_and_bound_search(
+        np.ascontiguousarray(matrix, dtype=np.float64))]
+  return _heap_search(matrix)
+
+
+@njit()
+def _heap_search(matrix):
   A = list(range(matrix.shape[1]))
   n = len(A)
   min_dim = min(matrix.shape)
@@ -104,6 +118,69 @@ def diagonal_bruteforce_search(matrix):
   return best_perm
 
 
+@njit()
+def _branch_and_bound_search(matrix):
+  nrow, ncol = matrix.shape
+  k = min(nrow, ncol)
+  # visit the best columns of each row first, so the first dive is the
+  # row-by-row greedy solution
+  order = np.empty((k, ncol), dtype=np.int64)
+  for r in range(k):
+    order[r] = np.argsort(-matrix[r])
+  used = np.zeros(ncol, dtype=np.bool_)
+  perm = np.empty(k, dtype=np.int64)
+  best_perm = np.arange(ncol)
+  best = -np.inf
+  partial = np.zeros(k + 1, dtype=np.float64)
+  ptr = np.zeros(k + 1, dtype=np.int64)
+  d = 0
+  while d >= 0:
+    # all columns tried at this depth, backtrack
+    if ptr[d] >= ncol:
+      d -= 1
+      if d >= 0:
+        used[perm[d]] = False
+      continue
+    c = order[d, ptr[d]]
+    ptr[d] += 1
+    if used[c]:
+      continue
+    score = partial[d] + matrix[d, c]
+    # complete assignment
+    if d + 1 == k:
+      if score > best:
+        best = score
+        perm[d] = c
+        best_perm[:k] = perm
+      continue
+    # upper bound of the remaining rows
+    used[c] = True
+    bound = score
+    for r in range(d + 1, k):
+      row_max = -np.inf
+      for j in range(ncol):
+        if not used[j] and matrix[r, j] > row_max:
+          row_max = matrix[r, j]
+      bound += row_max
+    if bound <= best:
+      used[c] = False
+      continue
+    perm[d] = c
+    partial[d + 1] = score
+    d += 1
+    ptr[d] = 0
+  # append the unassigned columns
+  used[:] = False
+  for i in range(k):
+    used[best_perm[i]] = True
+  idx = k
+  for i in range(ncol):
+    if not used[i]:
+      best_perm[idx] = i
+      idx += 1
+  return best_perm
+
+
 def diagonal_linear_assignment(matrix, nan_policy='propagate'):
   r""" Solve the diagonal linear assignment problem using the
   Hungarian algorithm, this version find the best permutation of columns
@@ -165,6 +242,28 @@ def diagonal_greedy_search(matrix, nonzeros=False):
   return best_perm
 
 
+@njit()
+def _greedy_search(matrix):
+  # only the first `ncol` rows could be on the diagonal
+  matrix = matrix[:matrix.shape[1]].copy()
+  nrow, ncol = matrix.shape
+  best_perm = np.arange(ncol)
+  for _ in range(min(nrow, ncol)):
+    max_val = -np.inf
+    max_row = 0
+    max_col = 0
+    for col in range(ncol):
+      for row in range(nrow):
+        if matrix[row, col] > max_val:
+          max_val = matrix[row, col]
+          max_row = row
+          max_col = col
+    best_perm[max_row] = max_col
+    matrix[:, max_col] = -np.inf
+    matrix[max_row, :] = -np.inf
+  return best_perm
+
+
 def diagonal_hillclimb_search(matrix):
   r""" Find the best permutation of columns to maximize the summization of
   diagonal entries.
@@ -194,42 +293,136 @@ def diagonal_beam_search(matrix, beam_size=-1):
       the columns order that give the maximum diagonal sum
   """
   ncol = matrix.shape[1]
-  min_dim = min(matrix.shape)
   if beam_size <= 0:
     beam_size = ncol
   # TODO: in theory beam_size could be larger than dictionary size, but
   # it would complicating the implementation.
   assert beam_size <= ncol, "Beam size must smaller than dictionary"
-  beam_seq = np.empty(shape=(beam_size, ncol), dtype=np.int64)
-  beam_score = [0. for i in range(beam_size)]
-  step_score = np.empty(shape=(beam_size * ncol, ncol + 1), dtype=np.float32)
+  return [int(i) for i in _beam_search(
+      np.ascontiguousarray(matrix, dtype=np.float64), beam_size)]
+
+
+@njit()
+def _beam_search(matrix, beam_size):
+  nrow, ncol = matrix.shape
+  min_dim = min(nrow, ncol)
+  # all buffers are preallocated, the beams are swapped after each row
+  beam_seq = np.zeros((beam_size, ncol), dtype=np.int64)
+  beam_used = np.zeros((beam_size, ncol), dtype=np.bool_)
+  beam_score = np.zeros(beam_size, dtype=np.float64)
+  new_seq = np.zeros((beam_size, ncol), dtype=np.int64)
+  new_used = np.zeros((beam_size, ncol), dtype=np.bool_)
+  new_score = np.zeros(beam_size, dtype=np.float64)
+  cand_score = np.empty(beam_size * ncol, dtype=np.float64)
+  cand_beam = np.empty(beam_size * ncol, dtype=np.int64)
+  cand_col = np.empty(beam_size * ncol, dtype=np.int64)
   # first row
-  order = np.argsort(matrix[0])[::-1]
-  beam_seq[:, 0] = order[:beam_size]
-  beam_score[:] = matrix[0][beam_seq[:, 0]]
-  # iterate each column
+  order = np.argsort(-matrix[0], kind='mergesort')
+  for b in range(beam_size):
+    beam_seq[b, 0] = order[b]
+    beam_used[b, order[b]] = True
+    beam_score[b] = matrix[0, order[b]]
+  # iterate each row
   for i in range(1, min_dim):
-    row = matrix[i]
-    order = np.argsort(row)[::-1]
     n = 0
-    for beam, score in zip(beam_seq, beam_score):
-      for col_idx in order:
-        if col_idx not in beam[:i]:
-          step_score[n, :ncol] = beam  # store the prev sequence
-          step_score[n, i] = col_idx  # next decode value
-          step_score[n, -1] = score + row[col_idx]  # total score
+    for b in range(beam_size):
+      for col in range(ncol):
+        if not beam_used[b, col]:
+          cand_score[n] = beam_score[b] + matrix[i, col]
+          cand_beam[n] = b
+          cand_col[n] = col
           n += 1
     # best solutions
-    for j, beam in enumerate(
-        sorted(step_score[:n], key=lambda x: x[-1], reverse=True)[:beam_size]):
-      beam_seq[j] = beam[:ncol]
-      beam_score[j] = beam[-1]
+    top = np.argsort(-cand_score[:n], kind='mergesort')[:beam_size]
+    for j in range(top.shape[0]):
+      b = cand_beam[top[j]]
+      new_seq[j, :i] = beam_seq[b, :i]
+      new_seq[j, i] = cand_col[top[j]]
+      new_used[j] = beam_used[b]
+      new_used[j, cand_col[top[j]]] = True
+      new_score[j] = cand_score[top[j]]
+    beam_seq, new_seq = new_seq, beam_seq
+    beam_used, new_used = new_used, beam_used
+    beam_score, new_score = new_score, beam_score
   # add the last dimensions
-  if min_dim < ncol:
-    for beam in beam_seq:
-      idx = min_dim
-      for i in range(ncol):
-        if i not in beam[:idx]:
-          beam[idx] = i
-          idx += 1
-  return [int(i) for i in beam_seq[0]]
+  best = beam_seq[0].copy()
+  idx = min_dim
+  for col in range(ncol):
+    if not beam_used[0, col]:
+      best[idx] = col
+      idx += 1
+  return best
+
+
+# ===========================================================================
+# Batched search
+# ===========================================================================
+@njit(parallel=True)
+def _batch_beam_search(matrices, beam_size):
+  results = np.empty((matrices.shape[0], matrices.shape[2]), dtype=np.int64)
+  for b in prange(matrices.shape[0]):
+    results[b] = _beam_search(matrices[b], beam_size)
+  return results
+
+
+@njit(parallel=True)
+def _batch_greedy_search(matrices):
+  results = np.empty((matrices.shape[0], matrices.shape[2]), dtype=np.int64)
+  for b in prange(matrices.shape[0]):
+    results[b] = _greedy_search(matrices[b])
+  return results
+
+
+@njit(parallel=True)
+def _batch_branch_and_bound_search(matrices):
+  results = np.empty((matrices.shape[0], matrices.shape[2]), dtype=np.int64)
+  for b in prange(matrices.shape[0]):
+    results[b] = _branch_and_bound_search(matrices[b])
+  return results
+
+
+def _as_batch(matrices):
+  matrices = np.ascontiguousarray(matrices, dtype=np.float64)
+  if matrices.ndim != 3:
+    raise ValueError("Expect a stack of matrices of shape [B, n, m], "
+                     f"but given shape={matrices.shape}")
+  return matrices
+
+
+def diagonal_beam_search_batch(matrices, beam_size=-1):
+  r""" `diagonal_beam_search` for a stack of matrices `[B, n, m]`, the
+  matrices are solved in parallel by numba threads.
+
+  Return:
+    indices : array `[B, m]`
+      the columns order that give the maximum diagonal sum of each matrix
+  """
+  matrices = _as_batch(matrices)
+  ncol = matrices.shape[2]
+  if beam_size <= 0:
+    beam_size = ncol
+  assert beam_size <= ncol, "Beam size must smaller than dictionary"
+  return _batch_beam_search(matrices, beam_size)
+
+
+def diagonal_greedy_search_batch(matrices):
+  r""" `diagonal_greedy_search` for a stack of matrices `[B, n, m]`, the
+  matrices are solved in parallel by numba threads.
+
+  Return:
+    indices : array `[B, m]`
+      the columns order that give the maximum diagonal sum of each matrix
+  """
+  return _batch_greedy_search(_as_batch(matrices))
+
+
+def diagonal_bruteforce_search_batch(matrices):
+  r""" Exact `diagonal_bruteforce_search` (with branch-and-bound pruning)
+  for a stack of matrices `[B, n, m]`, the matrices are solved in parallel
+  by numba threads.
+
+  Return:
+    indices : array `[B, m]`
+      the columns order that give the maximum diagonal sum of each matrix
+  """
+  return _batch_branch_and_bound_search(_as_batch(matrices))
@@ -1,5 +1,5 @@
 from odin.training.experimenter import *
 from odin.training.scores import ScoreBoard
-from odin.training.trainer import (Callback, Trainer, get_current_trainer,
-                              read_tensorboard)
+from odin.training.trainer import (Callback, MetricAccumulator, Trainer,
+                                   get_current_trainer, read_tensorboard)
 from odin.training.early_stopping import *
@@ -3,6 +3,8 @@ import inspect
 import os
 import pickle
 import tempfile
+import threading
+import time
 import warnings
 from collections import defaultdict
 from functools import partial
@@ -22,11 +24,14 @@ from tensorflow.python.data.ops.iterator_ops import OwnedIterator
 from tensorflow.python.eager.def_function import Function
 from tensorflow.python.keras import Model, Sequential
 from tensorflow.python.keras.optimizer_v2.optimizer_v2 import OptimizerV2
-from tensorflow.python.ops import summary_ops_v2
+from tensorflow.python.ops import io_ops, summary_ops_v2
 from tensorflow.python.summary.summary_iterator import summary_iterator
+from tensorflow.python.training import checkpoint_management
+from tensorflow.python.training.tracking import graph_view
+from tensorflow.python.training.tracking.base import OBJECT_GRAPH_PROTO_KEY
 from tqdm import tqdm
 
-__all__ = ['Trainer', 'get_current_trainer']
+__all__ = ['Trainer', 'MetricAccumulator', 'get_current_trainer']
 
 # ===========================================================================
 # Helpers
@@ -36,6 +41,12 @@ Callback = Callable[[], Optional[dict]]
 _BEST_WEIGHTS = {}
 _BEST_OPTIMIZER = {}
 _CHECKPOINT_MANAGER = {}
+# background checkpoint writing: the thread in flight for each folder,
+# the last save time, and the (blocking, writing) latency in seconds
+_CHECKPOINT_THREAD = {}
+_CHECKPOINT_ERROR = {}
+_CHECKPOINT_LAST_SAVE = {}
+_CHECKPOINT_LATENCY = defaultdict(list)
 _CURRENT_TRAINER = None
 
 
@@ -114,6 +125,174 @@ def _process_callback_returns(progress: tqdm,
       progress.write(f" {k}:{v}")
 
 
+def _snapshot_checkpoint(checkpoint: tf.train.Checkpoint):
+  r""" Copy all saveable tensors of the checkpoint to host memory, the
+  resource variables are copy-on-write, so the snapshot is not affected by
+  the following optimization steps """
+  saveables, graph_proto, _ = \
+    graph_view.ObjectGraphView(checkpoint).serialize_object_graph()
+  names, slices, tensors = [], [], []
+  with tf.device('/cpu:0'):
+    for saveable in saveables:
+      for spec in saveable.specs:
+        names.append(spec.name)
+        slices.append(spec.slice_spec)
+        tensors.append(tf.identity(spec.tensor))
+    names.append(OBJECT_GRAPH_PROTO_KEY)
+    slices.append('')
+    tensors.append(tf.constant(graph_proto.SerializeToString()))
+  return names, slices, tensors
+
+
+def _atomic_write(path: str, data: bytes):
+  tmp_path = os.path.join(os.path.dirname(path),
+                          '.tmp-' + os.path.basename(path))
+  with open(tmp_path, 'wb') as f:
+    f.write(data)
+  os.replace(tmp_path, path)
+
+
+def _write_checkpoint(dir_path: str, footprint: str, number: int,
+                      snapshot: tuple, max_to_keep: int,
+                      files: Dict[str, bytes], blocking_time: float):
+  r""" Write the snapshot to `ckpt-{number}` in the background, the files
+  are renamed from a temporary prefix on completion so the checkpoint
+  state never refers to a partially written checkpoint """
+  start_time = time.time()
+  try:
+    prefix = os.path.join(dir_path, f'ckpt-{number}')
+    tmp_prefix = os.path.join(dir_path, f'.tmp-ckpt-{number}')
+    with tf.device('/cpu:0'):
+      io_ops.save_v2(tmp_prefix, *snapshot)
+    # data shards first, the index marks a complete checkpoint
+    for path in sorted(glob.glob(f'{tmp_prefix}.data-*')):
+      os.replace(path, prefix + path[len(tmp_prefix):])
+    os.replace(f'{tmp_prefix}.index', f'{prefix}.index')
+    for name, data in files.items():
+      _atomic_write(os.path.join(dir_path, name), data)
+    # update the checkpoint state, same as `CheckpointManager.save`
+    state = tf.train.get_checkpoint_state(dir_path)
+    paths, timestamps = [], []
+    if state is not None:
+      paths = list(state.all_model_checkpoint_paths)
+      timestamps = list(state.all_model_checkpoint_timestamps)
+    paths.append(prefix)
+    timestamps.append(time.time())
+    if max_to_keep is not None and len(paths) > max_to_keep:
+      for path in paths[:-max_to_keep]:
+        for f in glob.glob(f'{path}.*'):
+          os.remove(f)
+      paths = paths[-max_to_keep:]
+      timestamps = timestamps[-max_to_keep:]
+    checkpoint_management.update_checkpoint_state_internal(
+        save_dir=dir_path,
+        model_checkpoint_path=prefix,
+        all_model_checkpoint_paths=paths,
+        all_model_checkpoint_timestamps=timestamps,
+        save_relative_paths=True)
+    # the manager recovers the new list of checkpoints from the state
+    cp = _CHECKPOINT_MANAGER[footprint][1]
+    _CHECKPOINT_MANAGER[footprint] = (tf.train.CheckpointManager(
+        cp, directory=dir_path, max_to_keep=max_to_keep), cp)
+  except Exception as e:
+    _CHECKPOINT_ERROR[dir_path] = e
+  _CHECKPOINT_LATENCY[dir_path].append(
+      (blocking_time, time.time() - start_time))
+
+
+class MetricAccumulator(object):
+  r""" Running sums of the loss and metrics stored in device variables,
+  `update` could be called inside a compiled step, so the host only needs
+  to synchronize when the results are read (i.e. `result` or `has_nan`).
+
+  Numeric scalar metrics are averaged over all steps since the last `reset`,
+  the other metrics (e.g. text, images or per-sample values whose shape
+  changes with the last partial batch) are taken from the last step.
+
+  Example
+  -------
+  ```
+  acc = MetricAccumulator()
+  @tf.function
+  def step(x):
+    loss, metrics = optimize(x)
+    acc.update(loss, metrics)
+    return loss, metrics
+  for x in ds:
+    loss, metrics = step(x)
+  mean_loss, mean_metrics = acc.result(last_metrics=metrics)
+  ```
+  """
+
+  def __init__(self, name: str = 'metrics'):
+    self.name = str(name)
+    with tf.init_scope():
+      self._count = tf.Variable(0., trainable=False, dtype=tf.float64,
+                                name=f'{self.name}_count')
+      self._nan = tf.Variable(False, trainable=False, dtype=tf.bool,
+                              name=f'{self.name}_nan')
+      self._loss = tf.Variable(0., trainable=False, dtype=tf.float64,
+                               name=f'{self.name}_loss')
+    self._sums = dict()
+    self._dtypes = dict()
+
+  @staticmethod
+  def _accumulable(v: Tensor) -> bool:
+    return (v.dtype.is_floating or
+            (v.dtype.is_integer and v.dtype != tf.uint8)) and \
+              v.shape.rank == 0
+
+  def update(self, loss: Tensor, metrics: Dict[str, Any]):
+    r""" Add the loss and metrics of one step, no host synchronization """
+    loss = tf.convert_to_tensor(loss)
+    self._count.assign_add(1.)
+    self._loss.assign_add(tf.cast(tf.reduce_mean(loss), tf.float64))
+    self._nan.assign(
+        tf.logical_or(self._nan,
+                      tf.logical_not(tf.reduce_all(tf.math.is_finite(loss)))))
+    for k, v in metrics.items():
+      # hidden metrics (e.g. gradients) are not accumulated
+      if k[0] == '_' or isinstance(v, (tuple, list)) or _is_text(v):
+        continue
+      v = tf.convert_to_tensor(v)
+      if not self._accumulable(v):
+        continue
+      if k not in self._sums:
+        with tf.init_scope():
+          self._sums[k] = tf.Variable(0., dtype=tf.float64,
+                                      trainable=False,
+                                      name=f'{self.name}_{k}')
+          self._dtypes[k] = v.dtype if v.dtype.is_floating else tf.float32
+      self._sums[k].assign_add(tf.cast(v, tf.float64))
+
+  def has_nan(self) -> bool:
+    r""" Return True if any NaN or Inf loss was added since last `reset`,
+    this call synchronizes with the device """
+    return bool(self._nan.numpy())
+
+  @property
+  def count(self) -> int:
+    return int(self._count.numpy())
+
+  def result(self, last_metrics: Optional[Dict[str, Any]] = None
+            ) -> Tuple[Tensor, Dict[str, Any]]:
+    r""" Return the mean loss and metrics since last `reset`, metrics
+    could not be accumulated are taken from `last_metrics` """
+    count = tf.maximum(self._count, 1.)
+    loss = tf.cast(self._loss / count, tf.float32)
+    metrics = dict() if last_metrics is None else dict(last_metrics)
+    for k, v in self._sums.items():
+      metrics[k] = tf.cast(v / count, self._dtypes[k])
+    return loss, metrics
+
+  def reset(self):
+    self._count.assign(0.)
+    self._loss.assign(0.)
+    self._nan.assign(False)
+    for v in self._sums.values():
+      v.assign(tf.zeros_like(v))
+
+
 def read_tensorboard(logdir: str) -> Dict[Text, Tuple[float, int, float]]:
   r""" Read Tensorboard event files from a `logdir`
 
@@ -189,19 +368,70 @@ class Trainer(object):
           if id(i) in _BEST_OPTIMIZER:
             i.set_weights(_BEST_OPTIMIZER[id(i)])
 
+  @staticmethod
+  def wait_for_checkpoints(dir_path: Optional[str] = None):
+    r""" Block until the background checkpoints (of `dir_path` or all
+    folders) are written, re-raise the error of the writing thread """
+    dir_paths = list(_CHECKPOINT_THREAD.keys()) if dir_path is None else \
+      [os.path.abspath(dir_path)]
+    for path in dir_paths:
+      thread = _CHECKPOINT_THREAD.pop(path, None)
+      if thread is not None:
+        thread.join()
+      error = _CHECKPOINT_ERROR.pop(path, None)
+      if error is not None:
+        raise RuntimeError(f"Failed to write checkpoint at {path}") from error
+
+  @staticmethod
+  def checkpoint_latency(dir_path: str) -> Dict[str, float]:
+    r""" Latency of the checkpoints saved asynchronously to `dir_path`:
+    `blocking` is the time the training thread spent on the snapshot (and
+    waiting for the previous save), `writing` is the time of the
+    background thread, both in seconds """
+    latency = np.array(_CHECKPOINT_LATENCY.get(os.path.abspath(dir_path), []))
+    if len(latency) == 0:
+      return dict(n_saves=0)
+    return dict(n_saves=len(latency),
+                blocking_mean=float(np.mean(latency[:, 0])),
+                blocking_max=float(np.max(latency[:, 0])),
+                writing_mean=float(np.mean(latency[:, 1])),
+                writing_max=float(np.max(latency[:, 1])),
+                blocking_last=float(latency[-1, 0]),
+                writing_last=float(latency[-1, 1]))
+
   @staticmethod
   def save_checkpoint(dir_path,
                       models,
                       optimizers=None,
                       trainer=None,
-                      max_to_keep=5):
-    r""" Save checkpoint """
+                      max_to_keep=5,
+                      async_save=False,
+                      min_interval=0.):
+    r""" Save checkpoint
+
+    Arguments:
+      async_save : Boolean. If True, the variables are snapshot to host
+        memory and written by a background thread, at most one save is
+        in flight for each folder (i.e. the next save waits for the previous
+        one). Call `Trainer.wait_for_checkpoints` before reading the files.
+      min_interval : Scalar. Minimum number of seconds since the last save
+        to the same folder, used for periodic checkpoints driven by
+        wall-clock time (i.e. call `save_checkpoint` at every iteration or
+        validation), the call is skipped if the interval is not reached.
+
+    Returns:
+      True if the checkpoint is saved, False if skipped by `min_interval`
+    """
+    start_time = time.time()
     if optimizers is None:
       optimizers = []
     optimizers = tf.nest.flatten(optimizers)
     assert all(isinstance(opt, tf.optimizers.Optimizer) for opt in optimizers), \
       "optimizer must be instance of tf.optimizers.Optimizer"
     dir_path = os.path.abspath(dir_path)
+    if start_time - _CHECKPOINT_LAST_SAVE.get(dir_path, -np.inf) < \
+      float(min_interval):
+      return False
     if not os.path.exists(dir_path):
       os.mkdir(dir_path)
     elif os.path.isfile(dir_path):
@@ -213,6 +443,8 @@ class Trainer(object):
     footprint = dir_path + \
       ''.join(sorted([str(id(i)) for i in optimizers])) + \
       ''.join(sorted([str(id(i)) for i in models]))
+    # at most one save in flight
+    Trainer.wait_for_checkpoints(dir_path)
     if footprint in _CHECKPOINT_MANAGER:
       manager, cp = _CHECKPOINT_MANAGER[footprint]
     else:
@@ -224,15 +456,35 @@ class Trainer(object):
                                            directory=dir_path,
                                            max_to_keep=max_to_keep)
       _CHECKPOINT_MANAGER[footprint] = (manager, cp)
-    manager.save()
-    with open(os.path.join(dir_path, 'optimizers.pkl'), 'wb') as f:
-      pickle.dump(
-          [(opt.__class__.__name__, opt.get_config()) for opt in optimizers], f)
-    with open(os.path.join(dir_path, 'max_to_keep'), 'wb') as f:
-      pickle.dump(max_to_keep, f)
+    files = {
+        'optimizers.pkl':
+            pickle.dumps([(opt.__class__.__name__, opt.get_config())
+                          for opt in optimizers]),
+        'max_to_keep':
+            pickle.dumps(max_to_keep)
+    }
     if trainer is not None:
-      with open(os.path.join(dir_path, 'trainer.pkl'), 'wb') as f:
-        pickle.dump(trainer, f)
+      files['trainer.pkl'] = pickle.dumps(trainer)
+    _CHECKPOINT_LAST_SAVE[dir_path] = start_time
+    ### synchronous
+    if not async_save:
+      manager.save()
+      for name, data in files.items():
+        with open(os.path.join(dir_path, name), 'wb') as f:
+          f.write(data)
+      return True
+    ### asynchronous, same numbering as `CheckpointManager.save`
+    cp.save_counter.assign_add(1)
+    number = int(cp.save_counter.numpy())
+    snapshot = _snapshot_checkpoint(cp)
+    thread = threading.Thread(target=_write_checkpoint,
+                              args=(dir_path, footprint, number, snapshot,
+                                    max_to_keep, files,
+                                    time.time() - start_time),
+                              name=f"checkpoint-{number}")
+    thread.start()
+    _CHECKPOINT_THREAD[dir_path] = thread
+    return True
 
   @staticmethod
   def restore_checkpoint(dir_path, models=None, optimizers=None, index=-1):
@@ -244,6 +496,7 @@ class Trainer(object):
       trainer : `odin.backend.Trainer` or `None`
     """
     dir_path = os.path.abspath(dir_path)
+    Trainer.wait_for_checkpoints(dir_path)
     kwargs = {}
     if not os.path.exists(dir_path):
       os.mkdir(dir_path)
@@ -530,6 +783,8 @@ class Trainer(object):
           log_tag: str = '',
           max_iter: int = -1,
           terminate_on_nan: bool = True,
+          nan_check_freq: int = 100,
+          steps_per_execution: int = 1,
           callback: Union[Callback, List[Callback]] = lambda: None):
     r""" A simplified fitting API
 
@@ -550,6 +805,17 @@ class Trainer(object):
       (in second).
     max_iter : An Interger or `None`. Maximum number of iteration for
       training. If `max_iter <= 0`, iterate the training data until the end.
+    terminate_on_nan : Boolean. Stop the training if NaN or Inf loss returned.
+    nan_check_freq : an Integer. The loss and metrics are accumulated on the
+      device within the compiled step, the NaN flag is only read back every
+      `nan_check_freq` iterations (and at every logging or validation),
+      `nan_check_freq=1` checks every iteration but stalls the pipeline.
+    steps_per_execution : an Integer. Number of batches pulled from the
+      dataset iterator and optimized within a single call of the compiled
+      function, reduce the Python overhead for small models. Logging,
+      validation, callbacks and NaN checking are performed at the
+      granularity of `steps_per_execution` iterations; the metrics which
+      could not be accumulated (e.g. text or images) are not reported.
     callback : Callable take no input arguments.
       The callback will be called after every fixed number of iteration
       according to `valid_freq`, or fixed duration defined by `valid_interval`
@@ -584,6 +850,8 @@ class Trainer(object):
       assert isinstance(valid_ds, (tf.data.Dataset, OwnedIterator)), \
         'valid_ds must be instance of tf.data.Datasets'
     valid_freq = max(1, int(valid_freq))
+    nan_check_freq = max(1, int(nan_check_freq))
+    steps_per_execution = max(1, int(steps_per_execution))
     valid_interval = float(valid_interval)
     if valid_interval > 0:  # prefer the interval
       valid_freq = 1
@@ -606,6 +874,70 @@ class Trainer(object):
             f"Metrics must be instance of dictionary, but return: {metrics}")
       return loss, metrics
 
+    ### running sums on device, the host only reads them when logging
+    train_metrics = MetricAccumulator(name='train')
+    valid_metrics = MetricAccumulator(name='valid')
+
+    def train_step(inputs):
+      loss, metrics = fn_step(inputs, training=True)
+      train_metrics.update(loss, metrics)
+      return loss, metrics
+
+    def valid_step(inputs):
+      loss, metrics = fn_step(inputs, training=False)
+      valid_metrics.update(loss, metrics)
+      return loss, metrics
+
+    def train_steps(iterator, n_steps):
+      # run `n_steps` optimization steps or until the iterator is exhausted,
+      # the loss and metrics are only kept by `train_metrics`
+      n = tf.constant(0, dtype=tf.int32)
+      for _ in tf.range(n_steps):
+        inputs = iterator.get_next_as_optional()
+        if not inputs.has_value():
+          break
+        train_step(inputs.get_value())
+        n += 1
+      return n
+
+    if compile_graph:
+      train_step = tf.function(train_step, autograph=False)
+      valid_step = tf.function(valid_step, autograph=False)
+      train_steps = tf.function(train_steps, autograph=True)
+
+    ### iterate the training data, yield the number of steps executed
+    def single_step_iterator(progress):
+      for cur_iter, inputs in enumerate(progress):
+        if max_iter > 0 and cur_iter >= max_iter:
+          break
+        tf.summary.experimental.set_step(self.n_iter + 1)
+        loss, metrics = train_step(inputs)
+        yield 1, loss, metrics
+
+    def multi_steps_iterator(progress):
+      iterator = iter(train_ds)
+      n_total = 0
+      while max_iter <= 0 or n_total < max_iter:
+        tf.summary.experimental.set_step(self.n_iter + 1)
+        # first step runs alone, so all variables are created eagerly
+        if n_total == 0:
+          inputs = next(iterator, None)
+          if inputs is None:
+            break
+          loss, metrics = train_step(inputs)
+          n_steps = 1
+        else:
+          n_steps = steps_per_execution if max_iter <= 0 else \
+            min(steps_per_execution, max_iter - n_total)
+          n_steps = int(
+              train_steps(iterator, tf.constant(n_steps, dtype=tf.int32)))
+          if n_steps == 0:
+            break
+          loss, metrics = train_metrics.result()
+        n_total += n_steps
+        progress.update(n_steps)
+        yield n_steps, loss, metrics
+
     ### callback function
     def _callback():
       results = {}
@@ -619,61 +951,69 @@ class Trainer(object):
 
     ### validating function
     def valid():
-      epoch_loss = []
-      epoch_metrics = defaultdict(list)
+      valid_metrics.reset()
+      _metrics = {}
       valid_progress = tqdm(
           enumerate(valid_ds.repeat(1)),
           desc=f"Validating {valid_freq}(it) or {valid_interval:.1f}(s)")
       for it, inputs in valid_progress:
-        _loss, _metrics = fn_step(inputs, training=False)
-        # store for calculating average
-        epoch_loss.append(_loss)
-        for k, v in _metrics.items():
-          epoch_metrics[k].append(v)
-      epoch_loss = tf.reduce_mean(epoch_loss, axis=0)
-      epoch_metrics = {
-          k: tf.reduce_mean(v, axis=0) for k, v in epoch_metrics.items()
-      }
-      return epoch_loss, epoch_metrics
+        _, _metrics = valid_step(inputs)
+      # streaming mean of all validation steps
+      return valid_metrics.result(last_metrics=_metrics)
 
     ### training function
     def train():
       global _CURRENT_TRAINER
       _CURRENT_TRAINER = self
       self._is_training = True
-      progress = tqdm(train_ds, desc=f"Traning {max_iter}(its)")
+      if steps_per_execution > 1:
+        progress = tqdm(total=max_iter if max_iter > 0 else None,
+                        desc=f"Traning {max_iter}(its) "
+                        f"{steps_per_execution}(steps/execution)")
+        steps_iterator = multi_steps_iterator(progress)
+      else:
+        progress = tqdm(train_ds, desc=f"Traning {max_iter}(its)")
+        steps_iterator = single_step_iterator(progress)
       self._current_train_progress = progress
       start_time = progress.start_t
       last_print_time = 0
       last_valid_time = start_time
       is_nan = False
-      for cur_iter, inputs in enumerate(progress):
-        self._n_iter += 1
+      train_metrics.reset()
+      for cur_iter, (n_steps, loss, metrics) in enumerate(steps_iterator):
+        self._n_iter += n_steps
         tf.summary.experimental.set_step(self.n_iter)
-        # ====== check maximum iteration ====== #
-        if max_iter > 0 and cur_iter >= max_iter:
-          break
         # the tensorboard will change after each iteration
         self._cached_tensorboard = None
+        # True if the last `n_steps` iterations passed a multiple of `freq`
+        is_due = lambda freq: \
+          self.n_iter // freq > (self.n_iter - n_steps) // freq
         # ====== train ====== #
-        loss, metrics = fn_step(inputs, training=True)
         self._last_train_loss = loss
         self._last_train_metrics = dict(metrics)
-        # metric could be hiden by add '_' to the beginning
-        metrics = {k: v for k, v in metrics.items() if '_' != k[0]}
-        # do not record the loss and metrics at every iteration, the
-        # performance will drop about 40%
-        if terminate_on_nan and np.isnan(loss) or np.isinf(loss):
+        # ====== check NaN, only synchronize every few iterations ====== #
+        interval = progress._time() - last_print_time
+        is_logging = interval >= logging_interval
+        interval = progress._time() - last_valid_time
+        is_validating = cur_iter == 0 or \
+          (is_due(valid_freq) and interval >= valid_interval)
+        if terminate_on_nan and \
+          (is_logging or is_validating or is_due(nan_check_freq)) and \
+            train_metrics.has_nan():
           is_nan = True
           progress.write(
               f" *Terminated on NaN loss at iteration #{int(self.n_iter)}")
           for k, v in metrics.items():
-            progress.write(f"\t{k}: {v}")
+            if '_' != k[0]:
+              progress.write(f"\t{k}: {v}")
           break
         # ====== logging ====== #
-        interval = progress._time() - last_print_time
-        if interval >= logging_interval:
-          # summarize the batch loss and metrics
+        if is_logging:
+          # mean of the loss and metrics since the last logging
+          loss, metrics = train_metrics.result(last_metrics=metrics)
+          train_metrics.reset()
+          # metric could be hiden by add '_' to the beginning
+          metrics = {k: v for k, v in metrics.items() if '_' != k[0]}
           _save_summary(loss, metrics, prefix="train/")
           _print_summary(progress,
                          log_tag,
@@ -683,9 +1023,7 @@ class Trainer(object):
                          is_valid=False)
           last_print_time = progress._time()
         # ====== validation ====== #
-        interval = progress._time() - last_valid_time
-        if cur_iter == 0 or \
-          (self.n_iter % valid_freq == 0 and interval >= valid_interval):
+        if is_validating:
           if valid_ds is not None:
             # finish the validation
             val_loss, val_metrics = valid()
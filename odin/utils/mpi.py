@@ -1,17 +1,23 @@
 from __future__ import absolute_import, division, print_function
 
+import atexit
+import copy
+import importlib
 import inspect
+import multiprocessing
+import multiprocessing.connection as _connection
 import os
 import pickle
 import sys
 import threading
 import time
+import traceback
 import types
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 from functools import wraps
-from multiprocessing import (Lock, Pipe, Process, Queue, Value, cpu_count,
-                             current_process)
+from multiprocessing import (Array, BoundedSemaphore, Lock, Pipe, Process,
+                             Queue, Value, cpu_count, current_process)
 from multiprocessing.pool import Pool, ThreadPool
 from typing import Any, Callable, Dict, List, Optional
 
@@ -32,6 +38,9 @@ __all__ = [
     'async_process',
     'TimeoutTask',
     'run_with_timeout',
+    'SharedMemoryRing',
+    'WorkerPool',
+    'get_worker_pool',
     'MPI',
 ]
 
@@ -383,9 +392,572 @@ class SharedCounter(object):
     del self.val
 
 
+class _ShmArray(object):
+  """ Descriptor of an array stored inside a `SharedMemoryRing` slot """
+
+  __slots__ = ('offset', 'shape', 'dtype')
+
+  def __init__(self, offset, shape, dtype):
+    self.offset = offset
+    self.shape = shape
+    self.dtype = dtype
+
+
+class SharedMemoryRing(object):
+  r""" A pool of fixed-size `multiprocessing.shared_memory` blocks used for
+  transporting `numpy.ndarray` between processes without pickling.
+
+  The producer (worker) acquires a free slot, writes all large arrays of a
+  result into the slot, and only sends a small descriptor through the queue.
+  The consumer (main process) rebuilds the arrays from the slot and returns
+  the slot to the pool.
+
+  Arguments:
+    n_slots : int
+        number of blocks in the pool, a producer blocks when all slots are
+        in use (i.e. natural backpressure).
+    slot_size : int
+        size in bytes of each block, result bigger than this size is sent
+        through the queue using pickle.
+    min_nbytes : int
+        only arrays bigger than this number of bytes are put in the shared
+        memory, small arrays are cheaper to be pickled.
+    copy : bool
+        if True, the consumer copies arrays out of the slot and releases it
+        immediately, otherwise, the returned arrays are views of the shared
+        memory and the slot is only released at the next call to `decode`
+        (i.e. the arrays are only valid until the next result is fetched).
+
+  Note:
+    The ring must be created before the worker processes are forked.
+  """
+
+  def __init__(self,
+               n_slots=8,
+               slot_size=16 * 1024 * 1024,
+               min_nbytes=1024,
+               copy=True):
+    try:
+      from multiprocessing import shared_memory
+    except ImportError:
+      raise RuntimeError("SharedMemoryRing requires python>=3.8 for "
+                         "`multiprocessing.shared_memory`")
+    self._n_slots = max(1, int(n_slots))
+    self._slot_size = int(slot_size)
+    self._min_nbytes = int(min_nbytes)
+    self._copy = bool(copy)
+    self._blocks = [
+        shared_memory.SharedMemory(create=True, size=self._slot_size)
+        for _ in range(self._n_slots)
+    ]
+    self._free = Queue(maxsize=0)
+    for i in range(self._n_slots):
+      self._free.put_nowait(i)
+    self._holding = None
+    self._owner_pid = os.getpid()
+
+  @property
+  def n_slots(self):
+    return self._n_slots
+
+  @property
+  def slot_size(self):
+    return self._slot_size
+
+  # ==================== helpers ==================== #
+  def _collect(self, obj, arrays):
+    if isinstance(obj, np.ndarray):
+      if obj.nbytes >= self._min_nbytes and obj.dtype != np.object_:
+        arrays.append(obj)
+    elif isinstance(obj, dict):
+      for v in obj.values():
+        self._collect(v, arrays)
+    elif isinstance(obj, (tuple, list)):
+      for v in obj:
+        self._collect(v, arrays)
+
+  @staticmethod
+  def _map(fn, obj):
+    """ Rebuild the container `obj` with `fn` applied on its items, keeping
+    the container type (e.g. `defaultdict` factory, `namedtuple` fields) """
+    if isinstance(obj, dict):
+      new = copy.copy(obj)
+      for k, v in obj.items():
+        new[k] = fn(v)
+      return new
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+      return type(obj)(*[fn(v) for v in obj])
+    return type(obj)(fn(v) for v in obj)
+
+  def _replace(self, obj, mapping):
+    if isinstance(obj, np.ndarray):
+      return mapping.get(id(obj), obj)
+    if isinstance(obj, (dict, tuple, list)):
+      return self._map(lambda v: self._replace(v, mapping), obj)
+    return obj
+
+  def _restore(self, obj, buf):
+    if isinstance(obj, _ShmArray):
+      x = np.ndarray(shape=obj.shape,
+                     dtype=obj.dtype,
+                     buffer=buf,
+                     offset=obj.offset)
+      return np.array(x, copy=True) if self._copy else x
+    if isinstance(obj, (dict, tuple, list)):
+      return self._map(lambda v: self._restore(v, buf), obj)
+    return obj
+
+  # ==================== producer and consumer ==================== #
+  def encode(self, obj):
+    """ Called by the producer, write all large arrays in `obj` into a free
+    slot and return a lightweight message `(slot_id, skeleton)` """
+    arrays = []
+    self._collect(obj, arrays)
+    if len(arrays) == 0:
+      return (None, obj)
+    # 64-bytes aligned layout of all arrays within one slot
+    layout = []
+    offset = 0
+    for x in arrays:
+      layout.append(offset)
+      offset += (x.nbytes + 63) // 64 * 64
+    if offset > self._slot_size:  # too big, fallback to pickle
+      return (None, obj)
+    slot = self._free.get()
+    buf = self._blocks[slot].buf
+    mapping = {}
+    for x, start in zip(arrays, layout):
+      dst = np.ndarray(shape=x.shape, dtype=x.dtype, buffer=buf, offset=start)
+      dst[...] = x
+      mapping[id(x)] = _ShmArray(start, x.shape, x.dtype)
+      del dst
+    return (slot, self._replace(obj, mapping))
+
+  def decode(self, msg):
+    """ Called by the consumer, rebuild the original object from the message
+    created by `encode` and release the slot """
+    if self._holding is not None:
+      self._free.put(self._holding)
+      self._holding = None
+    slot, obj = msg
+    if slot is None:
+      return obj
+    obj = self._restore(obj, self._blocks[slot].buf)
+    if self._copy:
+      self._free.put(slot)
+    else:
+      self._holding = slot
+    return obj
+
+  def close(self):
+    if os.getpid() != self._owner_pid:
+      return
+    self._free.close()
+    for b in self._blocks:
+      try:
+        b.close()
+        b.unlink()
+      except (BufferError, FileNotFoundError):
+        pass
+    self._blocks = []
+
+
+class _WorkStealingScheduler(object):
+  r""" Cost-aware scheduler with one deque of chunks for each worker
+
+  The chunks are sorted by their costs (longest-first) and greedily assigned
+  to the least loaded worker. A worker pops the next most expensive chunk
+  from the front of its own deque, once it runs out of work, it steals the
+  cheapest chunk from the back of the worker with the highest remaining
+  cost.
+
+  Arguments:
+    costs : numpy.ndarray
+        cost estimation (e.g. file size) of each job
+    ncpu : int
+        number of workers
+    batch : int
+        number of jobs grouped into a chunk
+  """
+
+  def __init__(self, costs, ncpu, batch):
+    costs = np.asarray(costs, dtype='float64').ravel()
+    if np.any(costs < 0) or not np.all(np.isfinite(costs)):
+      raise ValueError("`costs` must be finite and non-negative values.")
+    order = np.argsort(-costs, kind='mergesort')
+    chunks = [order[i:i + batch] for i in range(0, len(order), batch)]
+    chunk_costs = np.array([costs[c].sum() for c in chunks], dtype='float64')
+    # greedy longest processing time first assignment
+    load = np.zeros((ncpu,), dtype='float64')
+    deques = [[] for _ in range(ncpu)]
+    for cid in np.argsort(-chunk_costs, kind='mergesort'):
+      pID = int(np.argmin(load))
+      deques[pID].append(cid)
+      load[pID] += chunk_costs[cid]
+    # ====== flatten everything into shared arrays ====== #
+    self._ncpu = int(ncpu)
+    self._jobs = Array('l', np.concatenate(chunks).tolist(), lock=False)
+    offsets = np.cumsum([0] + [len(c) for c in chunks])
+    self._offsets = Array('l', offsets.tolist(), lock=False)
+    self._chunk_costs = Array('d', chunk_costs.tolist(), lock=False)
+    self._deques = Array('l', [int(i) for d in deques for i in d], lock=False)
+    sizes = np.cumsum([0] + [len(d) for d in deques])
+    self._head = Array('l', sizes[:-1].tolist(), lock=False)
+    self._tail = Array('l', sizes[1:].tolist(), lock=False)
+    self._remain_cost = Array('d', load.tolist(), lock=False)
+    self._steals = Array('l', int(ncpu), lock=False)
+    self._lock = Lock()
+
+  @property
+  def n_steals(self):
+    return list(self._steals)
+
+  def get(self, pID):
+    """ Return `(indices, cost)` of the next chunk for given worker,
+    or `None` if all chunks are consumed """
+    with self._lock:
+      head, tail = self._head[pID], self._tail[pID]
+      if head < tail:
+        cid = self._deques[head]
+        self._head[pID] = head + 1
+        owner = pID
+      else:
+        owner = -1
+        max_cost = -1.
+        for i in range(self._ncpu):
+          if self._head[i] < self._tail[i] and \
+            self._remain_cost[i] > max_cost:
+            owner = i
+            max_cost = self._remain_cost[i]
+        if owner < 0:
+          return None
+        tail = self._tail[owner] - 1
+        cid = self._deques[tail]
+        self._tail[owner] = tail
+        self._steals[pID] += 1
+      cost = self._chunk_costs[cid]
+      self._remain_cost[owner] -= cost
+    start, end = self._offsets[cid], self._offsets[cid + 1]
+    return self._jobs[start:end], cost
+
+
+# ===========================================================================
+# Persistent worker pool
+# ===========================================================================
+_POOL_TIMEOUT = 1.0  # seconds between each health check
+
+
+def _pool_worker(wid, inbox, outbox, warm_imports):
+  """ Main loop of a `WorkerPool` process, the messages from the inbox:
+
+    - `('func', call_id, func)`: cache the function of a map call
+    - `('task', call_id, task_id, jobs, batch)`: run the cached function
+    - `None`: exit
+
+  The results are sent through `outbox`, the write end of a pipe owned by
+  this worker only, so a killed worker could not leave a shared lock
+  acquired and block the other workers.
+  """
+  for name in warm_imports:
+    try:
+      importlib.import_module(name)
+    except ImportError:
+      pass
+  call_id = None
+  func = None
+  while True:
+    msg = inbox.get()
+    if msg is None:
+      break
+    if msg[0] == 'func':
+      call_id, func = msg[1], msg[2]
+      continue
+    _, task_call_id, task_id, jobs, batch = msg
+    if task_call_id != call_id:  # outdated task of a cancelled call
+      continue
+    try:
+      ret = func(jobs[0]) if batch == 1 else func(jobs)
+      if not isinstance(ret, types.GeneratorType):
+        ret = (ret,)
+      for r in ret:
+        if r is not None:
+          outbox.send(('result', call_id, task_id, r))
+      outbox.send(('done', call_id, task_id, wid))
+    except Exception:
+      outbox.send(('error', call_id, task_id, traceback.format_exc()))
+  outbox.close()
+
+
+class WorkerPool(object):
+  r""" A long-lived pool of processes which could be reused for many map
+  calls (e.g. `MPI(..., pool=pool)`), this avoid the overhead of forking
+  and importing modules for every short call.
+
+  Each worker owns an inbox, the mapping function is sent once to each
+  worker at the beginning of a call, then only the jobs are sent. A worker
+  died during a call is replaced and its unfinished tasks are re-submitted.
+
+  Arguments:
+    ncpu : int
+        number of worker processes
+    start_method : {None, 'fork', 'forkserver', 'spawn'}
+        start method of the processes, None for the platform default.
+    warm_imports : list of string
+        modules imported by each worker at startup
+    max_inflight : int
+        maximum number of tasks sent to a worker in advance
+
+  Note:
+    Since the processes are started before the mapping function is known,
+    the function and its jobs must be pickle-able (i.e. a module-level
+    function or `functools.partial`, no closure or lambda).
+  """
+
+  def __init__(self,
+               ncpu=None,
+               start_method=None,
+               warm_imports=('numpy',),
+               max_inflight=2):
+    if ncpu is None:
+      ncpu = cpu_count() - 1
+    self._ncpu = max(1, int(ncpu))
+    self._start_method = start_method
+    self._ctx = multiprocessing.get_context(start_method)
+    self._warm_imports = tuple(warm_imports)
+    self._max_inflight = max(1, int(max_inflight))
+    self._workers = [None] * self._ncpu
+    self._inboxes = [None] * self._ncpu
+    self._outboxes = [None] * self._ncpu
+    self._n_replaced = 0
+    self._call_id = 0
+    self._lock = threading.Lock()
+    self._closed = False
+    for wid in range(self._ncpu):
+      self._start_worker(wid)
+
+  # ==================== properties ==================== #
+  @property
+  def ncpu(self):
+    return self._ncpu
+
+  @property
+  def start_method(self):
+    return self._start_method
+
+  @property
+  def closed(self):
+    return self._closed
+
+  @property
+  def n_replaced(self):
+    """ Number of dead workers replaced by the health checks """
+    return self._n_replaced
+
+  def __str__(self):
+    return '<WorkerPool ncpu:%d start:%s alive:%d replaced:%d>' % \
+      (self._ncpu, self._ctx.get_start_method(),
+       sum(p.is_alive() for p in self._workers), self._n_replaced)
+
+  # ==================== helpers ==================== #
+  def _start_worker(self, wid):
+    inbox = self._ctx.Queue(maxsize=0)
+    reader, writer = self._ctx.Pipe(duplex=False)
+    p = self._ctx.Process(target=_pool_worker,
+                          args=(wid, inbox, writer, self._warm_imports),
+                          daemon=True)
+    p.start()
+    # only the worker keeps the write end, reading EOF means it died
+    writer.close()
+    self._workers[wid] = p
+    self._inboxes[wid] = inbox
+    self._outboxes[wid] = reader
+
+  def health_check(self):
+    """ Replace all dead workers, return list of replaced worker ID """
+    if self._closed:
+      raise RuntimeError("WorkerPool is closed.")
+    replaced = []
+    for wid, p in enumerate(self._workers):
+      if not p.is_alive():
+        self._inboxes[wid].close()
+        self._outboxes[wid].close()
+        self._start_worker(wid)
+        replaced.append(wid)
+    self._n_replaced += len(replaced)
+    return replaced
+
+  # ==================== mapping ==================== #
+  def imap(self, func, jobs, batch=1, keep_order=False, ncpu=None):
+    """ Apply `func` on `jobs` and iterate over the results, the semantic
+    is the same as `MPI`: if `batch=1`, `func(job)` is called, otherwise,
+    `func([job1, job2, ...])`, returned generator is traversed and `None`
+    results are ignored.
+
+    Arguments:
+      ncpu : int
+          number of workers used by this call, all the workers if None.
+
+    Note:
+      Only one map call is active at a time, a new call cancels the
+      unfinished one (e.g. a partially consumed iterator), continue
+      iterating the cancelled call raises `RuntimeError`.
+    """
+    try:
+      pickle.dumps(func, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+      raise ValueError("Mapping function for WorkerPool must be "
+                       "pickle-able, error: %s" % str(e))
+    batch = max(1, int(batch))
+    ncpu = self._ncpu if ncpu is None else \
+      int(np.clip(int(ncpu), 1, self._ncpu))
+    tasks = [list(jobs[i:i + batch]) for i in range(0, len(jobs), batch)]
+    return self._imap(func, tasks, batch, keep_order, ncpu)
+
+  def _imap(self, func, tasks, batch, keep_order, ncpu):
+    pending = list(range(len(tasks)))[::-1]  # stack of task_id
+    inflight = [set() for _ in range(self._ncpu)]
+
+    def submit(wid):
+      while wid < ncpu and \
+        len(inflight[wid]) < self._max_inflight and len(pending) > 0:
+        task_id = pending.pop()
+        inflight[wid].add(task_id)
+        self._inboxes[wid].put(('task', call_id, task_id, tasks[task_id],
+                                batch))
+
+    def replace_dead_workers():
+      for wid in self.health_check():
+        # re-submit unfinished tasks of the dead worker
+        pending.extend(sorted(inflight[wid], reverse=True))
+        inflight[wid].clear()
+        if wid < ncpu:
+          self._inboxes[wid].put(('func', call_id, func))
+          submit(wid)
+
+    # the lock is only held while communicating with the workers, never
+    # while the results are consumed
+    with self._lock:
+      self.health_check()
+      self._call_id += 1
+      call_id = self._call_id
+      for wid in range(ncpu):
+        self._inboxes[wid].put(('func', call_id, func))
+        submit(wid)
+    # ====== collecting the results ====== #
+    n_done = 0
+    next_task = 0
+    ordered = defaultdict(list)
+    finished = set()
+    messages = []
+    while n_done < len(tasks):
+      results = []
+      with self._lock:
+        if self._call_id != call_id:
+          raise RuntimeError("WorkerPool map call was cancelled by a newer "
+                             "map call.")
+        if len(messages) == 0:
+          ready = _connection.wait(self._outboxes, timeout=_POOL_TIMEOUT)
+          if len(ready) == 0:
+            replace_dead_workers()
+          for wid, outbox in enumerate(self._outboxes):
+            if outbox in ready:
+              try:
+                messages.append(outbox.recv())
+              except (EOFError, OSError):
+                # the worker died, its tasks are re-submitted after
+                # all its previous messages are processed
+                messages.append(('dead', call_id, None, wid))
+        while len(messages) > 0:
+          msg = messages.pop(0)
+          kind, msg_call_id, task_id = msg[:3]
+          if kind == 'dead':
+            self._workers[msg[3]].join(timeout=_POOL_TIMEOUT)
+            replace_dead_workers()
+            continue
+          if msg_call_id != call_id:
+            continue
+          if kind == 'error':
+            raise RuntimeError("Error in WorkerPool task #%d:\n%s" %
+                               (task_id, msg[3]))
+          elif kind == 'result':
+            if keep_order:
+              ordered[task_id].append(msg[3])
+            else:
+              results.append(msg[3])
+          elif kind == 'done':
+            wid = msg[3]
+            inflight[wid].discard(task_id)
+            n_done += 1
+            submit(wid)
+            if keep_order:
+              finished.add(task_id)
+              while next_task in finished:
+                results.extend(ordered.pop(next_task, ()))
+                finished.remove(next_task)
+                next_task += 1
+      for r in results:
+        yield r
+
+  def map(self, func, jobs, batch=1, ncpu=None):
+    """ Same as `imap` but return the list of ordered results """
+    return list(
+        self.imap(func, jobs, batch=batch, keep_order=True, ncpu=ncpu))
+
+  def close(self, timeout=None):
+    if self._closed:
+      return
+    self._closed = True
+    for inbox, p in zip(self._inboxes, self._workers):
+      if p.is_alive():
+        inbox.put(None)
+    for inbox, p in zip(self._inboxes, self._workers):
+      p.join(timeout=timeout)
+      if p.is_alive():
+        p.terminate()
+      inbox.close()
+    for outbox in self._outboxes:
+      outbox.close()
+
+
+_WORKER_POOL = None
+
+
+def get_worker_pool(ncpu=None, start_method=None, warm_imports=('numpy',)):
+  """ Return the shared `WorkerPool` of the current process, the pool is
+  created lazily and re-created if it was closed or a different
+  `start_method` is explicitly requested.
+
+  The pool is shared by all the callers regardless of their number of
+  jobs, `ncpu` (default: `cpu_count() - 1`) is only used when the pool is
+  created, each map call could use fewer workers (i.e. `imap(ncpu=...)`).
+  """
+  global _WORKER_POOL
+  if ncpu is None:
+    ncpu = cpu_count() - 1
+  ncpu = max(1, int(ncpu))
+  if _WORKER_POOL is not None and \
+    (_WORKER_POOL.closed or
+     (start_method is not None and
+      _WORKER_POOL._ctx.get_start_method() != start_method)):
+    _WORKER_POOL.close()
+    _WORKER_POOL = None
+  if _WORKER_POOL is None:
+    _WORKER_POOL = WorkerPool(ncpu=ncpu,
+                              start_method=start_method,
+                              warm_imports=warm_imports)
+  return _WORKER_POOL
+
+
+@atexit.register
+def _close_worker_pool():
+  if _WORKER_POOL is not None:
+    _WORKER_POOL.close(timeout=1)
+
+
 class MPI(object):
   r""" MPI - Simple multi-processing interface
-  This class use round robin to schedule the tasks to each processes
+  This class use round robin to schedule the tasks to each processes,
+  or a cost-aware work-stealing scheduler (i.e. `scheduler='steal'`)
 
   Arguments:
     jobs: list, tuple, numpy.ndarray
@@ -414,19 +986,54 @@ class MPI(object):
         continuously receives chunks from main process.
         if `False`, jobs are splited into equal size for each process at the
         beginning, do this if you sure all jobs require same processing time.
-    backend: {'pyzmq', 'python'}
-        using 'pyzmq' for interprocess communication or default python Queue.
+    backend: {'pyzmq', 'python', 'shm'}
+        using 'pyzmq' for interprocess communication or default python Queue,
+        'shm' is python Queue for small messages but all large
+        `numpy.ndarray` in the results are transported via
+        `SharedMemoryRing` instead of pickling.
+    shm_size: int
+        size in bytes of each shared memory slot for 'shm' backend, results
+        bigger than this size are sent via the Queue.
+    costs: {None, list of scalar}
+        cost estimation for each job (e.g. file size or duration), if given
+        the jobs are dispatched longest-first.
+    scheduler: {'queue', 'steal'}
+        'queue' - all processes get the next chunk from a single shared Queue.
+        'steal' - the chunks are assigned to each process in advance to
+        balance the total costs, an idle process steals the remaining chunks
+        from the busiest one.
+    pool: {None, True, WorkerPool}
+        if given, run the jobs on a persistent `WorkerPool` instead of forking
+        new processes (`True` for the shared pool from `get_worker_pool`),
+        `func` must be pickle-able, `backend` and `scheduler` are ignored,
+        at most `ncpu` workers of the pool are used.
 
   Note:
-    Using pyzmq backend often 3 time faster than python Queue
+    Using pyzmq backend often 3 time faster than python Queue, 'shm' backend
+    is the fastest for big `numpy.ndarray` results (e.g. features matrices).
   """
 
-  def __init__(self, jobs, func, ncpu=1, batch=1, hwm=144, backend='python'):
+  def __init__(self,
+               jobs,
+               func,
+               ncpu=1,
+               batch=1,
+               hwm=144,
+               backend='python',
+               shm_size=16 * 1024 * 1024,
+               costs=None,
+               scheduler='queue',
+               pool=None):
     super(MPI, self).__init__()
     backend = str(backend).lower()
-    if backend not in ('pyzmq', 'python'):
-      raise ValueError("Only support 2 backends: 'pyzmq', and 'python'")
+    if backend not in ('pyzmq', 'python', 'shm'):
+      raise ValueError("Only support 3 backends: 'pyzmq', 'python' and 'shm'")
+    scheduler = str(scheduler).lower()
+    if scheduler not in ('queue', 'steal'):
+      raise ValueError("Only support 2 schedulers: 'queue' and 'steal'")
     self._backend = backend
+    self._shm_size = int(shm_size)
+    self._shm = None
     self._ID = np.random.randint(0, 10e8, dtype=int)
     # ====== check map_func ====== #
     if not hasattr(func, '__call__'):
@@ -436,7 +1043,16 @@ class MPI(object):
     # never use all available CPU
     if ncpu is None:
       ncpu = cpu_count() - 1
-    self._ncpu = min(np.clip(int(ncpu), 1, cpu_count() - 1), len(jobs))
+    max_cpu = max(1, cpu_count() - 1)
+    self._ncpu = min(np.clip(int(ncpu), 1, max_cpu), len(jobs))
+    if pool is True:
+      pool = get_worker_pool()
+    elif pool is not None and not isinstance(pool, WorkerPool):
+      raise ValueError("`pool` must be None, True or instance of WorkerPool, "
+                       "but given: %s" % str(type(pool)))
+    if pool is not None:
+      self._ncpu = min(self._ncpu, pool.ncpu)
+    self._pool = pool
     self._batch = max(1, int(batch))
     self._hwm = max(0, int(hwm))
     # ====== internal states ====== #
@@ -451,11 +1067,32 @@ class MPI(object):
       raise ValueError("`jobs` must be instance of tuple or list.")
     self._jobs = jobs
     self._remain_jobs = SharedCounter(len(self._jobs))
-    # Equally split for all processes
+    if costs is not None:
+      costs = np.asarray(costs, dtype='float64').ravel()
+      if len(costs) != len(jobs):
+        raise ValueError("Given %d `costs` but %d `jobs`" %
+                         (len(costs), len(jobs)))
+    self._costs = costs
+    # (n_jobs, busy_time, cost, wait_time) for each process
+    self._stats = Array('d', int(self._ncpu) * 4, lock=False)
+    self._start_time = None
+    self._end_time = None
     self._tasks = Queue(maxsize=0)
-    for i in segment_list(np.arange(len(self._jobs), dtype='int32'),
-                          size=self._batch):
-      self._tasks.put_nowait(i)
+    if scheduler == 'steal':
+      self._scheduler = _WorkStealingScheduler(
+          np.ones((len(jobs),)) if costs is None else costs,
+          ncpu=self._ncpu,
+          batch=self._batch)
+    else:
+      self._scheduler = None
+      # Equally split for all processes
+      chunks = segment_list(np.arange(len(self._jobs), dtype='int32'),
+                            size=self._batch)
+      # longest-first
+      if costs is not None:
+        chunks = sorted(chunks, key=lambda c: -costs[c].sum())
+      for i in chunks:
+        self._tasks.put_nowait(i)
     for i in range(self._ncpu):  # ending signal
       self._tasks.put_nowait(None)
     # ====== only 1 iteration is created ====== #
@@ -482,6 +1119,37 @@ class MPI(object):
   def is_running(self):
     return self._is_running
 
+  @property
+  def stats(self):
+    """ Utilisation statistics of each process, a list of dictionary:
+
+      - 'n_jobs' : number of processed jobs
+      - 'busy_time' : seconds spent on running `func`
+      - 'wait_time' : seconds blocked by the consumer (i.e. `hwm` is reached)
+      - 'cost' : total cost of processed jobs (number of jobs if no `costs`)
+      - 'n_steals' : number of chunks stolen from other processes
+      - 'utilisation' : busy_time / elapsed time
+    """
+    if self._start_time is None:
+      elapsed = 0.
+    else:
+      elapsed = (time.time()
+                 if self._end_time is None else self._end_time) - \
+                   self._start_time
+    steals = ([0] * self._ncpu
+              if self._scheduler is None else self._scheduler.n_steals)
+    stats = []
+    for pID in range(self._ncpu):
+      n_jobs, busy, cost, wait = self._stats[pID * 4:(pID + 1) * 4]
+      stats.append(
+          dict(n_jobs=int(n_jobs),
+               busy_time=busy,
+               wait_time=wait,
+               cost=cost,
+               n_steals=int(steals[pID]),
+               utilisation=busy / elapsed if elapsed > 0 else 0.))
+    return stats
+
   def terminate(self):
     self._terminate_now = True
     # force everything finished
@@ -493,15 +1161,38 @@ class MPI(object):
         pass
 
   # ==================== helper ==================== #
+  def _next_task(self, pID):
+    """ Called by the worker, return the indices of next chunk of jobs """
+    if self._scheduler is None:
+      return self._tasks.get()
+    t = self._scheduler.get(pID)
+    return None if t is None else t[0]
+
+  def _update_stats(self, pID, indices, busy_time, wait_time):
+    """ Called by the worker, each process only writes its own row """
+    row = pID * 4
+    self._stats[row] += len(indices)
+    self._stats[row + 1] += busy_time
+    self._stats[row + 2] += (len(indices) if self._costs is None else
+                             float(np.sum(self._costs[indices])))
+    self._stats[row + 3] += wait_time
+
   def __iter(self):
     # Initialize
     if not self._is_init:
-      if self._backend == 'pyzmq':
+      self._start_time = time.time()
+      if self._pool is not None:
+        init_func = lambda: None
+        run_func = self._run_pool
+      elif self._backend == 'pyzmq':
         init_func = self._init_zmq
         run_func = self._run_pyzmq
       elif self._backend == 'python':
         init_func = self._init_python
         run_func = self._run_python
+      elif self._backend == 'shm':
+        init_func = self._init_shm
+        run_func = self._run_python
       init_func()
       self._is_init = True
     yield None  # yeild not thing for init
@@ -537,10 +1228,11 @@ class MPI(object):
       sk.bind("ipc:///tmp/%d" % (self._ID + pID))
 
       # ====== Doing the jobs ====== #
-      t = tasks.get()
-      while t is not None:
+      indices = self._next_task(pID)
+      while indices is not None:
+        start_time = time.time()
         # `t` is just list of indices
-        t = [self._jobs[i] for i in t]
+        t = [self._jobs[i] for i in indices]
         # monitor current number of remain jobs
         remain_jobs.add(-len(t))
         if self._batch == 1:  # batch=1, NO need for list of inputs
@@ -557,8 +1249,9 @@ class MPI(object):
             sk.send_pyobj(r)
         # delete old data (this work, checked)
         del ret
+        self._update_stats(pID, indices, time.time() - start_time, 0.)
         # ge tne tasks
-        t = tasks.get()
+        indices = self._next_task(pID)
       # ending signal
       sk.send_pyobj(None)
       # wait for ending message
@@ -601,17 +1294,43 @@ class MPI(object):
         except self._zmq_again:
           pass
 
+  # ==================== worker pool ==================== #
+  def _run_pool(self):
+    self._processes = []
+    jobs = self._jobs
+    # the pool do not know about the costs, sort jobs longest-first here
+    if self._costs is not None:
+      order = np.argsort(-self._costs, kind='mergesort')
+      jobs = [jobs[i] for i in order]
+    for r in self._pool.imap(self._func,
+                             jobs,
+                             batch=self._batch,
+                             ncpu=self._ncpu):
+      yield r
+    self._remain_jobs.add(-len(self._jobs))
+
+  # ==================== shared memory ==================== #
+  def _init_shm(self):
+    # the ring must be created before forking the workers, one slot for
+    # each outstanding result on the consumer side and the producer side
+    self._shm = SharedMemoryRing(n_slots=max(2, min(self._hwm,
+                                                    2 * self._ncpu)),
+                                 slot_size=self._shm_size,
+                                 copy=True)
+    self._init_python()
+
   # ==================== python queue ==================== #
   def _init_python(self):
 
-    def worker_func(tasks, queue, counter, remain_jobs):
-      hwm = self._hwm
-      minimum_update_size = max(hwm // self._ncpu, 1)
+    def worker_func(pID, queue, slots, remain_jobs):
+      encode = (lambda x: x) if self._shm is None else self._shm.encode
       # ====== Doing the jobs ====== #
-      t = tasks.get()
-      while t is not None:
+      indices = self._next_task(pID)
+      while indices is not None:
+        start_time = time.time()
+        wait_time = 0.
         # `t` is just list of indices
-        t = [self._jobs[i] for i in t]
+        t = [self._jobs[i] for i in indices]
         remain_jobs.add(-len(t))  # monitor current number of remain jobs
         if self._batch == 1:  # batch=1, NO need for list of inputs
           ret = self._func(t[0])
@@ -621,39 +1340,30 @@ class MPI(object):
         # iterator and return each result
         if not isinstance(ret, types.GeneratorType):
           ret = (ret,)
-        nb_returned = 0
         for r in ret:
           if r is not None:  # ignore None values
-            queue.put(r)
-            nb_returned += 1
-            # sometime 1 batch get too big, and we need to stop
-            # putting too many data into the queue
-            if nb_returned >= minimum_update_size:
-              counter.add(nb_returned)
-              nb_returned = 0
-              while counter.value > hwm:
-                time.sleep(_SLEEP_TIME)
+            # block until the consumer takes some results out of the queue,
+            # this keep at most `hwm` results in the queue
+            wait_start = time.time()
+            slots.acquire()
+            wait_time += time.time() - wait_start
+            queue.put(encode(r))
         del ret  # delete old data (this work, checked)
-        # increase shared counter (this number must perfectly
-        # counted, only 1 mismatch and deadlock will happen)
-        if nb_returned > 0:
-          counter.add(nb_returned)
-        # check if we need to wait for the consumer here
-        while counter.value > hwm:
-          time.sleep(_SLEEP_TIME)
+        self._update_stats(pID, indices,
+                           time.time() - start_time - wait_time, wait_time)
         # get new tasks
-        t = tasks.get()
+        indices = self._next_task(pID)
       # ending signal
       queue.put(None)
       sys.exit(0)
 
     # ====== multiprocessing variables ====== #
     self._queue = Queue(maxsize=0)
-    self._counter = SharedCounter(initial_value=0)
+    self._slots = BoundedSemaphore(max(1, self._hwm))
     self._processes = [
         Process(target=worker_func,
-                args=(self._tasks, self._queue, self._counter,
-                      self._remain_jobs)) for i in range(self._ncpu)
+                args=(i, self._queue, self._slots, self._remain_jobs))
+        for i in range(self._ncpu)
     ]
     [p.start() for p in self._processes]
 
@@ -666,7 +1376,9 @@ class MPI(object):
           break
         r = self._queue.get()
       if r is not None:
-        self._counter.add(-1)
+        self._slots.release()
+        if self._shm is not None:
+          r = self._shm.decode(r)
         yield r
 
   # ==================== finalize ==================== #
@@ -681,14 +1393,21 @@ class MPI(object):
     # only join started process which has _popen is not None
     else:
       [p.join() for p in self._processes if p._popen is not None]
+    self._end_time = time.time()
     self._tasks.close()
     del self._remain_jobs
+    # ====== pool ====== #
+    if self._pool is not None:
+      pass
     # ====== pyzmq ====== #
-    if self._backend == 'pyzmq':
+    elif self._backend == 'pyzmq':
       for sk in self._sockets:
         sk.close()
       self._ctx.term()
     # ====== python ====== #
-    elif self._backend == 'python':
+    elif self._backend in ('python', 'shm'):
       self._queue.close()
-      del self._counter
+      del self._slots
+      if self._shm is not None:
+        self._shm.close()
+        self._shm = None
@@ -0,0 +1,67 @@
+from __future__ import absolute_import, division, print_function
+
+import unittest
+
+import numpy as np
+
+from odin.backend.metrics import (DetectionEvaluator, compute_EER,
+                                  compute_minDCF, det_curve)
+
+np.random.seed(8)
+
+
+class DetectionEvaluatorTest(unittest.TestCase):
+
+  def test_streaming_detection_metrics(self):
+    rand = np.random.RandomState(8)
+    y_true = (rand.rand(20000) < 0.05).astype('int32')
+    y_score = rand.randn(20000) + 2 * y_true
+    Pfa, Pmiss = det_curve(y_true, y_score)
+    eer = compute_EER(Pfa, Pmiss)
+    dcf = [compute_minDCF(Pfa, Pmiss, Cmiss=1, Cfa=1, Ptrue=p)[0]
+           for p in (0.01, 0.5)]
+    for approximate in (False, True):
+      evaluator = DetectionEvaluator(approximate=approximate, n_bins=4096)
+      for start in range(0, len(y_true), 3000):
+        evaluator.update(y_true[start:start + 3000],
+                         y_score[start:start + 3000])
+      results = evaluator.compute(operating_points=[(1, 1, 0.01),
+                                                    (1, 1, 0.5)])
+      tol = 1e-3 if approximate else 1e-8
+      self.assertAlmostEqual(results['EER'], eer, delta=tol)
+      for (min_dcf, _, _), expected in zip(results['minDCF'], dcf):
+        self.assertAlmostEqual(min_dcf, expected, delta=tol)
+      self.assertEqual(len(results['Pfa']), len(results['Pmiss']))
+
+  def test_approximate_score_range(self):
+    rand = np.random.RandomState(8)
+    y_true = (rand.rand(20000) < 0.05).astype('int32')
+    y_score = rand.randn(20000) + 2 * y_true
+    exact = DetectionEvaluator().update(y_true, y_score).compute(
+        operating_points=[(1, 1, 0.01), (1, 1, 0.5)])
+    # the first chunk only covers the lowest (or highest) scores, the
+    # inferred range must be widened by the following chunks
+    for order in (np.argsort(y_score), np.argsort(-y_score)):
+      evaluator = DetectionEvaluator(approximate=True, n_bins=4096)
+      for start in range(0, len(y_true), 3000):
+        idx = order[start:start + 3000]
+        evaluator.update(y_true[idx], y_score[idx])
+      self.assertEqual(evaluator.n_target, np.sum(y_true))
+      self.assertEqual(evaluator.n_nontarget, np.sum(1 - y_true))
+      self.assertLessEqual(evaluator.score_range[0], np.min(y_score))
+      self.assertGreaterEqual(evaluator.score_range[1], np.max(y_score))
+      results = evaluator.compute(operating_points=[(1, 1, 0.01),
+                                                    (1, 1, 0.5)])
+      self.assertAlmostEqual(results['EER'], exact['EER'], delta=2e-3)
+      for (min_dcf, _, _), (expected, _, _) in zip(results['minDCF'],
+                                                   exact['minDCF']):
+        self.assertAlmostEqual(min_dcf, expected, delta=2e-3)
+    # a given range is kept, the scores outside are clipped
+    evaluator = DetectionEvaluator(approximate=True, score_range=(-1, 1))
+    evaluator.update(y_true, y_score)
+    self.assertEqual(evaluator.score_range, (-1., 1.))
+    self.assertEqual(evaluator.n_target + evaluator.n_nontarget, len(y_true))
+
+
+if __name__ == '__main__':
+  unittest.main()
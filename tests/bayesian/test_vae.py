@@ -92,6 +92,17 @@ def create_networks():
               latents=latents)
 
 
+def create_small_vae(name):
+  vae = VariationalAutoencoder(
+      encoder=keras.Sequential([keras.layers.Dense(16, activation='relu')]),
+      decoder=keras.Sequential([keras.layers.Dense(16, activation='relu')]),
+      latents=RVmeta(2, 'mvndiag', projection=True, name='latents'),
+      observation=RVmeta(4, 'gaussian', projection=True, name='x'),
+      name=name)
+  vae.build((None, 4))
+  return vae
+
+
 # ===========================================================================
 # Tests
 # ===========================================================================
@@ -138,6 +149,59 @@ class VAETest(unittest.TestCase):
     print(mllk)
     # vae.fit(train, **fit_kw)
 
+  def test_chunked_marginal_log_prob(self):
+    tf.random.set_seed(8)
+    x = np.random.RandomState(8).rand(128, 4).astype('float32')
+    vae = create_small_vae('chunked_mllk')
+    vae.set_elbo_configs(sample_shape=2000)
+    mllk, distortion = vae.marginal_log_prob(x)
+    vae.set_elbo_configs(sample_shape=())
+    # 6 chunks of 300 and a remainder chunk of 200 samples
+    chunked_mllk, chunked_distortion = vae.chunked_marginal_log_prob(
+        x, n_samples=2000, chunk_size=300)
+    self.assertEqual(chunked_mllk.shape, mllk.shape)
+    # both are Monte-Carlo estimates with different samples, the estimate
+    # of a single example is heavy-tailed, only its average is tight
+    diff = chunked_mllk.numpy() - mllk.numpy()
+    self.assertTrue(np.abs(np.mean(diff)) < 0.05)
+    self.assertTrue(np.median(np.abs(diff)) < 0.2)
+    self.assertEqual(set(chunked_distortion.keys()), set(distortion.keys()))
+    for k, v in distortion.items():
+      self.assertTrue(np.allclose(chunked_distortion[k], v, atol=0.2))
+
+  def test_chunked_marginal_log_prob_remainder(self):
+    x = np.random.RandomState(8).rand(5, 4).astype('float32')
+    for n_samples, chunk_size in [(10, 3), (9, 3), (10, 20), (1, 1)]:
+      vae = create_small_vae('chunked_mllk_%d_%d' % (n_samples, chunk_size))
+
+      # constant importance weights, the estimate is exactly the constant
+      # only if every sample is counted once
+      def log_weights(qz_x, inputs, n, training, mask, **kwargs):
+        shape = [n, tf.shape(inputs)[0]]
+        return tf.fill(shape, 2.), {'x': tf.fill(shape, -1.)}
+
+      vae._importance_log_weights = log_weights
+      mllk, distortion = vae.chunked_marginal_log_prob(
+          x, n_samples=n_samples, chunk_size=chunk_size)
+      self.assertTrue(np.allclose(mllk, 2.))
+      self.assertTrue(np.allclose(distortion['x'], -1.))
+
+  def test_infer_latents_outputs(self):
+    x = np.random.RandomState(8).rand(37, 4).astype('float32')
+    vae = create_small_vae('infer')
+    qz = vae.encode(x, training=False)
+    # 2 full batches and the last batch of 5 padded to 8
+    z = vae.infer_latents(x, statistics=['mean', 'stddev', 'sample'],
+                          n_samples=3, batch_size=16)
+    self.assertEqual(z['mean'].shape, (37, 2))
+    self.assertEqual(z['sample'].shape, (3, 37, 2))
+    self.assertTrue(np.allclose(z['mean'], qz.mean(), atol=1e-5))
+    self.assertTrue(np.allclose(z['stddev'], qz.stddev(), atol=1e-5))
+    px = vae.decode(qz.mean(), training=False)
+    y = vae.infer_outputs(z['mean'], statistics='mean', batch_size=16)
+    self.assertEqual(y['mean'].shape, (37, 4))
+    self.assertTrue(np.allclose(y['mean'], px.mean(), atol=1e-5))
+
   # def test_all_models(self):
   #   all_vae = autoencoder.get_vae()
   #   for vae_cls in all_vae:
@@ -0,0 +1,46 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import unittest
+from tempfile import mkstemp
+
+import numpy as np
+from sklearn.decomposition import PCA
+
+from odin.ml import MiniBatchPCA
+
+np.random.seed(8)
+
+
+class DecompositionTest(unittest.TestCase):
+
+  def test_out_of_core_pca(self):
+    rand = np.random.RandomState(8)
+    x = np.dot(rand.randn(4000, 24), rand.randn(24, 24)) + 3.
+    _, path = mkstemp()
+    X = np.memmap(path, dtype='float64', mode='w+', shape=x.shape)
+    X[:] = x
+    X.flush()
+    ref = PCA(n_components=8).fit(x)
+    for algo in ('exact', 'randomized'):
+      pca = MiniBatchPCA(n_components=8, batch_size=100)
+      pca.fit_mpi(X, algo=algo, ncpu=2, iterated_power=4, random_state=8)
+      self.assertTrue(np.allclose(pca.mean_, ref.mean_))
+      self.assertTrue(
+          np.allclose(pca.explained_variance_ratio_,
+                      ref.explained_variance_ratio_,
+                      rtol=1e-4))
+      self.assertTrue(
+          np.allclose(np.abs(pca.components_),
+                      np.abs(ref.components_),
+                      atol=1e-3))
+      self.assertTrue(
+          np.allclose(np.abs(pca.transform(x)),
+                      np.abs(ref.transform(x)),
+                      atol=1e-2))
+    del X
+    os.remove(path)
+
+
+if __name__ == '__main__':
+  unittest.main()
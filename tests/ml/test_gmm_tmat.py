@@ -0,0 +1,90 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import unittest
+from tempfile import mkstemp
+
+import numpy as np
+from bigarray import MmapArray, MmapArrayWriter
+
+from odin.ml import GMM, Tmatrix
+
+np.random.seed(8)
+
+
+def _random_gmm(X, nmix, **kwargs):
+  rand = np.random.RandomState(8)
+  gmm = GMM(nmix=nmix, nmix_start=nmix, dtype='float64', device='cpu',
+            stochastic_downsample=False, **kwargs)
+  gmm.initialize(X)
+  gmm.mean = X[rand.choice(X.shape[0], nmix, replace=False)].T.copy()
+  gmm.sigma = np.var(X, axis=0, keepdims=True).T + \
+      rand.rand(X.shape[1], nmix)
+  gmm.w = rand.dirichlet(np.ones(nmix))[None, :]
+  gmm._resfresh_cpu_posterior()
+  return gmm
+
+
+class GMMTest(unittest.TestCase):
+
+  def setUp(self):
+    rand = np.random.RandomState(8)
+    self.X = np.concatenate([rand.randn(300, 6) + i * 2 for i in range(4)],
+                            axis=0)
+    _, self.path = mkstemp()
+    os.remove(self.path)
+    writer = MmapArrayWriter(path=self.path, shape=(0, self.X.shape[1]),
+                             dtype='float64', remove_exist=True)
+    writer.write(self.X)
+    writer.flush()
+    writer.close()
+
+  def tearDown(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def test_out_of_core_expectation(self):
+    X = MmapArray(self.path)
+    indices = [('a', (0, 250)), ('b', (250, 700)), ('c', (900, 1200))]
+    gmm = _random_gmm(self.X, nmix=4, batch_size_cpu=128, ncpu=3)
+    for inputs in (None, indices):
+      # in-memory E-step on a single batch
+      gmm.batch_size_cpu = self.X.shape[0]
+      ref = gmm.expectation(self.X if inputs is None else (self.X, inputs),
+                            print_progress=False)
+      # out-of-core E-step, 3 processes and multiple batches each
+      gmm.batch_size_cpu = 128
+      gmm.out_of_core = True
+      out = gmm.expectation(X if inputs is None else (X, inputs),
+                            print_progress=False)
+      gmm.out_of_core = False
+      for r, o in zip(ref, out):
+        self.assertTrue(np.allclose(r, o))
+
+  def test_gmm_partial_fit(self):
+    # a single full-batch step of stepwise EM is one EM iteration
+    batch_size = self.X.shape[0]
+    gmm1 = _random_gmm(self.X, nmix=4, niter=1, batch_size_cpu=batch_size)
+    gmm2 = _random_gmm(self.X, nmix=4, niter=1, batch_size_cpu=batch_size)
+    gmm1.fit(self.X)
+    gmm2.partial_fit(self.X)
+    for name in ('w', 'mean', 'sigma'):
+      self.assertTrue(
+          np.allclose(getattr(gmm1, name), getattr(gmm2, name)))
+
+  def test_tmatrix_partial_fit(self):
+    gmm = _random_gmm(self.X, nmix=4, batch_size_cpu=self.X.shape[0])
+    Z, F = zip(*[gmm.transform(x, device='cpu')
+                 for x in np.split(self.X, 24)])
+    Z = np.concatenate(Z, axis=0)
+    F = np.concatenate(F, axis=0)
+    tmat1 = Tmatrix(tv_dim=3, gmm=gmm, niter=1, device='cpu', name='tmat1')
+    tmat2 = Tmatrix(tv_dim=3, gmm=gmm, niter=1, device='cpu', name='tmat2')
+    self.assertTrue(np.all(tmat1.Tm == tmat2.Tm))
+    tmat1.fit((Z, F))
+    tmat2.partial_fit((Z, F))
+    self.assertTrue(np.allclose(tmat1.Tm, tmat2.Tm))
+
+
+if __name__ == '__main__':
+  unittest.main()
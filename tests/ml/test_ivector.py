@@ -0,0 +1,81 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+from bigarray import MmapArray
+
+from odin.ml import GMM
+from odin.ml.ivector import _extract_zero_and_first_stats
+
+np.random.seed(8)
+
+
+class IvectorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.path = mkdtemp()
+    rand = np.random.RandomState(8)
+    self.X = rand.randn(1000, 5) + rand.randint(0, 4, size=(1000, 1)) * 2
+    self.sad = rand.rand(1000) > 0.2
+    gmm = GMM(nmix=4, nmix_start=4, dtype='float64', device='cpu',
+              batch_size_cpu=64)
+    gmm.initialize(self.X)
+    gmm.mean = self.X[rand.choice(1000, 4, replace=False)].T.copy()
+    gmm.sigma = np.var(self.X, axis=0, keepdims=True).T + rand.rand(5, 4)
+    gmm.w = rand.dirichlet(np.ones(4))[None, :]
+    gmm._resfresh_cpu_posterior()
+    self.gmm = gmm
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def extract(self, sad, indices):
+    z_path = os.path.join(self.path, 'Z')
+    f_path = os.path.join(self.path, 'F')
+    name_path = os.path.join(self.path, 'name')
+    _extract_zero_and_first_stats(self.X, sad, indices, self.gmm,
+                                  z_path, f_path, name_path)
+    return np.array(MmapArray(z_path)), np.array(MmapArray(f_path))
+
+  def test_batched_stats_per_row(self):
+    for sad in (None, self.sad):
+      Z, F = self.extract(sad, None)
+      self.assertEqual(Z.shape, (1000, 4))
+      self.assertEqual(F.shape, (1000, 20))
+      for i, x in enumerate(self.X):
+        if sad is not None and not sad[i]:
+          continue
+        z, f = self.gmm.transform(x[np.newaxis, :], device='cpu')
+        self.assertTrue(np.allclose(Z[i], z.ravel(), rtol=1e-4, atol=1e-5))
+        self.assertTrue(np.allclose(F[i], f.ravel(), rtol=1e-4, atol=1e-5))
+
+  def test_batched_stats_indices(self):
+    # segments span multiple blocks, and blocks hold multiple segments
+    ends = np.cumsum([7, 150, 30, 3, 90, 64, 256, 1, 120, 279])
+    indices = [('utt%d' % i, (int(s), int(e)))
+               for i, (s, e) in enumerate(zip(np.r_[0, ends[:-1]], ends))]
+    # the tail of utt2 is removed by SAD
+    sad = self.sad.copy()
+    sad[170:187] = False
+    for sad in (None, sad):
+      # the Mapping is sorted by the start index
+      Z, F = self.extract(sad, dict(indices[::-1]))
+      self.assertEqual(Z.shape, (len(indices), 4))
+      self.assertEqual(
+          np.genfromtxt(os.path.join(self.path, 'name'), dtype=str).tolist(),
+          [name for name, _ in indices])
+      for i, (name, (start, end)) in enumerate(indices):
+        x = self.X[start:end]
+        if sad is not None:
+          x = x[sad[start:end]]
+        z, f = self.gmm.transform(x, device='cpu')
+        self.assertTrue(np.allclose(Z[i], z.ravel(), rtol=1e-4, atol=1e-4))
+        self.assertTrue(np.allclose(F[i], f.ravel(), rtol=1e-4, atol=1e-4))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+
+from odin.ml import PLDA, ScoreNormalizer, Scorer, score_trial_list
+
+np.random.seed(8)
+
+
+def _full_scores(model, enroll, test):
+  """ Return: score matrix [nb_enroll, nb_test] """
+  if isinstance(model, PLDA):
+    return model.predict_log_proba(test, X_model=enroll).T
+  enroll = model.normalizer.transform(enroll)
+  test = model.normalizer.transform(test)
+  return np.dot(enroll, test.T)
+
+
+def _cohort_stats(scores, top_k):
+  """ Return: mean and std of each row of `scores` [n, nb_cohort] """
+  if top_k is not None:
+    scores = np.sort(scores, axis=1)[:, ::-1][:, :top_k]
+  return np.mean(scores, axis=1), np.std(scores, axis=1)
+
+
+class ScoringTest(unittest.TestCase):
+
+  def setUp(self):
+    self.path = mkdtemp()
+    rand = np.random.RandomState(8)
+    centers = rand.randn(10, 20) * 3
+    y = np.repeat(np.arange(10), 30)
+    X = centers[y] + rand.randn(300, 20)
+    plda = PLDA(n_phi=8, n_iter=10, random_state=8)
+    plda.fit(X, y)
+    self.models = [plda, Scorer(wccn=True, lda=True).fit(X, y)]
+    self.enroll = centers + rand.randn(10, 20)
+    self.test = centers[rand.randint(0, 10, size=40)] + rand.randn(40, 20)
+    self.enroll_ids = ['spk%d' % i for i in range(10)]
+    self.test_ids = ['utt%d' % i for i in range(40)]
+    self.trials = [(self.enroll_ids[i], self.test_ids[j])
+                   for i, j in zip(rand.randint(0, 10, size=150),
+                                   rand.randint(0, 40, size=150))]
+    self.trials += [('spk0', 'unknown'), ('unknown', 'utt0')]
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def lookup(self, scores):
+    enroll_map = {i: n for n, i in enumerate(self.enroll_ids)}
+    test_map = {i: n for n, i in enumerate(self.test_ids)}
+    return np.array([scores[enroll_map[e], test_map[t]]
+                     for e, t in self.trials[:-2]])
+
+  def test_score_trial_list(self):
+    enroll = (self.enroll_ids, self.enroll)
+    test = dict(zip(self.test_ids, self.test))
+    for model in self.models:
+      ref = self.lookup(_full_scores(model, self.enroll, self.test))
+      # dense GEMM blocks and row-wise dot products
+      for dense_ratio in (0., 1e8):
+        scores = score_trial_list(model, enroll, test, self.trials,
+                                  chunk_size=16, dense_ratio=dense_ratio)
+        self.assertEqual(scores.shape, (len(self.trials),))
+        self.assertTrue(np.all(np.isnan(scores[-2:])))
+        self.assertTrue(np.allclose(scores[:-2], ref, rtol=1e-4, atol=1e-4))
+      # trial file in, score file out
+      trial_path = os.path.join(self.path, 'trials')
+      score_path = os.path.join(self.path, 'scores')
+      with open(trial_path, 'w') as f:
+        f.write('enroll test\n')
+        f.write(''.join('%s %s target\n' % t for t in self.trials))
+      model.score_trials(enroll, test, trial_path, path=score_path,
+                         chunk_size=16, header=True)
+      with open(score_path, 'r') as f:
+        lines = [line.split('\t') for line in f]
+      self.assertEqual([tuple(l[:2]) for l in lines], self.trials)
+      scores = np.array([float(l[2]) for l in lines])
+      self.assertTrue(np.allclose(scores[:-2], ref, rtol=1e-4, atol=1e-4))
+
+  def test_score_normalization(self):
+    cohort = np.random.RandomState(12).randn(60, 20) * 3
+    enroll = dict(zip(self.enroll_ids, self.enroll))
+    test = (self.test_ids, self.test)
+    for model in self.models:
+      scores = _full_scores(model, self.enroll, self.test)
+      for top_k in (None, 10):
+        mu_e, sd_e = _cohort_stats(
+            _full_scores(model, self.enroll, cohort), top_k)
+        mu_t, sd_t = _cohort_stats(
+            _full_scores(model, cohort, self.test).T, top_k)
+        ref = self.lookup(0.5 * ((scores - mu_e[:, None]) / sd_e[:, None] +
+                                 (scores - mu_t[None, :]) / sd_t[None, :]))
+        normalizer = ScoreNormalizer(model, top_k=top_k, block_size=7)
+        normalizer.fit(cohort)
+        # the second call uses the cached cohort statistics
+        for _ in range(2):
+          norm = normalizer.score_trials(enroll, test, self.trials,
+                                         chunk_size=16)
+          self.assertTrue(np.all(np.isnan(norm[-2:])))
+          self.assertTrue(np.allclose(norm[:-2], ref, rtol=1e-4, atol=1e-4))
+
+
+if __name__ == '__main__':
+  unittest.main()
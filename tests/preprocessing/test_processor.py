@@ -0,0 +1,106 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+
+from odin.fuel.dataset import PROCESSOR_CHECKPOINT, Dataset
+from odin.preprocessing.base import Extractor
+from odin.preprocessing.processor import FeatureProcessor
+
+np.random.seed(8)
+
+
+class _RowsExtractor(Extractor):
+  """ Job `i` returns `i + 1` rows filled with `i`, raise at `crash_at` """
+
+  def __init__(self, crash_at=None):
+    super(_RowsExtractor, self).__init__(is_input_layer=True, name='rows')
+    self.crash_at = crash_at
+
+  def _transform(self, i):
+    if i == self.crash_at:
+      raise RuntimeError("Crash at job: %d" % i)
+    x = np.full((i + 1, 3), i, dtype='float64')
+    return {'name': 'file%d' % i, 'x': x,
+            'x_sum1': np.sum(x, 0), 'x_sum2': np.sum(x**2, 0)}
+
+
+def _run(jobs, path, crash_at=None, resume=True, override=False):
+  return FeatureProcessor(jobs=jobs,
+                          path=path,
+                          extractor=_RowsExtractor(crash_at),
+                          n_cache=2,
+                          ncpu=1,
+                          override=override,
+                          stop_on_failure=True,
+                          resume=resume,
+                          keep_order=True).run()
+
+
+class FeatureProcessorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.path = mkdtemp()
+    self.jobs = list(range(10))
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def check_dataset(self, jobs=None):
+    jobs = self.jobs if jobs is None else jobs
+    ds = Dataset(self.path, read_only=True)
+    indices = dict(ds['indices_x'].items())
+    self.assertEqual(sorted(indices.keys()),
+                     sorted('file%d' % i for i in jobs))
+    self.assertEqual(ds['x'].shape[0], sum(i + 1 for i in jobs))
+    for name, (start, end) in indices.items():
+      i = int(name[4:])
+      self.assertEqual(end - start, i + 1)
+      self.assertTrue(np.all(ds['x'][start:end] == i))
+    x = ds['x'][:]
+    self.assertTrue(np.allclose(ds['x_mean'], np.mean(x, 0)))
+    self.assertTrue(np.allclose(ds['x_std'], np.std(x, 0)))
+    ds.close()
+
+  def test_crash_and_resume(self):
+    with self.assertRaises(RuntimeError):
+      _run(self.jobs, self.path, crash_at=7)
+    self.assertTrue(
+        os.path.exists(os.path.join(self.path, PROCESSOR_CHECKPOINT)))
+    _run(self.jobs, self.path)
+    self.assertFalse(
+        os.path.exists(os.path.join(self.path, PROCESSOR_CHECKPOINT)))
+    self.check_dataset()
+
+  def test_crash_before_first_commit(self):
+    with self.assertRaises(RuntimeError):
+      _run(self.jobs, self.path, crash_at=1)
+    _run(self.jobs, self.path)
+    self.check_dataset()
+
+  def test_append_without_override(self):
+    _run(self.jobs[:4], self.path)
+    self.check_dataset(self.jobs[:4])
+    _run(self.jobs[4:], self.path)
+    self.check_dataset()
+    # only the features of the last run are kept
+    _run(self.jobs[:3], self.path, override=True)
+    self.check_dataset(self.jobs[:3])
+
+  def test_restart_without_resume(self):
+    _run(self.jobs[:4], self.path)
+    with self.assertRaises(RuntimeError):
+      _run(self.jobs[4:], self.path, crash_at=7)
+    # drop all the data of the crashed run, but not of the finished one
+    _run(self.jobs[4:], self.path, resume=False)
+    self.assertFalse(
+        os.path.exists(os.path.join(self.path, PROCESSOR_CHECKPOINT)))
+    self.check_dataset()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,45 +1,129 @@
 from __future__ import absolute_import, division, print_function
 
-import itertools
-import os
+import unittest
 
 import numpy as np
-import tensorflow as tf
 
-from odin.search import (diagonal_beam_search, diagonal_bruteforce_search,
-                         diagonal_greedy_search, diagonal_hillclimb_search)
-from odin.utils import UnitTimer
+from odin.search import (diagonal_beam_search, diagonal_beam_search_batch,
+                         diagonal_bruteforce_search,
+                         diagonal_bruteforce_search_batch,
+                         diagonal_greedy_search, diagonal_greedy_search_batch,
+                         diagonal_hillclimb_search, diagonal_linear_assignment)
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'true'
-
-tf.random.set_seed(8)
 np.random.seed(8)
 
-shape = (8, 8)
-mat = np.random.randint(0, 88, size=shape)
-print(mat)
-
-with UnitTimer():
-  ids = diagonal_beam_search(mat)
-print(ids)
-print(mat[:, ids])
-print(np.sum(np.diag(mat[:, ids])))
-
-with UnitTimer():
-  ids = diagonal_hillclimb_search(mat)
-print(ids)
-print(mat[:, ids])
-print(np.sum(np.diag(mat[:, ids])))
-
-with UnitTimer():
-  ids = diagonal_greedy_search(mat)
-print(ids)
-print(mat[:, ids])
-print(np.sum(np.diag(mat[:, ids])))
-
-with UnitTimer():
-  ids = diagonal_bruteforce_search(mat)
-print(ids)
-print(mat[:, ids])
-print(np.sum(np.diag(mat[:, ids])))
+
+def _beam_search_reference(matrix, beam_size=-1):
+  """ The pure python beam search before it was compiled by numba """
+  ncol = matrix.shape[1]
+  min_dim = min(matrix.shape)
+  if beam_size <= 0:
+    beam_size = ncol
+  beam_seq = np.empty(shape=(beam_size, ncol), dtype=np.int64)
+  beam_score = [0. for i in range(beam_size)]
+  step_score = np.empty(shape=(beam_size * ncol, ncol + 1), dtype=np.float64)
+  # first row
+  order = np.argsort(matrix[0])[::-1]
+  beam_seq[:, 0] = order[:beam_size]
+  beam_score[:] = matrix[0][beam_seq[:, 0]]
+  # iterate each column
+  for i in range(1, min_dim):
+    row = matrix[i]
+    order = np.argsort(row)[::-1]
+    n = 0
+    for beam, score in zip(beam_seq, beam_score):
+      for col_idx in order:
+        if col_idx not in beam[:i]:
+          step_score[n, :ncol] = beam
+          step_score[n, i] = col_idx
+          step_score[n, -1] = score + row[col_idx]
+          n += 1
+    # best solutions
+    for j, beam in enumerate(
+        sorted(step_score[:n], key=lambda x: x[-1], reverse=True)[:beam_size]):
+      beam_seq[j] = beam[:ncol]
+      beam_score[j] = beam[-1]
+  # add the last dimensions
+  if min_dim < ncol:
+    for beam in beam_seq:
+      idx = min_dim
+      for i in range(ncol):
+        if i not in beam[:idx]:
+          beam[idx] = i
+          idx += 1
+  return [int(i) for i in beam_seq[0]]
+
+
+def _diag_sum(matrix, ids):
+  return np.sum(np.diag(matrix[:, ids]))
+
+
+class SearchTest(unittest.TestCase):
+
+  def assertPermutation(self, ids, ncol):
+    self.assertEqual(sorted(int(i) for i in ids), list(range(ncol)))
+
+  def test_square_permutation(self):
+    mat = np.random.rand(8, 8)
+    for search in (diagonal_beam_search, diagonal_hillclimb_search,
+                   diagonal_greedy_search, diagonal_bruteforce_search,
+                   diagonal_linear_assignment):
+      self.assertPermutation(search(mat), 8)
+    self.assertPermutation(diagonal_bruteforce_search(mat, pruning=True), 8)
+    mats = np.random.rand(16, 8, 8)
+    for search in (diagonal_beam_search_batch, diagonal_greedy_search_batch,
+                   diagonal_bruteforce_search_batch):
+      for ids in search(mats):
+        self.assertPermutation(ids, 8)
+
+  def test_branch_and_bound(self):
+    for shape in ((8, 8), (6, 8), (8, 6), (7, 7)):
+      for _ in range(5):
+        mat = np.random.rand(*shape)
+        ids = diagonal_bruteforce_search(mat, pruning=True)
+        # the order of the columns out of the diagonal is arbitrary
+        k = min(shape)
+        self.assertEqual(ids[:k], list(diagonal_bruteforce_search(mat))[:k])
+        self.assertPermutation(ids, shape[1])
+    # larger than practical for Heap's algorithm, but still exact
+    for _ in range(5):
+      mat = np.random.rand(14, 14)
+      ids = diagonal_bruteforce_search(mat, pruning=True)
+      self.assertAlmostEqual(_diag_sum(mat, ids),
+                             _diag_sum(mat, diagonal_linear_assignment(mat)))
+
+  def test_beam_search(self):
+    for shape in ((8, 8), (6, 10), (10, 6)):
+      for beam_size in (1, 3, -1):
+        for _ in range(5):
+          mat = np.random.rand(*shape)
+          self.assertEqual(diagonal_beam_search(mat, beam_size=beam_size),
+                           _beam_search_reference(mat, beam_size=beam_size))
+    mat = np.random.rand(8, 8)
+    self.assertEqual(diagonal_hillclimb_search(mat),
+                     _beam_search_reference(mat, beam_size=1))
+
+  def test_batch(self):
+    for shape in ((32, 8, 8), (32, 6, 8), (32, 8, 6)):
+      mats = np.random.rand(*shape)
+      ids = diagonal_beam_search_batch(mats, beam_size=4)
+      self.assertEqual(ids.shape, (shape[0], shape[2]))
+      for m, i in zip(mats, ids):
+        self.assertEqual(i.tolist(), diagonal_beam_search(m, beam_size=4))
+      ids = diagonal_bruteforce_search_batch(mats)
+      self.assertEqual(ids.shape, (shape[0], shape[2]))
+      for m, i in zip(mats, ids):
+        self.assertEqual(i.tolist(),
+                         diagonal_bruteforce_search(m, pruning=True))
+    # the batched greedy search only considers the first `m` rows of tall
+    # matrices
+    for shape in ((32, 8, 8), (32, 6, 8)):
+      mats = np.random.rand(*shape)
+      ids = diagonal_greedy_search_batch(mats)
+      self.assertEqual(ids.shape, (shape[0], shape[2]))
+      for m, i in zip(mats, ids):
+        self.assertEqual(i.tolist(), diagonal_greedy_search(m))
+
+
+if __name__ == '__main__':
+  unittest.main()
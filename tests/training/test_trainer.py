@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+import tensorflow as tf
+
+from odin.training.trainer import Trainer
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+np.random.seed(8)
+
+
+def _checkpoints(path):
+  state = tf.train.get_checkpoint_state(path)
+  return [os.path.basename(p) for p in state.all_model_checkpoint_paths]
+
+
+class CheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.path = mkdtemp()
+
+  def tearDown(self):
+    Trainer.wait_for_checkpoints()
+    shutil.rmtree(self.path)
+
+  def test_async_checkpoint(self):
+    sync_path = os.path.join(self.path, 'sync')
+    async_path = os.path.join(self.path, 'async')
+    w = tf.Variable(np.zeros((8, 4), dtype='float32'))
+    b = tf.Variable(np.zeros((4,), dtype='float32'))
+    for _ in range(2):
+      w.assign(np.random.rand(8, 4))
+      b.assign(np.random.rand(4))
+      self.assertTrue(
+          Trainer.save_checkpoint(sync_path, models=[w, b], max_to_keep=1))
+      self.assertTrue(
+          Trainer.save_checkpoint(async_path,
+                                  models=[w, b],
+                                  max_to_keep=1,
+                                  async_save=True))
+    weights = [w.numpy(), b.numpy()]
+    # the snapshot is not affected by the following updates
+    w.assign(np.zeros((8, 4)))
+    b.assign(np.zeros((4,)))
+    Trainer.wait_for_checkpoints(async_path)
+    # same numbering, pruning and files as `CheckpointManager.save`
+    self.assertEqual(_checkpoints(async_path), ['ckpt-2'])
+    self.assertEqual(_checkpoints(async_path), _checkpoints(sync_path))
+    self.assertEqual(sorted(os.listdir(async_path)),
+                     sorted(os.listdir(sync_path)))
+    self.assertEqual(Trainer.checkpoint_latency(async_path)['n_saves'], 2)
+    # skipped by `min_interval`
+    self.assertFalse(
+        Trainer.save_checkpoint(async_path,
+                                models=[w, b],
+                                max_to_keep=1,
+                                async_save=True,
+                                min_interval=3600))
+    Trainer.wait_for_checkpoints(async_path)
+    self.assertEqual(_checkpoints(async_path), ['ckpt-2'])
+    # restore the cached checkpoint
+    Trainer.restore_checkpoint(async_path, models=[w, b])
+    self.assertTrue(np.all(w.numpy() == weights[0]))
+    self.assertTrue(np.all(b.numpy() == weights[1]))
+    # restore from the files to new variables
+    w1 = tf.Variable(np.zeros((8, 4), dtype='float32'))
+    b1 = tf.Variable(np.zeros((4,), dtype='float32'))
+    models, optimizers, trainer = Trainer.restore_checkpoint(async_path,
+                                                             models=[w1, b1])
+    self.assertEqual(len(models), 2)
+    self.assertEqual(len(optimizers), 0)
+    self.assertIsNone(trainer)
+    self.assertTrue(np.all(w1.numpy() == weights[0]))
+    self.assertTrue(np.all(b1.numpy() == weights[1]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,159 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import multiprocessing
+import shutil
+import threading
+import unittest
+from tempfile import mkstemp
+from unittest import mock
+
+import numpy as np
+
+from odin.fuel.databases import MmapDict, SQLiteDict
+
+np.random.seed(8)
+
+
+def _temp_path(suffix):
+  fd, path = mkstemp(suffix=suffix)
+  os.close(fd)
+  os.remove(path)
+  return path
+
+
+class DatabasesTest(unittest.TestCase):
+
+  def test_mmapdict_binary_index(self):
+    path = _temp_path('.mmapdict')
+    ref = {}
+    db = MmapDict(path, cache_size=16)
+    for i in range(800):
+      key = 'key%d' % np.random.randint(0, 300)
+      db[key] = i
+      ref[key] = i
+      if i % 50 == 0:
+        db.flush(save_all=True)
+    for key in list(ref.keys())[:25]:
+      del db[key]
+      del ref[key]
+    self.assertEqual(dict(db.items()), ref)
+    db.close()
+    # reopen, the index is memory-mapped
+    db = MmapDict(path, read_only=True)
+    self.assertEqual(len(db), len(ref))
+    self.assertEqual(dict(db.items()), ref)
+    for key, val in ref.items():
+      self.assertEqual(db[key], val)
+    self.assertTrue('key301' not in db)
+    db.close()
+    # compaction reclaims old indices and overwritten values
+    size = os.path.getsize(path)
+    db = MmapDict(path)
+    reclaimed = db.compact()
+    self.assertGreater(reclaimed, 0)
+    self.assertEqual(os.path.getsize(path), size - reclaimed)
+    self.assertEqual(dict(db.items()), ref)
+    db['new'] = 'value'
+    # flush without writing the index, the index is not loaded into memory
+    db.flush()
+    self.assertFalse(db.indices._records.flags.owndata)
+    self.assertEqual(db['new'], 'value')
+    db.close()
+    ref['new'] = 'value'
+    db = MmapDict(path, read_only=True)
+    self.assertEqual(dict(db.items()), ref)
+    db.close()
+    os.remove(path)
+
+  def test_mmapdict_crash_safety(self):
+    path = _temp_path('.mmapdict')
+    db = MmapDict(path)
+    old = {'key%d' % i: i for i in range(20)}
+    for key, val in old.items():
+      db[key] = val
+    db.flush(save_all=True)
+    new = dict(old)
+    for i in range(10, 40):
+      db['key%d' % i] = -i
+      new['key%d' % i] = -i
+    # snapshot the file at each sync point, i.e. a crash right after it
+    snapshots = []
+    fsync = os.fsync
+
+    def snapshot_fsync(fd):
+      fsync(fd)
+      snapshots.append(_temp_path('.mmapdict'))
+      shutil.copyfile(path, snapshots[-1])
+
+    with mock.patch('os.fsync', snapshot_fsync):
+      db.flush(save_all=True)
+    db.close()
+    # values and index are written, but the header is still the old one
+    self.assertEqual(len(snapshots), 2)
+    for snapshot, ref in zip(snapshots, (old, new)):
+      db = MmapDict(snapshot, read_only=True)
+      self.assertEqual(dict(db.items()), ref)
+      db.close()
+      # appending after the crash never overwrites the saved index
+      db = MmapDict(snapshot)
+      db['appended'] = 'value'
+      db.flush(save_all=True)
+      db.close()
+      db = MmapDict(snapshot, read_only=True)
+      self.assertEqual(dict(db.items()), dict(ref, appended='value'))
+      db.close()
+      os.remove(snapshot)
+    os.remove(path)
+
+  def test_get_many(self):
+    for cls in (MmapDict, SQLiteDict):
+      path = _temp_path('.db')
+      db = cls(path, cache_size=2000)
+      ref = {'key%d' % i: i for i in range(2500)}
+      for key, val in ref.items():
+        db[key] = val
+      db['key7'] = 'cached'
+      ref['key7'] = 'cached'
+      keys = list(np.random.choice(list(ref.keys()), size=1200))
+      self.assertEqual(db.get_many(keys), [ref[k] for k in keys])
+      self.assertEqual(db[keys] if cls is SQLiteDict else db.get_many(keys),
+                       [ref[k] for k in keys])
+      with self.assertRaises(KeyError):
+        db.get_many(['key1', 'not_exist'])
+      db.close()
+      os.remove(path)
+
+  def test_sqlitedict_concurrent(self):
+    path = _temp_path('.db')
+    db = SQLiteDict(path, concurrent=True)
+    ref = {'key%d' % i: i for i in range(1000)}
+    for key, val in ref.items():
+      db[key] = val
+    db.as_table('extra')['a'] = 1
+    db.close()
+    reader = SQLiteDict(path, read_only=True, concurrent=True)
+    self.assertEqual(len(reader), len(ref))
+    # read from other threads
+    results = {}
+
+    def read(i):
+      results[i] = reader.get_many(['key%d' % j for j in range(i, 1000, 8)])
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    for i in range(8):
+      self.assertEqual(results[i], list(range(i, 1000, 8)))
+    # read from forked processes after the parent used the connection
+    if 'fork' in multiprocessing.get_all_start_methods():
+      ctx = multiprocessing.get_context('fork')
+      with ctx.Pool(2) as pool:
+        self.assertEqual(pool.map(reader.__getitem__, ['key1', 'key999']),
+                         [1, 999])
+    reader.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+  unittest.main()
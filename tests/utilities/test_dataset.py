@@ -0,0 +1,76 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+
+from odin.fuel.databases import MmapDict
+from odin.fuel.dataset import DATASET_MANIFEST, Dataset, _LazyData
+
+np.random.seed(8)
+
+
+def _write_pickle(path, obj):
+  with open(path, 'wb') as f:
+    pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class DatasetTest(unittest.TestCase):
+
+  def setUp(self):
+    self.root = mkdtemp()
+    self.path = os.path.join(self.root, 'ds')
+    os.mkdir(self.path)
+    self.x = np.random.rand(12, 8)
+    _write_pickle(os.path.join(self.path, 'x'), self.x)
+    db = MmapDict(os.path.join(self.path, 'indices'))
+    db['a'] = (0, 5)
+    db['b'] = (5, 12)
+    db.flush(save_all=True)
+    db.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_lazy_loading_and_manifest(self):
+    manifest = os.path.join(self.path, DATASET_MANIFEST)
+    ds = Dataset(self.path)
+    self.assertTrue(isinstance(ds._data_map['x'][2], _LazyData))
+    self.assertTrue(np.all(ds['x'] == self.x))
+    self.assertFalse(isinstance(ds._data_map['x'][2], _LazyData))
+    self.assertEqual(dict(ds['indices'].items()), {'a': (0, 5), 'b': (5, 12)})
+    ds.close()
+    self.assertTrue(os.path.isfile(manifest))
+    # unchanged folder, the manifest is not rewritten
+    mtime = os.stat(manifest).st_mtime_ns
+    ds = Dataset(self.path)
+    self.assertTrue(np.all(ds['x'] == self.x))
+    ds.close()
+    self.assertEqual(os.stat(manifest).st_mtime_ns, mtime)
+    # modified file invalidates its cached descriptor
+    y = np.arange(24).reshape(4, 6)
+    _write_pickle(os.path.join(self.path, 'x'), y)
+    ds = Dataset(self.path)
+    self.assertTrue(np.all(ds['x'] == y))
+    ds.close()
+    # the manifest is still valid after the folder is moved
+    new_path = os.path.join(self.root, 'moved')
+    os.rename(self.path, new_path)
+    ds = Dataset(new_path)
+    self.assertTrue(np.all(ds['x'] == y))
+    self.assertEqual(dict(ds['indices'].items()), {'a': (0, 5), 'b': (5, 12)})
+    ds.close()
+
+  def test_read_only_manifest(self):
+    ds = Dataset(self.path, read_only=True)
+    self.assertTrue(np.all(ds['x'] == self.x))
+    ds.close()
+    self.assertFalse(os.path.exists(os.path.join(self.path, DATASET_MANIFEST)))
+
+
+if __name__ == '__main__':
+  unittest.main()
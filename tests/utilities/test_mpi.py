@@ -0,0 +1,215 @@
+from __future__ import absolute_import, division, print_function
+
+import functools
+import os
+import shutil
+import signal
+import unittest
+from collections import defaultdict, namedtuple
+from tempfile import mkdtemp
+
+import numpy as np
+
+from odin.utils.mpi import MPI, SharedMemoryRing, WorkerPool, get_worker_pool
+
+np.random.seed(8)
+
+_Stats = namedtuple('_Stats', ['mean', 'std'])
+
+
+def _map_func(idx):
+  return {
+      'name': str(idx),
+      'X': np.full((1000, 20), idx, dtype='float32'),
+      'small': np.arange(3) * idx,
+      'meta': (idx, [np.full((300,), idx, dtype='int64')]),
+  }
+
+
+def _batch_map_func(jobs):
+  for idx in jobs:
+    yield _map_func(idx)
+
+
+def _container_map_func(idx):
+  counts = defaultdict(list)
+  counts['X'].append(np.full((500,), idx, dtype='float32'))
+  return {
+      'name': str(idx),
+      'counts': counts,
+      'stats': _Stats(np.full((400,), idx, dtype='float64'),
+                      np.full((400,), -idx, dtype='float64')),
+  }
+
+
+def _pid_map_func(idx):
+  return {'name': str(idx), 'pid': os.getpid()}
+
+
+def _die_once_map_func(jobs, path):
+  """ The worker processing job `3` exits the first time it is called """
+  if 3 in jobs and not os.path.exists(path):
+    with open(path, 'w'):
+      pass
+    os._exit(1)
+  return _batch_map_func(jobs)
+
+
+def _timeout(seconds):
+  """ Fail the test instead of hanging when the workers died silently """
+
+  def decorator(test):
+
+    @functools.wraps(test)
+    def wrapper(*args, **kwargs):
+
+      def handler(signum, frame):
+        raise RuntimeError("Test timeout after %d(s)" % seconds)
+
+      old_handler = signal.signal(signal.SIGALRM, handler)
+      signal.alarm(seconds)
+      try:
+        return test(*args, **kwargs)
+      finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+    return wrapper
+
+  return decorator
+
+
+class MPITest(unittest.TestCase):
+
+  def test_shm_ring(self):
+    ring = SharedMemoryRing(n_slots=2, slot_size=1024 * 1024)
+    for i in range(5):
+      msg = ring.encode(_map_func(i))
+      self.assertIsNotNone(msg[0])
+      r = ring.decode(msg)
+      self.assertTrue(np.all(r['X'] == i))
+      self.assertTrue(np.all(r['meta'][1][0] == i))
+      self.assertEqual(r['meta'][0], i)
+    # too big for a slot, fallback to pickle
+    x = np.ones((1024, 1024), dtype='float32')
+    msg = ring.encode({'X': x})
+    self.assertIsNone(msg[0])
+    ring.close()
+
+  def test_shm_backend(self):
+    jobs = list(range(48))
+    results = {}
+    for backend in ('python', 'shm'):
+      mpi = MPI(jobs=jobs, func=_map_func, ncpu=2, batch=1, hwm=4,
+                backend=backend)
+      results[backend] = sorted(mpi, key=lambda r: int(r['name']))
+    self.assertEqual(len(results['python']), len(results['shm']))
+    for r1, r2 in zip(results['python'], results['shm']):
+      self.assertEqual(r1['name'], r2['name'])
+      self.assertTrue(np.all(r1['X'] == r2['X']))
+      self.assertTrue(np.all(r1['small'] == r2['small']))
+      self.assertTrue(np.all(r1['meta'][1][0] == r2['meta'][1][0]))
+
+  def test_shm_containers(self):
+    ring = SharedMemoryRing(n_slots=2, slot_size=1024 * 1024)
+    slot, skeleton = ring.encode(_container_map_func(3))
+    self.assertIsNotNone(slot)
+    # all arrays are in the slot, none of them is pickled with the skeleton
+    self.assertIsInstance(skeleton['counts'], defaultdict)
+    self.assertIsInstance(skeleton['stats'], _Stats)
+    self.assertFalse(isinstance(skeleton['stats'].mean, np.ndarray))
+    self.assertFalse(isinstance(skeleton['counts']['X'][0], np.ndarray))
+    ring.decode((slot, skeleton))
+    ring.close()
+    # through the shm backend
+    jobs = list(range(12))
+    mpi = MPI(jobs=jobs, func=_container_map_func, ncpu=2, batch=1,
+              backend='shm')
+    results = sorted(mpi, key=lambda r: int(r['name']))
+    self.assertEqual(len(results), len(jobs))
+    for idx, r in zip(jobs, results):
+      self.assertIsInstance(r['counts'], defaultdict)
+      self.assertEqual(r['counts'].default_factory, list)
+      self.assertTrue(np.all(r['counts']['X'][0] == idx))
+      self.assertIsInstance(r['stats'], _Stats)
+      self.assertTrue(np.all(r['stats'].mean == idx))
+      self.assertTrue(np.all(r['stats'].std == -idx))
+
+  @_timeout(120)
+  def test_work_stealing(self):
+    # one very expensive job and many cheap ones
+    costs = [50] + [1] * 40
+    jobs = list(range(len(costs)))
+    for scheduler in ('queue', 'steal'):
+      mpi = MPI(jobs=jobs, func=_batch_map_func, ncpu=2, batch=3, hwm=4,
+                costs=costs, scheduler=scheduler)
+      names = sorted(int(r['name']) for r in mpi)
+      self.assertEqual(names, jobs)
+      stats = mpi.stats
+      self.assertEqual(sum(s['n_jobs'] for s in stats), len(jobs))
+      self.assertEqual(sum(s['cost'] for s in stats), sum(costs))
+      self.assertTrue(all(0 <= s['utilisation'] <= 1 for s in stats))
+
+  @_timeout(120)
+  def test_worker_pool(self):
+    pool = WorkerPool(ncpu=2, start_method='spawn')
+    tmpdir = mkdtemp()
+    try:
+      jobs = list(range(20))
+      # ordered results
+      results = pool.map(_map_func, jobs)
+      self.assertEqual([int(r['name']) for r in results], jobs)
+      # reuse the same processes for MPI
+      pids = [p.pid for p in pool._workers]
+      for _ in range(2):
+        mpi = MPI(jobs=jobs, func=_batch_map_func, ncpu=2, batch=4,
+                  pool=pool)
+        self.assertEqual(sorted(int(r['name']) for r in mpi), jobs)
+      self.assertEqual(pids, [p.pid for p in pool._workers])
+      # dead worker is replaced
+      pool._workers[0].terminate()
+      pool._workers[0].join()
+      self.assertEqual(pool.health_check(), [0])
+      self.assertEqual(len(pool.map(_map_func, jobs)), len(jobs))
+      # worker died in the middle of a call, its tasks are re-submitted
+      n_replaced = pool.n_replaced
+      func = functools.partial(_die_once_map_func,
+                               path=os.path.join(tmpdir, 'died'))
+      results = pool.map(func, jobs, batch=4)
+      self.assertEqual([int(r['name']) for r in results], jobs)
+      self.assertEqual(pool.n_replaced, n_replaced + 1)
+      # closure cannot be sent to the pool
+      with self.assertRaises(ValueError):
+        pool.map(lambda x: x, jobs)
+      # a call only uses the given number of workers
+      results = pool.map(_pid_map_func, jobs, ncpu=1)
+      self.assertEqual(set(r['pid'] for r in results), {pool._workers[0].pid})
+      # a partially consumed iterator doesn't block the pool, it is
+      # cancelled by the next call
+      it = pool.imap(_map_func, jobs)
+      next(it)
+      self.assertEqual(len(pool.map(_map_func, jobs)), len(jobs))
+      with self.assertRaises(RuntimeError):
+        list(it)
+    finally:
+      pool.close()
+      shutil.rmtree(tmpdir)
+
+  @_timeout(120)
+  def test_shared_worker_pool(self):
+    pool = get_worker_pool(ncpu=2, start_method='spawn')
+    try:
+      # the pool is reused by calls with any number of jobs
+      for n in (3, 20, 1):
+        jobs = list(range(n))
+        mpi = MPI(jobs=jobs, func=_batch_map_func, ncpu=2, batch=2,
+                  pool=True)
+        self.assertEqual(sorted(int(r['name']) for r in mpi), jobs)
+        self.assertIs(get_worker_pool(), pool)
+        self.assertFalse(pool.closed)
+    finally:
+      pool.close()
+
+
+if __name__ == '__main__':
+  unittest.main()